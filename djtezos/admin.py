@@ -2,11 +2,17 @@ from django.contrib import admin
 
 from .models import (
     Account,
+    ArchivedTransaction,
     Blockchain,
     Call,
     Contract,
+    GlobalConstant,
+    Provision,
+    QueueClass,
+    SenderPool,
     Transaction,
     Transfer,
+    Webhook,
 )
 
 
@@ -18,10 +24,11 @@ class AccountAdmin(admin.ModelAdmin):
     )
     list_filter = (
         'blockchain',
+        'pool',
     )
     search_fields = (
         'owner__email',
-        'address',
+        '=address',
     )
     raw_id_fields = (
         'owner',
@@ -62,6 +69,56 @@ class BlockchainAdmin(admin.ModelAdmin):
 admin.site.register(Blockchain, BlockchainAdmin)
 
 
+class ProvisionAdmin(admin.ModelAdmin):
+    list_display = (
+        'address',
+        'amount',
+        'funder',
+        'txhash',
+        'created_at',
+    )
+    list_filter = (
+        'blockchain',
+    )
+    search_fields = (
+        'address',
+        'txhash',
+    )
+
+
+admin.site.register(Provision, ProvisionAdmin)
+
+
+class SenderPoolAdmin(admin.ModelAdmin):
+    list_display = (
+        'name',
+        'blockchain',
+        'min_balance',
+    )
+
+
+admin.site.register(SenderPool, SenderPoolAdmin)
+
+
+class QueueClassAdmin(admin.ModelAdmin):
+    list_display = (
+        'priority',
+        'kind',
+        'dispatched',
+        'average_wait',
+        'max_wait',
+    )
+    readonly_fields = (
+        'pass_value',
+        'dispatched',
+        'total_wait',
+        'max_wait',
+    )
+
+
+admin.site.register(QueueClass, QueueClassAdmin)
+
+
 class TransactionAdmin(admin.ModelAdmin):
     def sender_name(self, obj):
         return obj.sender.owner if obj.sender_id else ""
@@ -90,8 +147,8 @@ class TransactionAdmin(admin.ModelAdmin):
     )
     search_fields = (
         'id',
-        'txhash',
-        'sender__address',
+        '=txhash',
+        '=sender__address',
         'sender__owner__name',
         'sender__owner__contact_name',
         'sender__owner__email',
@@ -100,6 +157,7 @@ class TransactionAdmin(admin.ModelAdmin):
     list_filter = (
         'sender__blockchain',
         'state',
+        'priority',
         'created_at',
         'updated_at',
         'state',
@@ -128,3 +186,84 @@ admin.site.register(Transaction, TransactionAdmin)
 admin.site.register(Contract)
 admin.site.register(Call)
 admin.site.register(Transfer)
+
+
+class WebhookAdmin(admin.ModelAdmin):
+    list_display = (
+        'url',
+        'owner',
+        'is_active',
+        'delivered',
+        'failures',
+        'next_attempt_at',
+    )
+    list_filter = (
+        'is_active',
+    )
+    raw_id_fields = (
+        'owner',
+    )
+    readonly_fields = (
+        'cursor',
+        'delivered',
+        'failures',
+        'next_attempt_at',
+        'last_error',
+    )
+
+
+admin.site.register(Webhook, WebhookAdmin)
+
+
+class ArchivedTransactionAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'txhash',
+        'sender',
+        'receiver',
+        'contract_name',
+        'function',
+        'state',
+        'updated_at',
+    )
+    search_fields = (
+        'id',
+        '=txhash',
+        '=sender__address',
+    )
+    list_filter = (
+        'state',
+        'updated_at',
+    )
+    ordering = ['-updated_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+admin.site.register(ArchivedTransaction, ArchivedTransactionAdmin)
+
+
+class GlobalConstantAdmin(admin.ModelAdmin):
+    list_display = (
+        'hash',
+        'blockchain',
+        'registered',
+        'transaction',
+        'created_at',
+    )
+    list_filter = (
+        'blockchain',
+        'registered',
+    )
+    search_fields = (
+        '=hash',
+    )
+    raw_id_fields = (
+        'code',
+        'transaction',
+    )
+
+admin.site.register(GlobalConstant, GlobalConstantAdmin)
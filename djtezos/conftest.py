@@ -0,0 +1,32 @@
+import pytest
+
+from django.contrib.auth import get_user_model
+
+from djtezos.models import Account, Blockchain
+
+
+@pytest.fixture
+def fake():
+    return Blockchain.objects.create(
+        name='fake',
+        provider_class='djtezos.fake.Provider',
+    )
+
+
+@pytest.fixture
+def tzlocal():
+    return Blockchain.objects.create(
+        name='tzlocal',
+        endpoint='http://tz:8732',
+        provider_class='djtezos.tezos.Provider',
+    )
+
+
+@pytest.fixture
+def user():
+    return get_user_model().objects.create(username='test')
+
+
+@pytest.fixture
+def account(fake):
+    return Account.objects.create(blockchain=fake)
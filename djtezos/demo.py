@@ -100,7 +100,12 @@ for model in (Group, User, Permission, Account, Blockchain, Transaction):
                             model=model,
                             fields='__all__',
                         )
-                    )
+                    ),
+                    # state transitions in the former history field shape
+                    **(
+                        dict(history=serializers.ReadOnlyField())
+                        if model is Transaction else {}
+                    ),
                 )
             )
         )
@@ -19,7 +19,8 @@ def fakehash(leet):
 
 
 class Provider(BaseProvider):
-    def create_wallet(self, passphrase):
+    @staticmethod
+    def derive_wallet(passphrase):
         return (
             fakehash('w41137'),
             b'_\xf2\x7f\xf6\xfd\xadu:\n\xe3Y\xc3a\xd2\x92\x97o3F\x86\xf5[\x9d\x10\x9d{S\x87zh\xde\xc1'  # noqa
@@ -38,7 +39,8 @@ class Provider(BaseProvider):
 
     def deploy(self, transaction):
         time.sleep(SLEEP)
-        return fakehash('d3pl0y3d7xh4sH')
+        transaction.txhash = fakehash('d3pl0y3d7xh4sH')
+        return transaction.txhash
 
     def watch(self, transaction):
         time.sleep(SLEEP)
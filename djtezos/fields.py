@@ -0,0 +1,115 @@
+import base58
+
+from django import forms
+from django.db import models
+from django.db.models import lookups
+
+
+class Base58Field(models.BinaryField):
+    """
+    Base58check string stored as a tag byte followed by its decoded payload.
+
+    The tag is the index of the matching prefix, values that don't decode
+    with any prefix are stored as is after the RAW tag. Exact, iexact and in
+    lookups take strings.
+    """
+    # (string prefix, decoded prefix, payload length)
+    prefixes = ()
+    RAW = 0xff
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs.pop('editable', None)
+        return name, path, args, kwargs
+
+    def encode(self, value):
+        for tag, (prefix, decoded_prefix, length) in enumerate(self.prefixes):
+            if not value.startswith(prefix):
+                continue
+            try:
+                decoded = base58.b58decode_check(value)
+            except ValueError:
+                break
+            if (
+                decoded.startswith(decoded_prefix)
+                and len(decoded) == len(decoded_prefix) + length
+            ):
+                return bytes([tag]) + decoded[len(decoded_prefix):]
+            break
+        return bytes([self.RAW]) + value.encode('utf8')
+
+    def decode(self, value):
+        value = bytes(value)
+        if value[0] == self.RAW:
+            return value[1:].decode('utf8')
+        prefix, decoded_prefix, length = self.prefixes[value[0]]
+        return base58.b58encode_check(
+            decoded_prefix + value[1:]
+        ).decode('ascii')
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return self.decode(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return self.decode(value)
+        return value
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if isinstance(value, str):
+            return self.encode(value)
+        return value
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{
+            'form_class': forms.CharField,
+            'max_length': 255,
+            **kwargs,
+        })
+
+
+@Base58Field.register_lookup
+class Base58IExact(lookups.Exact):
+    """
+    Base58 is case sensitive: compare encoded values for the iexact lookups
+    of "=" searches in admin and DRF.
+    """
+    lookup_name = 'iexact'
+
+    def get_rhs_op(self, connection, rhs):
+        return connection.operators['exact'] % rhs
+
+
+class AddressField(Base58Field):
+    """Implicit or originated account address in 21 bytes."""
+    prefixes = (
+        ('tz1', b'\x06\xa1\x9f', 20),
+        ('tz2', b'\x06\xa1\xa1', 20),
+        ('tz3', b'\x06\xa1\xa4', 20),
+        ('KT1', b'\x02\x5a\x79', 20),
+        ('tz4', b'\x06\xa1\xa6', 20),
+    )
+
+
+class OperationHashField(Base58Field):
+    """Operation hash in 33 bytes."""
+    prefixes = (
+        ('o', b'\x05\x74', 32),
+    )
+
+
+class BlockHashField(Base58Field):
+    """Block hash in 33 bytes."""
+    prefixes = (
+        ('B', b'\x01\x34', 32),
+    )
@@ -0,0 +1,48 @@
+import datetime
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from djtezos.models import SETTINGS, Transaction
+
+
+logger = logging.getLogger('djtezos.djtezos_archive')
+
+
+class Command(BaseCommand):
+    help = 'Move finished transactions out of the live table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=SETTINGS['ARCHIVE_DAYS'],
+            help='Archive transactions finished more than this days ago',
+        )
+        parser.add_argument(
+            '--batch',
+            type=int,
+            default=1000,
+            help='Number of transactions to move per database transaction',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Seconds to sleep between batches to spare the database',
+        )
+
+    def handle(self, *args, **options):
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        total = 0
+        while True:
+            count = Transaction.objects.archive(before, options['batch'])
+            total += count
+            if count:
+                logger.info(f'Archived {total} transactions')
+            if count < options['batch']:
+                break
+            time.sleep(options['pause'])
+        logger.info(f'Archived {total} transactions finished before {before}')
@@ -1,10 +1,10 @@
 import decimal
 import logging
-import requests
 
 from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
 
-from djtezos.models import Account
+from djtezos.models import Account, Transaction, low_balance
 
 
 logger = logging.getLogger('djtezos.balance')
@@ -21,6 +21,7 @@ class Command(BaseCommand):
         )
         for account in accounts:
             self.handle_account(account)
+        self.alert()
 
     def handle_account(self, account):
         from pytezos import pytezos
@@ -39,7 +40,19 @@ class Command(BaseCommand):
         else:
             balance = decimal.Decimal(balance / 1_000_000)
 
+        account.balance_updated_at = timezone.now()
         if account.balance != balance:
             print(f'Updating balance of {account} from {account.balance} to {balance}')
             account.balance = balance
-            account.save()
+        account.save()
+
+    def alert(self):
+        senders = set(Transaction.objects.filter(
+            state__in=('deploy', 'retrying'),
+        ).exclude(
+            sender=None,
+        ).unaffordable().values_list('sender', flat=True))
+
+        for account in Account.objects.filter(pk__in=senders):
+            logger.warning(f'{account} cannot afford its queued transactions')
+            low_balance.send(sender=Account, account=account)
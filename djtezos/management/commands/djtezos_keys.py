@@ -0,0 +1,73 @@
+import logging
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djtezos.models import Blockchain, WalletKey, encrypt, passphrase
+
+
+logger = logging.getLogger('djtezos.djtezos_keys')
+
+
+class Command(BaseCommand):
+    help = 'Refill the pool of pre-derived wallet keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=100,
+            help='Number of keys to keep in the pool of each blockchain',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of processes deriving keys',
+        )
+        parser.add_argument(
+            '--blockchain',
+            help='Name of the only blockchain to refill',
+        )
+
+    def handle(self, *args, **options):
+        blockchains = Blockchain.objects.filter(is_active=True)
+        if options['blockchain']:
+            blockchains = blockchains.filter(name=options['blockchain'])
+            if not blockchains:
+                raise CommandError(f'No active blockchain {options["blockchain"]}')
+
+        for blockchain in blockchains:
+            self.refill(blockchain, options['size'], options['processes'])
+
+    def refill(self, blockchain, size, processes):
+        if not blockchain.provider.uses_key_pool():
+            logger.info(f'{blockchain} does not use the key pool')
+            return
+
+        missing = size - WalletKey.objects.filter(blockchain=blockchain).count()
+        if missing <= 0:
+            logger.info(f'Key pool of {blockchain} is full')
+            return
+
+        derive = blockchain.provider.derive_wallet
+        passphrases = [passphrase() for i in range(missing)]
+
+        # derive_wallet doesn't touch the database, so forked processes never
+        # use the inherited connection
+        keys = []
+        with ProcessPoolExecutor(processes) as executor:
+            chunksize = max(1, missing // (processes * 4))
+            for address, private_key in executor.map(
+                derive, passphrases, chunksize=chunksize,
+            ):
+                keys.append(WalletKey(
+                    blockchain=blockchain,
+                    address=address,
+                    crypted_key=encrypt(private_key),
+                ))
+
+        WalletKey.objects.bulk_create(keys)
+        logger.info(f'Added {len(keys)} keys to the pool of {blockchain}')
@@ -0,0 +1,19 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djtezos.models import Blockchain
+
+
+logger = logging.getLogger('djtezos.djtezos_provision')
+
+
+class Command(BaseCommand):
+    help = 'Fund queued provisions, run it once per block'
+
+    def handle(self, *args, **options):
+        for blockchain in Blockchain.objects.filter(is_active=True):
+            try:
+                blockchain.provider.provision_batch()
+            except Exception as exception:
+                logger.exception(exception)
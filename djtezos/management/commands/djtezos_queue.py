@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from djtezos.models import QueueClass, Transaction
+from djtezos.management.commands.djtezos_write import Command as Write
+
+
+class Command(BaseCommand):
+    help = 'Show queue wait time per priority and kind'
+
+    def handle(self, *args, **options):
+        write = Write()
+        now = timezone.now()
+        self.stdout.write(
+            'class            pending  oldest(s)  average(s)  max(s)  dispatched'
+        )
+        for priority, priority_label in Transaction.PRIORITY_CHOICES:
+            for kind, kind_label in QueueClass.KIND_CHOICES:
+                queue_class = QueueClass.objects.filter(
+                    priority=priority,
+                    kind=kind,
+                ).first() or QueueClass(priority=priority, kind=kind)
+                pending = write.queryset(kind).filter(priority=priority)
+                oldest = pending.order_by('created_at').first()
+                if oldest:
+                    since = oldest.last_fail or oldest.created_at
+                    oldest = (now - since).total_seconds()
+                self.stdout.write(' '.join((
+                    str(queue_class).ljust(16),
+                    str(pending.count()).rjust(7),
+                    f'{oldest or 0:10.1f}',
+                    f'{queue_class.average_wait:11.1f}',
+                    f'{queue_class.max_wait:7.1f}',
+                    str(queue_class.dispatched).rjust(11),
+                )))
@@ -0,0 +1,52 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djtezos.models import Account
+from djtezos.signer import KeyStore, SignerServer
+from djtezos.tezos import SETTINGS
+
+
+class Command(BaseCommand):
+    help = 'Run the signer process that holds keys and signs for workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket',
+            default=SETTINGS['SIGNER_SOCKET'],
+            help='Path of the Unix socket, SIGNER_SOCKET by default',
+        )
+        parser.add_argument(
+            '--preload',
+            action='store_true',
+            help='Decrypt the keys of all accounts on start',
+        )
+
+    def handle(self, *args, **options):
+        path = options['socket']
+        if not path:
+            raise CommandError('Set SIGNER_SOCKET or --socket')
+
+        keys = KeyStore()
+        if options['preload']:
+            count = keys.load(Account.objects.filter(
+                blockchain__is_active=True,
+                blockchain__provider_class='djtezos.tezos.Provider',
+            ))
+            self.stdout.write(f'Loaded {count} keys')
+
+        if os.path.exists(path):
+            os.unlink(path)
+        # only the user running workers may connect
+        umask = os.umask(0o177)
+        try:
+            server = SignerServer(path, keys)
+        finally:
+            os.umask(umask)
+
+        self.stdout.write(f'Listening on {path}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+            os.unlink(path)
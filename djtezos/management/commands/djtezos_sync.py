@@ -1,7 +1,5 @@
 import logging
 
-from pytezos import pytezos
-
 from django.core.management.base import BaseCommand, CommandError
 
 from djtezos.models import Blockchain, Contract, Call, Transaction
@@ -17,5 +15,6 @@ class Command(BaseCommand):
         for blockchain in Blockchain.objects.filter(is_active=True):
             try:
                 blockchain.provider.watch_blockchain(blockchain)
+                blockchain.provider.watch_mempool(blockchain)
             except Exception as exception:
                 logger.exception(exception)
@@ -0,0 +1,54 @@
+import hmac
+import json
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from django.core.management.base import BaseCommand
+
+from djtezos.models import Webhook
+
+
+class Command(BaseCommand):
+    help = 'Run a local webhook receiver that prints verified events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('secret', help='Secret of the Webhook')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--status',
+            type=int,
+            default=200,
+            help='Status to respond, ie. 500 to test retries',
+        )
+
+    def handle(self, *args, **options):
+        command = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                expected = 'sha256=' + Webhook.signature(
+                    options['secret'],
+                    body,
+                )
+                signature = self.headers.get('X-Djtezos-Signature', '')
+                if not hmac.compare_digest(signature, expected):
+                    command.stderr.write('Invalid signature')
+                    self.send_response(401)
+                    self.end_headers()
+                    return
+
+                for event in json.loads(body)['events']:
+                    command.stdout.write(
+                        f'{event["event_id"]} {event["created_at"]}'
+                        f' {event["id"]} {event["state"]}'
+                    )
+                self.send_response(options['status'])
+                self.end_headers()
+
+        server = HTTPServer(('127.0.0.1', options['port']), Handler)
+        self.stdout.write(f'Listening on http://127.0.0.1:{options["port"]}/')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
@@ -0,0 +1,120 @@
+import json
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from djtezos.models import SETTINGS, Webhook
+
+
+logger = logging.getLogger('djtezos.djtezos_webhooks')
+
+
+class Command(BaseCommand):
+    help = 'Deliver state transitions to webhooks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Number of webhooks to deliver to at the same time',
+        )
+        parser.add_argument(
+            '--batches',
+            type=int,
+            default=10,
+            help='Maximum number of requests per webhook in this run',
+        )
+
+    def handle(self, *args, **options):
+        webhooks = Webhook.objects.filter(is_active=True).filter(
+            Q(next_attempt_at=None)
+            | Q(next_attempt_at__lte=timezone.now())
+        ).select_related('owner')
+
+        start = time.monotonic()
+        if options['concurrency'] > 1:
+            with ThreadPoolExecutor(options['concurrency']) as executor:
+                results = list(executor.map(
+                    lambda webhook: self.worker(webhook, options['batches']),
+                    webhooks,
+                ))
+        else:
+            results = [
+                self.deliver(webhook, options['batches'])
+                for webhook in webhooks
+            ]
+        seconds = time.monotonic() - start
+
+        events = sum(result[0] for result in results)
+        requests = sum(result[1] for result in results)
+        failures = sum(result[2] for result in results)
+        logger.info(
+            f'Delivered {events} events in {requests} requests to'
+            f' {len(results)} webhooks in {seconds:.2f}s'
+            f' ({events / seconds if seconds else 0:.0f} events/s),'
+            f' {failures} failed'
+        )
+
+    def worker(self, webhook, batches):
+        try:
+            return self.deliver(webhook, batches)
+        finally:
+            # each thread has its own connection
+            connection.close()
+
+    def deliver(self, webhook, batches):
+        """Return the number of events, requests and failures."""
+        import requests
+
+        events = sent = 0
+        for i in range(batches):
+            transitions, cursor = webhook.next_batch()
+            if not transitions:
+                if cursor != webhook.cursor:
+                    webhook.cursor = cursor
+                    webhook.save(update_fields=['cursor'])
+                break
+
+            body = json.dumps(dict(events=[
+                dict(event_id=transition.pk, **transition.as_event())
+                for transition in transitions
+            ])).encode('utf8')
+            try:
+                response = requests.post(
+                    webhook.url,
+                    data=body,
+                    headers={
+                        'Content-Type': 'application/json',
+                        'X-Djtezos-Signature': 'sha256=' + Webhook.signature(
+                            webhook.secret,
+                            body,
+                        ),
+                    },
+                    timeout=SETTINGS['WEBHOOK_TIMEOUT'],
+                )
+                response.raise_for_status()
+            except requests.RequestException as exception:
+                logger.warning(f'Webhook({webhook}) failed: {exception}')
+                webhook.failed(exception)
+                return events, sent + 1, 1
+
+            webhook.cursor = cursor
+            webhook.delivered += len(transitions)
+            webhook.failures = 0
+            webhook.next_attempt_at = None
+            webhook.last_error = ''
+            webhook.save()
+            events += len(transitions)
+            sent += 1
+
+            if len(transitions) < SETTINGS['WEBHOOK_BATCH']:
+                break
+
+        return events, sent, 0
@@ -1,11 +1,16 @@
 import logging
-from pytezos import pytezos
-
 from django.core.management.base import BaseCommand, CommandError
 from django.db.models import Q
 from django.utils import timezone
 
-from djtezos.models import Blockchain, Contract, Call, Transfer
+from djtezos.models import (
+    Blockchain,
+    Call,
+    Contract,
+    QueueClass,
+    SenderPool,
+    Transfer,
+)
 
 
 logger = logging.getLogger('djtezos.djtezos_write')
@@ -15,84 +20,79 @@ class Command(BaseCommand):
     help = 'Synchronize external transactions'
     exclude_states = ('held', 'aborted', 'import', 'importing', 'done')
 
+    # transactions that failed after their operation was signed keep their
+    # txhash, to be injected again by the provider
+    injectable = Q(txhash=None) | Q(state='retrying')
+
     def contracts(self):
         return Contract.objects.filter(
+            self.injectable,
             contract_address=None,
-            txhash=None,
             sender__blockchain__is_active=True,
-        ).exclude(
-            Q(sender__balance=None)
-            | Q(sender__balance=0)
-            | Q(state__in=self.exclude_states)
-            | Q(contract_micheline=None)
-            | Q(contract_micheline='')
+        ).affordable().exclude(
+            Q(state__in=self.exclude_states)
+            | Q(micheline_code=None)
         )
 
     def calls(self):
         return Call.objects.filter(
-            txhash=None,
+            self.injectable,
             sender__blockchain__is_active=True,
-        ).exclude(
-            Q(sender__balance=None)
-            | Q(sender__balance=0)
-            | Q(state__in=self.exclude_states)
+        ).affordable().exclude(
+            Q(state__in=self.exclude_states)
             | Q(contract_address=None)
             | Q(contract_address='')
         )
 
     def transfers(self):
         return Transfer.objects.filter(
-            txhash=None,
+            self.injectable,
             sender__blockchain__is_active=True,
-        ).exclude(
-            Q(sender__balance=None)
-            | Q(sender__balance=0)
-            | Q(state__in=self.exclude_states)
+        ).affordable().exclude(
+            Q(state__in=self.exclude_states)
         )
 
     def handle(self, *args, **options):
-        # is there any new transfer to deploy from an account with balance?
-        transfer = self.transfers().filter(last_fail=None).first()
-        if transfer:
-            logger.info(f'Deploying transfer {transfer}')
-            return self.deploy(transfer)
-        logger.info('Found 0 transfers to deploy')
-
-        # is there any new contract to deploy from an account with balance?
-        contract = self.contracts().filter(last_fail=None).first()
-
-        if contract:
-            logger.info(f'Deploying contract {contract}')
-            return self.deploy(contract)
-        logger.info('Found 0 contracts to deploy')
-
-        # is there any new contract call ready to deploy?
-        call = self.calls().filter(last_fail=None).first()
-        if call:
-            logger.info(f'Calling function {call}')
-            return self.deploy(call)
-        logger.info('Found 0 calls to send')
-
-        # is there any transfer to retry from an account with balance?
-        transfer = self.transfers().order_by('last_fail').first()
-        if transfer:
-            logger.info(f'Retrying transfer {transfer}')
-            return self.deploy(transfer)
-        logger.info('Found 0 transfer to retry')
-
-        contract = self.contracts().order_by('last_fail').first()
-
-        if contract:
-            logger.info(f'Retrying contract {contract}')
-            return self.deploy(contract)
-        logger.info('Found 0 contract to retry')
-
-        call = self.calls().order_by('last_fail').first()
-        if call:
-            logger.info(f'Retrying function {call}')
-            return self.deploy(call)
-        logger.info('Found 0 call to retry')
-
+        for pool in SenderPool.objects.filter(blockchain__is_active=True):
+            pool.rebalance()
+            pool.dispatch()
+
+        tx = self.schedule()
+        if not tx:
+            logger.info('Found 0 transactions to deploy')
+            return
+        return self.deploy(tx)
+
+    def queryset(self, kind):
+        return dict(
+            transfer=self.transfers,
+            contract=self.contracts,
+            call=self.calls,
+        )[kind]()
+
+    def schedule(self):
+        """
+        Return the next transaction to deploy, with weighted fair queuing
+        between priorities and kinds, and fairness between owners.
+        """
+        active = set()
+        for kind, label in QueueClass.KIND_CHOICES:
+            for priority in self.queryset(kind).order_by().values_list(
+                'priority',
+                flat=True,
+            ).distinct():
+                active.add((priority, kind))
+        if not active:
+            return
+
+        queue_class = QueueClass.objects.pick(active)
+        tx = self.queryset(queue_class.kind).filter(
+            priority=queue_class.priority,
+        ).fair().first()
+        if tx:
+            wait = queue_class.dispatch(tx)
+            logger.info(f'Deploying {queue_class} {tx} after {wait:.1f}s')
+        return tx
 
     def deploy(self, tx):
         tx.state_set('deploying')
@@ -100,28 +100,32 @@ class Command(BaseCommand):
             tx.provider.deploy(tx)
         except Exception as exception:
             tx.last_fail = timezone.now()
-            tx.error = str(exception)
-
-            deploys_since_last_start = 0
-            for logentry in reversed(tx.history):
-                if logentry[0] == 'deploying':
-                    deploys_since_last_start += 1
-                elif logentry[0] == 'aborted':
-                    break
-            if deploys_since_last_start >= 10:
+            error = str(exception)
+
+            deploys_since_last_start = tx.transitions.filter(
+                state='deploying',
+            )
+            aborted = tx.transitions.filter(state='aborted').order_by(
+                '-created_at'
+            ).values_list('created_at', flat=True).first()
+            if aborted:
+                deploys_since_last_start = deploys_since_last_start.filter(
+                    created_at__gt=aborted,
+                )
+            if deploys_since_last_start.count() >= 10:
                 message = 'Aborting because >= 10 failures,'
-                tx.error = ' '.join([
+                tx.state_set('aborted', error=' '.join([
                     message,
                     'last error:',
-                    tx.error,
-                ])
-                tx.state_set('aborted')
+                    error,
+                ]))
             else:
-                tx.state_set('retrying')
+                tx.state_set('retrying', error=error)
         else:
+            # djtezos_sync confirms the operation
             tx.last_fail = None
-            tx.error = ''
-            if tx.function or tx.amount:
-                tx.state_set('done')
+            if tx.state == 'watching':
+                # set by the provider with the signed operation
+                tx.save(update_fields=['last_fail'])
             else:
-                tx.state_set('watching')
+                tx.state_set('watching', error='')
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0012_transaction_users'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('address', models.CharField(max_length=255)),
+                ('crypted_key', models.BinaryField()),
+                ('blockchain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='djtezos.blockchain')),
+            ],
+        ),
+    ]
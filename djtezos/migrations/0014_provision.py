@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0013_walletkey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Provision',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('address', models.CharField(max_length=255)),
+                ('amount', models.BigIntegerField(help_text='Amount in xTZ')),
+                ('funder', models.CharField(blank=True, max_length=255, null=True)),
+                ('txhash', models.CharField(blank=True, db_index=True, max_length=255, null=True)),
+                ('blockchain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='djtezos.blockchain')),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0014_provision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SenderPool',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('min_balance', models.DecimalField(decimal_places=9, default=0, help_text='Accounts below this balance get refilled by richer ones', max_digits=18)),
+                ('blockchain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='djtezos.blockchain')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='pool',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='djtezos.senderpool'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='pool',
+            field=models.ForeignKey(blank=True, help_text='Pick the sender from this pool when sender is empty', null=True, on_delete=django.db.models.deletion.SET_NULL, to='djtezos.senderpool'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0015_senderpool'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='balance_updated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0016_account_balance_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='signed_operation',
+            field=models.BinaryField(blank=True, help_text='Signed operation bytes, persisted before injection', null=True),
+        ),
+    ]
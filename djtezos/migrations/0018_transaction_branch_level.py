@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0017_transaction_signed_operation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='branch_level',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Level of the block the operation was forged against', null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 22:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0018_transaction_branch_level'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blockchain',
+            name='fee_percentiles',
+            field=models.JSONField(blank=True, default=dict, help_text='Fee percentile to target per priority, ie. {"high": 95}'),
+        ),
+        migrations.AddField(
+            model_name='blockchain',
+            name='fee_samples',
+            field=models.JSONField(blank=True, default=list, editable=False, help_text='[fee per gas, fee per byte] in nanotez of recent operations'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='fee',
+            field=models.BigIntegerField(blank=True, editable=False, help_text='Fee in xTZ chosen at injection', null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='fee_percentile',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, help_text='Percentile of recent fees that fee was chosen to reach', null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'low'), (1, 'normal'), (2, 'high')], db_index=True, default=1),
+        ),
+    ]
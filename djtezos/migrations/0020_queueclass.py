@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 22:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0019_fees'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueClass',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.PositiveSmallIntegerField(choices=[(0, 'low'), (1, 'normal'), (2, 'high')])),
+                ('kind', models.CharField(choices=[('transfer', 'Transfer'), ('contract', 'Contract'), ('call', 'Call')], max_length=8)),
+                ('pass_value', models.FloatField(default=0)),
+                ('dispatched', models.PositiveIntegerField(default=0)),
+                ('total_wait', models.FloatField(default=0, help_text='Seconds dispatched transactions waited in queue')),
+                ('max_wait', models.FloatField(default=0)),
+            ],
+            options={
+                'unique_together': {('priority', 'kind')},
+            },
+        ),
+    ]
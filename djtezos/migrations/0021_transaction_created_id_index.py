@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 22:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0020_queueclass'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['created_at', 'id'], name='djtezos_tx_created_id'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 22:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import djtezos.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('djtezos', '0022_statetransition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Webhook',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField()),
+                ('secret', models.CharField(default=djtezos.models.webhook_secret, help_text='Key of the HMAC-SHA256 signature of request bodies', max_length=200)),
+                ('states', models.JSONField(blank=True, default=list, help_text='Only send transitions to these states, all if empty')),
+                ('is_active', models.BooleanField(default=True)),
+                ('cursor', models.BigIntegerField(blank=True, null=True)),
+                ('delivered', models.BigIntegerField(default=0)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('owner', models.ForeignKey(blank=True, help_text='Only send transactions of this user, all if empty', null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
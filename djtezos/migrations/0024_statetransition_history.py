@@ -0,0 +1,92 @@
+# Generated by Django 3.2.25 on 2026-10-18 22:12
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def timestamp_datetime(timestamp):
+    value = datetime.datetime.fromtimestamp(timestamp)
+    if settings.USE_TZ:
+        value = timezone.make_aware(value)
+    return value
+
+
+def history_transitions(apps, schema_editor):
+    Transaction = apps.get_model('djtezos', 'Transaction')
+    StateTransition = apps.get_model('djtezos', 'StateTransition')
+    Webhook = apps.get_model('djtezos', 'Webhook')
+
+    last = StateTransition.objects.aggregate(
+        last=models.Max('pk'),
+    )['last'] or 0
+
+    # state_set() has been recording both since 0022, only backfill the
+    # history entries that came before
+    recorded = dict(StateTransition.objects.values_list(
+        'transaction',
+    ).annotate(count=models.Count('pk')).values_list('transaction', 'count'))
+
+    transitions = []
+    for pk, history in Transaction.objects.values_list(
+        'pk', 'history',
+    ).iterator(chunk_size=2000):
+        history = history or []
+        for state, timestamp in history[:len(history) - recorded.get(pk, 0)]:
+            transitions.append(StateTransition(
+                transaction_id=pk,
+                state=state,
+                created_at=timestamp_datetime(timestamp),
+            ))
+        if len(transitions) >= 5000:
+            StateTransition.objects.bulk_create(transitions)
+            transitions = []
+    StateTransition.objects.bulk_create(transitions)
+
+    # don't deliver the backfill as new events to webhooks that were caught up
+    Webhook.objects.filter(cursor__gte=last).update(
+        cursor=StateTransition.objects.aggregate(
+            last=models.Max('pk'),
+        )['last'] or 0,
+    )
+
+
+def transitions_history(apps, schema_editor):
+    Transaction = apps.get_model('djtezos', 'Transaction')
+    StateTransition = apps.get_model('djtezos', 'StateTransition')
+
+    history = dict()
+    for pk, state, created_at in StateTransition.objects.order_by(
+        'created_at', 'pk',
+    ).values_list('transaction', 'state', 'created_at').iterator():
+        history.setdefault(pk, []).append(
+            [state, int(created_at.timestamp())]
+        )
+    for pk, entries in history.items():
+        Transaction.objects.filter(pk=pk).update(history=entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0023_webhook'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statetransition',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddIndex(
+            model_name='statetransition',
+            index=models.Index(fields=['state', 'created_at'], name='djtezos_transition_state'),
+        ),
+        migrations.RunPython(history_transitions, transitions_history),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='history',
+        ),
+    ]
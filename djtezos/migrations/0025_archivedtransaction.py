@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-18 22:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('djtezos', '0024_statetransition_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('txhash', models.CharField(blank=True, db_index=True, max_length=255, null=True)),
+                ('gasprice', models.BigIntegerField(blank=True, null=True)),
+                ('gas', models.BigIntegerField(blank=True, null=True)),
+                ('fee', models.BigIntegerField(blank=True, null=True)),
+                ('fee_percentile', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('priority', models.PositiveSmallIntegerField(choices=[(0, 'low'), (1, 'normal'), (2, 'high')], default=1)),
+                ('contract_address', models.CharField(max_length=255, null=True)),
+                ('contract_name', models.CharField(max_length=100, null=True)),
+                ('function', models.CharField(blank=True, max_length=100, null=True)),
+                ('args', models.JSONField(blank=True, default=list, null=True)),
+                ('amount', models.PositiveIntegerField(blank=True, null=True)),
+                ('level', models.PositiveIntegerField(blank=True, null=True)),
+                ('state', models.CharField(choices=[('held', 'Held'), ('aborted', 'Aborted'), ('deploy', 'To deploy'), ('deploying', 'Deploying'), ('retrying', 'Retrying'), ('watch', 'To watch'), ('watching', 'Watching'), ('done', 'Finished')], max_length=200)),
+                ('error', models.TextField(blank=True)),
+                ('history', models.JSONField(default=list)),
+                ('contract', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='djtezos.transaction')),
+                ('receiver', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='djtezos.account')),
+                ('sender', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='djtezos.account')),
+                ('users', models.ManyToManyField(blank=True, related_name='_djtezos_archivedtransaction_users_+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedtransaction',
+            index=models.Index(fields=['created_at', 'id'], name='djtezos_archive_created_id'),
+        ),
+    ]
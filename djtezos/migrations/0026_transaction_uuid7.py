@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 22:16
+
+from django.db import migrations, models
+import djtezos.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0025_archivedtransaction'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='id',
+            field=models.UUIDField(default=djtezos.models.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 3.2.25 on 2026-10-18 22:20
+
+from django.db import migrations, models
+
+import djtezos.fields
+
+
+# model, field, final field: each value is copied encoded to a new binary
+# column which then replaces the string column
+FIELDS = (
+    (
+        'account',
+        'address',
+        djtezos.fields.AddressField(blank=True, db_index=True, max_length=255, null=True),
+    ),
+    (
+        'archivedtransaction',
+        'contract_address',
+        djtezos.fields.AddressField(max_length=255, null=True),
+    ),
+    (
+        'archivedtransaction',
+        'txhash',
+        djtezos.fields.OperationHashField(blank=True, db_index=True, max_length=255, null=True),
+    ),
+    (
+        'transaction',
+        'contract_address',
+        djtezos.fields.AddressField(db_index=True, max_length=255, null=True),
+    ),
+    (
+        'transaction',
+        'txhash',
+        djtezos.fields.OperationHashField(blank=True, max_length=255, null=True, unique=True),
+    ),
+)
+
+
+def copy(model_name, source, destination, convert):
+    def run(apps, schema_editor):
+        Model = apps.get_model('djtezos', model_name)
+        rows = Model.objects.exclude(**{source: None}).values_list('pk', source)
+        batch = []
+        for pk, value in rows.iterator(chunk_size=5000):
+            batch.append(Model(pk=pk, **{destination: convert(value)}))
+            if len(batch) == 5000:
+                Model.objects.bulk_update(batch, [destination])
+                batch = []
+        Model.objects.bulk_update(batch, [destination])
+    return run
+
+
+def operations():
+    for model_name, name, field in FIELDS:
+        compact = f'{name}_compact'
+        yield migrations.AddField(
+            model_name=model_name,
+            name=compact,
+            field=models.BinaryField(null=True),
+        )
+        yield migrations.RunPython(
+            copy(model_name, name, compact, field.encode),
+            copy(model_name, compact, name, field.decode),
+        )
+        yield migrations.RemoveField(
+            model_name=model_name,
+            name=name,
+        )
+        yield migrations.RenameField(
+            model_name=model_name,
+            old_name=compact,
+            new_name=name,
+        )
+        yield migrations.AlterField(
+            model_name=model_name,
+            name=name,
+            field=field,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0026_transaction_uuid7'),
+    ]
+
+    operations = list(operations())
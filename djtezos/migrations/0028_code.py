@@ -0,0 +1,113 @@
+# Generated by Django 3.2.25 on 2026-10-18 22:20
+
+import hashlib
+import json
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def dumps(micheline):
+    return json.dumps(
+        micheline,
+        separators=(',', ':'),
+        sort_keys=True,
+    ).encode('utf8')
+
+
+def store_codes(apps, schema_editor):
+    Transaction = apps.get_model('djtezos', 'Transaction')
+    Code = apps.get_model('djtezos', 'Code')
+
+    codes = set(Code.objects.values_list('hash', flat=True))
+
+    def store(data):
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in codes:
+            Code.objects.create(
+                hash=digest,
+                data=zlib.compress(data),
+                size=len(data),
+            )
+            codes.add(digest)
+        return digest
+
+    batch = []
+    rows = Transaction.objects.exclude(
+        contract_micheline=None,
+        contract_source=None,
+    ).values_list('pk', 'contract_micheline', 'contract_source')
+    for pk, micheline, source in rows.iterator(chunk_size=1000):
+        if not micheline and not source:
+            continue
+        batch.append(Transaction(
+            pk=pk,
+            micheline_code_id=store(dumps(micheline)) if micheline else None,
+            source_code_id=store(source.encode('utf8')) if source else None,
+        ))
+        if len(batch) == 1000:
+            Transaction.objects.bulk_update(
+                batch,
+                ['micheline_code', 'source_code'],
+            )
+            batch = []
+    Transaction.objects.bulk_update(batch, ['micheline_code', 'source_code'])
+
+
+def load_codes(apps, schema_editor):
+    Transaction = apps.get_model('djtezos', 'Transaction')
+    for transaction in Transaction.objects.exclude(
+        micheline_code=None,
+        source_code=None,
+    ).select_related('micheline_code', 'source_code').iterator():
+        if transaction.micheline_code:
+            transaction.contract_micheline = json.loads(
+                zlib.decompress(transaction.micheline_code.data)
+            )
+        if transaction.source_code:
+            transaction.contract_source = zlib.decompress(
+                transaction.source_code.data
+            ).decode('utf8')
+        transaction.save(update_fields=['contract_micheline', 'contract_source'])
+
+
+class Migration(migrations.Migration):
+    # on PostgreSQL, dropping columns of a table with pending foreign key
+    # trigger events fails: store_codes commits in its own transaction
+    atomic = False
+
+    dependencies = [
+        ('djtezos', '0027_compact_addresses'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Code',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('size', models.PositiveIntegerField(help_text='Uncompressed size in bytes')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='micheline_code',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='djtezos.code'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='source_code',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='djtezos.code'),
+        ),
+        migrations.RunPython(store_codes, load_codes, atomic=True),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='contract_micheline',
+        ),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='contract_source',
+        ),
+    ]
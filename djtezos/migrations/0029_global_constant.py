@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 22:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0028_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GlobalConstant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(help_text='Script expression hash', max_length=54)),
+                ('registered', models.BooleanField(default=False, help_text='Found on chain, see is_registered')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blockchain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='global_constants', to='djtezos.blockchain')),
+                ('code', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='djtezos.code')),
+                ('transaction', models.ForeignKey(blank=True, help_text='Origination that registers the constant', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='djtezos.transaction')),
+            ],
+            options={
+                'unique_together': {('blockchain', 'hash')},
+            },
+        ),
+    ]
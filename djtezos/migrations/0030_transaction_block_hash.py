@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 22:32
+
+from django.db import migrations
+import djtezos.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0029_global_constant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='block_hash',
+            field=djtezos.fields.BlockHashField(blank=True, help_text='Block the operation was included in, to detect reorgs', max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0030_transaction_block_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='account',
+            name='balance',
+            field=models.DecimalField(blank=True, decimal_places=9, default=0, editable=False, max_digits=18),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0031_account_balance_default'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedtransaction',
+            name='amount',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='amount',
+            field=models.PositiveBigIntegerField(blank=True, db_index=True, help_text='Amount in xTZ', null=True),
+        ),
+    ]
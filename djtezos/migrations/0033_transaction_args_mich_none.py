@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+def unencoded_args(apps, schema_editor):
+    # an empty list is a valid parameter, not encoded is None now
+    Transaction = apps.get_model('djtezos', 'Transaction')
+    Transaction.objects.filter(
+        txhash=None,
+        args_mich=[],
+    ).update(args_mich=None)
+
+
+def empty_args(apps, schema_editor):
+    Transaction = apps.get_model('djtezos', 'Transaction')
+    Transaction.objects.filter(args_mich__isnull=True).update(args_mich=[])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0032_transaction_amount_big'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='args_mich',
+            field=models.JSONField(blank=True, default=None, null=True),
+        ),
+        migrations.RunPython(unencoded_args, empty_args),
+    ]
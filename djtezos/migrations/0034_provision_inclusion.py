@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djtezos', '0033_transaction_args_mich_none'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='provision',
+            name='branch_level',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='provision',
+            name='level',
+            field=models.PositiveIntegerField(blank=True, help_text='Of the block that includes the funding operation', null=True),
+        ),
+    ]
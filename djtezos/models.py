@@ -1,14 +1,20 @@
 import datetime
+import functools
+import hashlib
+import hmac
 import importlib
+import itertools
 import json
 import logging
 import random
-import requests.exceptions
+import secrets
 import string
 import sys
+import threading
 import time
 import traceback
 import uuid
+import zlib
 
 try:
     import uwsgi
@@ -20,13 +26,30 @@ from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db import close_old_connections
-from django.db.models import Q, signals
+from django.db import transaction as db_transaction
+from django.db.models import (
+    BigIntegerField,
+    Case,
+    Count,
+    DecimalField,
+    Exists,
+    ExpressionWrapper,
+    F,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+    signals,
+)
+from django.db.models.functions import Coalesce, Greatest
+from django.dispatch import Signal
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from cryptography.hazmat.primitives.ciphers import (
-    Cipher, algorithms, modes)
-from cryptography.hazmat.backends import default_backend
-
 from djcall.models import Caller
 
 from model_utils.managers import (
@@ -35,6 +58,7 @@ from model_utils.managers import (
 )
 
 from .exceptions import PermanentError, TemporaryError
+from .fields import AddressField, BlockHashField, OperationHashField
 
 logger = logging.getLogger('djtezos')
 
@@ -45,16 +69,67 @@ SETTINGS = dict(
         ('djtezos.fake.Provider', 'Test'),
         ('djtezos.fake.FailDeploy', 'Test that fails deploy'),
         ('djtezos.fake.FailWatch', 'Test that fails watch'),
-    )
+    ),
+    # fee percentile of recent blocks to target by default per priority, 0
+    # for the minimal fee
+    FEE_PERCENTILES=dict(
+        low=0,
+        normal=50,
+        high=90,
+    ),
+    # share of the write queue each priority gets when others are queued too
+    PRIORITY_WEIGHTS=dict(
+        low=1,
+        normal=2,
+        high=4,
+    ),
+    # limits of the bulk transaction creation endpoint
+    BULK_MAX_ITEMS=1000,
+    BULK_MAX_BYTES=10 * 1024 * 1024,
+    # seconds between polls of the transaction event stream, and before it
+    # ends so that clients reconnect with their last event id
+    EVENTS_POLL=1,
+    EVENTS_TIMEOUT=300,
+    # seconds before a transition is streamed or delivered to webhooks, for
+    # transitions with lower ids committed later not to be skipped. Their
+    # created_at is the time of insert, not of commit, so this must exceed
+    # the longest database transaction that inserts transitions, such as a
+    # bulk_enqueue batch or a queryset state_set: transitions committed
+    # later than that are skipped by cursors
+    EVENTS_SETTLE=5,
+    # transitions per webhook request, seconds before a request times out,
+    # and bounds of the exponential delay between failed deliveries
+    WEBHOOK_BATCH=100,
+    WEBHOOK_TIMEOUT=10,
+    WEBHOOK_BACKOFF=(10, 3600),
+    # days after which djtezos_archive moves finished transactions out of
+    # the live table
+    ARCHIVE_DAYS=90,
+    # xTZ reserved for the fees of a transaction until its fee is known
+    FEE_ESTIMATES=dict(
+        transfer=300_000,
+        call=100_000,
+        originate=1_000_000,
+    ),
 )
 SETTINGS.update(getattr(settings, 'DJBLOCKCHAIN', {}))
 
 
+# sent with account when it can't afford its queued transactions
+low_balance = Signal()
+
+
 KEY = settings.SECRET_KEY.encode('utf8')[:32]
 IV = settings.SECRET_KEY.encode('utf8')[-16:]
 
 
 def cipher():
+    # imported here so that web workers which never touch keys don't pay
+    # for loading cryptography
+    from cryptography.hazmat.primitives.ciphers import (
+        Cipher, algorithms, modes)
+    from cryptography.hazmat.backends import default_backend
+
     return Cipher(
         algorithms.AES(KEY),
         modes.CBC(IV),
@@ -72,6 +147,59 @@ def decrypt(secret):
     return decryptor.update(secret) + decryptor.finalize()
 
 
+def passphrase():
+    return ''.join(
+        random.choice(string.ascii_letters) for i in range(42)
+    )
+
+
+# unix milliseconds and sequence of the last uuid7() of this process, ids
+# are generated from any thread
+_uuid7_last = [0, 0]
+_uuid7_lock = threading.Lock()
+
+
+def uuid7():
+    """
+    Time ordered UUID version 7, for inserts to append to the primary key.
+
+    48 bits of unix milliseconds, then a 12 bits sequence that keeps ids of
+    the same millisecond ordered within a process, then 62 random bits.
+    """
+    with _uuid7_lock:
+        ms = time.time_ns() // 1_000_000
+        last_ms, sequence = _uuid7_last
+        if ms > last_ms:
+            sequence = secrets.randbits(10)
+        else:
+            ms, sequence = last_ms, sequence + 1
+            if sequence > 0xfff:
+                ms, sequence = ms + 1, 0
+        _uuid7_last[:] = ms, sequence
+
+    return uuid.UUID(int=(
+        ms << 80
+        | 0x7 << 76
+        | sequence << 64
+        | 0b10 << 62
+        | secrets.randbits(62)
+    ))
+
+
+def uuid7_min(value):
+    """
+    Lowest uuid7() of a datetime, to range scan by primary key.
+
+    Ids generated with uuid4 before uuid7 became the default are not ordered,
+    only use it on transactions created since.
+    """
+    return uuid.UUID(int=(
+        int(value.timestamp() * 1000) << 80
+        | 0x7 << 76
+        | 0b10 << 62
+    ))
+
+
 class Account(models.Model):
     created_at = models.DateTimeField(
         null=True,
@@ -83,10 +211,11 @@ class Account(models.Model):
         blank=True,
         auto_now=True,
     )
-    address = models.CharField(
+    address = AddressField(
         max_length=255,
         blank=True,
         null=True,
+        db_index=True,
     )
     blockchain = models.ForeignKey(
         'Blockchain',
@@ -106,7 +235,18 @@ class Account(models.Model):
         editable=False,
         default=0,
     )
+    balance_updated_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+    )
     name = models.CharField(max_length=100)
+    pool = models.ForeignKey(
+        'SenderPool',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
 
     def __str__(self):
         balance = int(self.balance) if self.balance else 0
@@ -133,21 +273,103 @@ class Account(models.Model):
     def get_tzkt_url(self):
         return f'https://{self.codename}.tzkt.io/{self.address}/'
 
+    def save(self, *args, **kwargs):
+        key = self.__dict__.pop('_wallet_key', None)
+        try:
+            return super().save(*args, **kwargs)
+        except Exception:
+            # an enclosing atomic block rolls the pop back by itself
+            if key and not db_transaction.get_connection().in_atomic_block:
+                WalletKey.objects.create(
+                    blockchain_id=key.blockchain_id,
+                    address=key.address,
+                    crypted_key=key.crypted_key,
+                )
+            raise
+
     def generate_private_key(self):
         if self.crypted_key or not self.owner:
             return
 
-        passphrase = ''.join(
-            random.choice(string.ascii_letters) for i in range(42)
-        )
+        key = None
+        if self.provider.uses_key_pool():
+            key = WalletKey.objects.pop(self.blockchain)
+        if key:
+            self.address = key.address
+            self.crypted_key = key.crypted_key
+            # back to the pool if save() fails
+            self._wallet_key = key
+            return
 
+        logger.info(f'Key pool of {self.blockchain} empty, deriving a key')
         self.address, private_key = (
-            self.blockchain.provider.create_wallet(passphrase)
+            self.blockchain.provider.create_wallet(passphrase())
         )
 
         self.crypted_key = encrypt(private_key)
 
 
+class WalletKeyManager(models.Manager):
+    def pop(self, blockchain):
+        with db_transaction.atomic():
+            key = self.select_for_update(skip_locked=True).filter(
+                blockchain=blockchain,
+            ).order_by('pk').first()
+            if key:
+                key.delete()
+        return key
+
+
+class WalletKey(models.Model):
+    """
+    Pre-derived wallet, waiting to be assigned to a new Account.
+
+    Filled by the djtezos_keys management command.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    blockchain = models.ForeignKey(
+        'Blockchain',
+        on_delete=models.CASCADE,
+    )
+    address = models.CharField(max_length=255)
+    crypted_key = models.BinaryField()
+
+    objects = WalletKeyManager()
+
+    def __str__(self):
+        return self.address
+
+
+class Provision(models.Model):
+    """
+    Request to fund an address, see Provider.provision_batch.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    blockchain = models.ForeignKey(
+        'Blockchain',
+        on_delete=models.CASCADE,
+    )
+    address = models.CharField(max_length=255)
+    amount = models.BigIntegerField(help_text='Amount in xTZ')
+    funder = models.CharField(max_length=255, null=True, blank=True)
+    txhash = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        db_index=True,
+    )
+    branch_level = models.PositiveIntegerField(null=True, blank=True)
+    level = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text='Of the block that includes the funding operation',
+    )
+
+    def __str__(self):
+        return f'{self.amount}xTZ to {self.address}'
+
+
 class Blockchain(models.Model):
     name = models.CharField(max_length=100)
     endpoint = models.CharField(max_length=255)
@@ -162,10 +384,28 @@ class Blockchain(models.Model):
     is_active = models.BooleanField(default=True)
     max_level = models.PositiveIntegerField(default=None, blank=True, null=True)
     min_level = models.PositiveIntegerField(default=None, blank=True, null=True)
+    fee_percentiles = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text='Fee percentile to target per priority, ie. {"high": 95}',
+    )
+    fee_samples = models.JSONField(
+        default=list,
+        blank=True,
+        editable=False,
+        help_text='[fee per gas, fee per byte] in nanotez of recent operations',
+    )
 
     def __str__(self):
         return self.name
 
+    def get_fee_percentile(self, priority):
+        name = dict(Transaction.PRIORITY_CHOICES)[priority]
+        return self.fee_percentiles.get(
+            name,
+            SETTINGS['FEE_PERCENTILES'][name],
+        )
+
     @property
     def provider(self):
         parts = self.provider_class.split('.')
@@ -175,12 +415,345 @@ class Blockchain(models.Model):
         return getattr(mod, parts[-1])(self)
 
 
-class TransactionQuerySet(InheritanceQuerySetMixin, models.QuerySet):
+class SenderPool(models.Model):
+    """
+    Hot wallets sharing the load of platform-originated transactions.
+
+    A Transaction with a pool and no sender gets the least loaded Account of
+    the pool as sender when dispatched, see djtezos_write.
+    """
+    name = models.CharField(max_length=100)
+    blockchain = models.ForeignKey(
+        'Blockchain',
+        on_delete=models.CASCADE,
+    )
+    min_balance = models.DecimalField(
+        max_digits=18,
+        decimal_places=9,
+        default=0,
+        help_text='Accounts below this balance get refilled by richer ones',
+    )
+
+    def __str__(self):
+        return self.name
+
+    def accounts(self):
+        return self.account_set.exclude(
+            Q(balance=None) | Q(balance=0)
+        ).annotate(
+            inflight=Count(
+                'transactions_sent',
+                filter=Q(transactions_sent__state__in=Transaction.inflight_states),
+            )
+        )
+
+    def dispatch(self):
+        """Assign a sender to each pending transaction of the pool."""
+        pending = self.transaction_set.filter(
+            sender=None,
+            state__in=('deploy', 'retrying'),
+        ).order_by('created_at').values_list('pk', flat=True)
+        if not pending:
+            return
+
+        accounts = list(self.accounts())
+        if not accounts:
+            logger.error(f'SenderPool({self}) has no funded account')
+            return
+
+        for pk in pending:
+            account = min(
+                accounts,
+                key=lambda account: (account.inflight, -account.balance),
+            )
+            # update() on sender=None so that concurrent dispatchers don't
+            # assign the same transaction twice
+            if Transaction.objects.filter(pk=pk, sender=None).update(
+                sender=account,
+            ):
+                account.inflight += 1
+                logger.info(f'SenderPool({self}) dispatched {pk} to {account}')
+
+    def rebalance(self):
+        """
+        Queue transfers from the richest accounts to the poorest ones.
+
+        Balances are those of the last sync corrected with what the
+        transactions it doesn't reflect yet will spend or bring, so that a
+        refill is counted until the balance of its receiver is synced again.
+        """
+        if not self.min_balance:
+            return
+
+        spent = Transaction.objects.filter(
+            sender=OuterRef('pk'),
+        ).unsynced(
+            OuterRef('balance_updated_at'),
+        ).order_by().values('sender').annotate(
+            total=Sum(spend()),
+        ).values('total')
+        received = Transaction.objects.filter(
+            receiver=OuterRef('pk'),
+        ).unsynced(
+            OuterRef('balance_updated_at'),
+            states=Transaction.inflight_states,
+        ).order_by().values('receiver').annotate(
+            total=Sum('amount'),
+        ).values('total')
+        accounts = list(self.account_set.exclude(balance=None).annotate(
+            available=ExpressionWrapper(
+                F('balance') * 1_000_000
+                - Coalesce(Subquery(spent), 0)
+                + Coalesce(Subquery(received), 0),
+                output_field=DecimalField(),
+            ),
+        ))
+        if len(accounts) < 2:
+            return
+
+        # in xTZ from here
+        min_balance = self.min_balance * 1_000_000
+        target = sum(account.available for account in accounts) / len(accounts)
+        if target <= min_balance:
+            logger.error(f'SenderPool({self}) balance too low to rebalance')
+            return
+
+        for account in accounts:
+            if account.available >= min_balance:
+                continue
+            richest = max(accounts, key=lambda account: account.available)
+            amount = int(target - account.available)
+            if richest.available - amount < min_balance:
+                continue
+            Transaction.objects.create(
+                sender=richest,
+                receiver=account,
+                amount=amount,
+                state='deploy',
+            )
+            richest.available -= amount
+            account.available += amount
+            logger.info(f'SenderPool({self}) refilling {account} from {richest}')
+
+
+class CodeManager(models.Manager):
+    def store(self, data):
+        """Return the Code of data, create it if it's new."""
+        code, created = self.get_or_create(
+            hash=Code.digest(data),
+            defaults=dict(data=zlib.compress(data), size=len(data)),
+        )
+        return code
+
+
+@functools.lru_cache(maxsize=256)
+def decompress(hash, data):
+    return zlib.decompress(data)
+
+
+class Code(models.Model):
+    """
+    Contract Micheline or source, compressed and stored once per content.
+    """
+    hash = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField(help_text='Uncompressed size in bytes')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = CodeManager()
+
+    def __str__(self):
+        return self.hash
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def dumps(micheline):
+        return json.dumps(
+            micheline,
+            separators=(',', ':'),
+            sort_keys=True,
+        ).encode('utf8')
+
+    @property
+    def content(self):
+        return decompress(self.hash, bytes(self.data))
+
+
+class GlobalConstant(models.Model):
+    """
+    Micheline expression registered as a global constant of a blockchain,
+    by the origination of transaction or before it was tracked here.
+    """
+    blockchain = models.ForeignKey(
+        Blockchain,
+        related_name='global_constants',
+        on_delete=models.CASCADE,
+    )
+    hash = models.CharField(max_length=54, help_text='Script expression hash')
+    code = models.ForeignKey(
+        Code,
+        related_name='+',
+        on_delete=models.PROTECT,
+    )
+    transaction = models.ForeignKey(
+        'Transaction',
+        null=True,
+        blank=True,
+        related_name='+',
+        on_delete=models.SET_NULL,
+        help_text='Origination that registers the constant',
+    )
+    registered = models.BooleanField(
+        default=False,
+        help_text='Found on chain, see is_registered',
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (('blockchain', 'hash'),)
+
+    def __str__(self):
+        return self.hash
+
+    @property
+    def is_registered(self):
+        return self.registered or bool(
+            self.transaction_id and self.transaction.state == 'done'
+        )
+
+
+def spend():
+    """Expression of the xTZ a transaction takes from its sender."""
+    estimates = SETTINGS['FEE_ESTIMATES']
+    return ExpressionWrapper(
+        Coalesce('amount', 0) + Coalesce('gas', Case(
+            When(function__isnull=False, then=Value(estimates['call'])),
+            When(amount__isnull=False, then=Value(estimates['transfer'])),
+            default=Value(estimates['originate']),
+        )),
+        output_field=BigIntegerField(),
+    )
+
+
+class ParticipantQuerySetMixin:
     def for_user(self, user):
+        """
+        Transactions that user sends, receives or participates in.
+
+        Use subqueries rather than joins so that rows are not duplicated by
+        the users relation and the planner can walk the created_at index for
+        the latest transactions.
+        """
+        accounts = Account.objects.filter(owner=user).values('pk')
+        users = self.model.users
         return self.filter(
-            Q(sender__owner=user)
-            | Q(receiver__owner=user)
-            | Q(users=user)
+            Q(sender__in=accounts)
+            | Q(receiver__in=accounts)
+            | Q(Exists(users.through.objects.filter(**{
+                users.field.m2m_field_name(): OuterRef('pk'),
+                'user': user,
+            })))
+        )
+
+
+class TransactionQuerySet(
+    InheritanceQuerySetMixin,
+    ParticipantQuerySetMixin,
+    models.QuerySet,
+):
+
+    def with_available(self):
+        """
+        Annotate spend and the available balance of the sender, in xTZ.
+
+        Available balance is the last known balance minus what in flight
+        transactions and transactions done since it was synced will spend.
+        """
+        reserved = Transaction.objects.filter(
+            sender=OuterRef('sender'),
+        ).unsynced(
+            OuterRef('sender__balance_updated_at'),
+        ).order_by().values('sender').annotate(
+            total=Sum(spend()),
+        ).values('total')
+
+        return self.annotate(
+            spend=spend(),
+            available=ExpressionWrapper(
+                F('sender__balance') * 1_000_000
+                - Coalesce(Subquery(reserved), 0),
+                output_field=DecimalField(),
+            ),
+        )
+
+    def unsynced(self, since, states=None):
+        """
+        Transactions that a balance synced at since doesn't reflect yet.
+
+        Those in states, spending_states by default, and those done after.
+        """
+        return self.filter(
+            Q(state__in=states or Transaction.spending_states)
+            | Q(state='done', updated_at__gt=since)
+        )
+
+    def fair(self):
+        """
+        Order by in flight transactions of the sender owner, then oldest.
+
+        So that an owner with many queued transactions doesn't delay those of
+        other owners.
+        """
+        inflight = Transaction.objects.filter(
+            sender__owner=OuterRef('sender__owner'),
+            state__in=Transaction.spending_states,
+        ).order_by().values('sender__owner').annotate(
+            total=Count('pk'),
+        ).values('total')
+
+        return self.annotate(
+            owner_inflight=Coalesce(Subquery(inflight), 0),
+        ).order_by(
+            'owner_inflight',
+            F('last_fail').asc(nulls_first=True),
+            'created_at',
+        )
+
+    def state_set(self, state, error=None, **fields):
+        """
+        Set the state of the transactions with one update and record their
+        transitions, return how many.
+        """
+        with db_transaction.atomic():
+            pks = list(self.select_for_update(of=('self',)).values_list(
+                'pk',
+                flat=True,
+            ))
+            if not pks:
+                return 0
+            fields.update(state=state, updated_at=timezone.now())
+            if error is not None:
+                fields['error'] = error
+            Transaction.objects.filter(pk__in=pks).update(**fields)
+            StateTransition.objects.bulk_create([
+                StateTransition(
+                    transaction_id=pk,
+                    state=state,
+                    error=error or '',
+                )
+                for pk in pks
+            ])
+        return len(pks)
+
+    def affordable(self):
+        return self.with_available().filter(available__gte=F('spend'))
+
+    def unaffordable(self):
+        return self.with_available().filter(
+            Q(available__lt=F('spend')) | Q(available=None)
         )
 
 
@@ -188,12 +761,137 @@ class TransactionManager(InheritanceManagerMixin, models.Manager):
     def get_queryset(self):
         return TransactionQuerySet(self.model)
 
+    def bulk_enqueue(self, transactions, batch_size=1000):
+        """
+        Validate and insert transactions in batches, return how many.
+
+        transactions may be any iterable, such as a generator, of
+        Transaction instances or dicts of field values with an optional
+        users list, it's consumed batch_size at a time.
+        """
+        transactions = iter(transactions)
+        count = 0
+        while True:
+            batch = list(itertools.islice(transactions, batch_size))
+            if not batch:
+                return count
+            self._enqueue_batch(batch)
+            count += len(batch)
+
+    def _enqueue_batch(self, batch):
+        users = dict()
+        objs = []
+        for item in batch:
+            if isinstance(item, dict):
+                item = dict(item)
+                item_users = item.pop('users', [])
+                item = self.model(**item)
+                if item_users:
+                    users[item.pk] = item_users
+            objs.append(item)
+
+        # one query to resolve contract names, addresses and codes of the
+        # batch
+        contract_ids = {obj.contract_id for obj in objs if obj.contract_id}
+        contracts = {
+            pk: (name, address, code)
+            for pk, name, address, code in Transaction.objects.filter(
+                pk__in=contract_ids,
+            ).values_list(
+                'pk',
+                'contract_name',
+                'contract_address',
+                'micheline_code',
+            )
+        } if contract_ids else {}
+        contract_codes = {
+            pk: code for pk, (name, address, code) in contracts.items()
+        }
+        codes = dict()
+        for obj in objs:
+            if obj.contract_id in contracts:
+                name, address, code = contracts[obj.contract_id]
+                obj.contract_name = obj.contract_name or name
+                obj.contract_address = obj.contract_address or address
+            obj.validate(contract_codes)
+            obj.store_code(codes)
+
+        Through = self.model.users.through
+        with db_transaction.atomic():
+            self.bulk_create(objs)
+            StateTransition.objects.bulk_create([
+                StateTransition(transaction=obj, state=obj.state)
+                for obj in objs
+            ])
+            Through.objects.bulk_create([
+                Through(transaction_id=pk, user_id=getattr(user, 'pk', user))
+                for pk, item_users in users.items()
+                for user in item_users
+            ])
+
+    def archive(self, before, batch_size=1000):
+        """
+        Move one batch of transactions finished before a datetime to
+        ArchivedTransaction, return how many.
+
+        Each batch is committed on its own so that archiving can stop and
+        resume at any time. Contracts stay, calls keep referencing them.
+        Transitions are frozen into the history of archived transactions,
+        those that an active webhook has not delivered yet stay live.
+        """
+        transactions = Transaction.objects.filter(
+            state__in=Transaction.finished_states,
+            updated_at__lt=before,
+        ).exclude(
+            function=None,
+            amount=None,
+        )
+        for webhook in Webhook.objects.filter(is_active=True):
+            transactions = transactions.exclude(
+                pk__in=webhook.pending().values('transaction'),
+            )
+
+        with db_transaction.atomic():
+            transactions = list(
+                transactions.order_by(
+                    'updated_at'
+                ).select_for_update(
+                    skip_locked=True,
+                ).prefetch_related(
+                    'transitions',
+                    'users',
+                )[:batch_size]
+            )
+            if not transactions:
+                return 0
+
+            ArchivedTransaction.objects.bulk_create(
+                [
+                    ArchivedTransaction.from_transaction(transaction)
+                    for transaction in transactions
+                ],
+                ignore_conflicts=True,
+            )
+            Through = ArchivedTransaction.users.through
+            Through.objects.bulk_create(
+                [
+                    Through(archivedtransaction_id=transaction.pk, user=user)
+                    for transaction in transactions
+                    for user in transaction.users.all()
+                ],
+                ignore_conflicts=True,
+            )
+            Transaction.objects.filter(
+                pk__in=[transaction.pk for transaction in transactions],
+            ).delete()
+        return len(transactions)
+
 
 class Transaction(models.Model):
     id = models.UUIDField(
         primary_key=True,
         editable=False,
-        default=uuid.uuid4
+        default=uuid7,
     )
     sender = models.ForeignKey(
         'Account',
@@ -212,6 +910,13 @@ class Transaction(models.Model):
         settings.AUTH_USER_MODEL,
         blank=True,
     )
+    pool = models.ForeignKey(
+        'SenderPool',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        help_text='Pick the sender from this pool when sender is empty',
+    )
     created_at = models.DateTimeField(
         null=True,
         blank=True,
@@ -222,18 +927,50 @@ class Transaction(models.Model):
         blank=True,
         auto_now=True,
     )
-    txhash = models.CharField(
+    txhash = OperationHashField(
         unique=True,
         max_length=255,
         null=True,
         blank=True,
     )
+    signed_operation = models.BinaryField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='Signed operation bytes, persisted before injection',
+    )
     gasprice = models.BigIntegerField(blank=True, null=True)
     gas = models.BigIntegerField(blank=True, null=True)
-    contract_address = models.CharField(max_length=255, null=True)
+    fee = models.BigIntegerField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text='Fee in xTZ chosen at injection',
+    )
+    fee_percentile = models.PositiveSmallIntegerField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text='Percentile of recent fees that fee was chosen to reach',
+    )
+    contract_address = AddressField(max_length=255, null=True, db_index=True)
     contract_name = models.CharField(max_length=100, null=True)
-    contract_source = models.TextField(null=True, blank=True)
-    contract_micheline = models.JSONField(null=True, blank=True, default=list)
+    micheline_code = models.ForeignKey(
+        Code,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='+',
+        on_delete=models.PROTECT,
+    )
+    source_code = models.ForeignKey(
+        Code,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='+',
+        on_delete=models.PROTECT,
+    )
     contract = models.ForeignKey(
         'self',
         null=True,
@@ -248,8 +985,8 @@ class Transaction(models.Model):
         db_index=True,
     )
     args = models.JSONField(null=True, default=list, blank=True)
-    args_mich = models.JSONField(null=True, default=list, blank=True)
-    amount = models.PositiveIntegerField(
+    args_mich = models.JSONField(null=True, default=None, blank=True)
+    amount = models.PositiveBigIntegerField(
         null=True,
         blank=True,
         help_text='Amount in xTZ',
@@ -260,6 +997,19 @@ class Transaction(models.Model):
         blank=True,
         db_index=True,
     )
+    block_hash = BlockHashField(
+        max_length=255,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='Block the operation was included in, to detect reorgs',
+    )
+    branch_level = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='Level of the block the operation was forged against',
+    )
     last_fail = models.DateTimeField(
         null=True,
         blank=True,
@@ -282,12 +1032,42 @@ class Transaction(models.Model):
         max_length=200,
         db_index=True,
     )
+    PRIORITY_CHOICES = (
+        (0, 'low'),
+        (1, 'normal'),
+        (2, 'high'),
+    )
+    priority = models.PositiveSmallIntegerField(
+        choices=PRIORITY_CHOICES,
+        default=1,
+        db_index=True,
+    )
     error = models.TextField(blank=True)
-    history = models.JSONField(default=list)
     states = [i[0] for i in STATE_CHOICES]
+    inflight_states = ('deploy', 'deploying', 'retrying', 'watch', 'watching')
+    # states of transactions that may already be spending their sender funds
+    spending_states = ('deploying', 'watch', 'watching')
+    # states that transactions never leave
+    finished_states = ('done', 'aborted')
 
     objects = TransactionManager()
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['created_at', 'id'],
+                name='djtezos_tx_created_id',
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'args' in field_names:
+            # args_mich was encoded from the args as loaded
+            instance._encoded_args = json.dumps(instance.args)
+        return instance
+
     def __str__(self):
         if self.txhash:
             return self.txhash
@@ -304,6 +1084,8 @@ class Transaction(models.Model):
     def blockchain(self):
         if self.sender:
             return self.sender.blockchain
+        elif self.pool:
+            return self.pool.blockchain
 
     @property
     def explorer_link(self):
@@ -313,7 +1095,100 @@ class Transaction(models.Model):
     def provider(self):
         return self.sender.blockchain.provider
 
-    def save(self, *args, **kwargs):
+    @property
+    def contract_micheline(self):
+        if '_contract_micheline' not in self.__dict__:
+            self._contract_micheline = json.loads(
+                self.micheline_code.content
+            ) if self.micheline_code_id else []
+        return self._contract_micheline
+
+    @contract_micheline.setter
+    def contract_micheline(self, value):
+        self._contract_micheline = value
+        self._code_changed = True
+
+    @property
+    def contract_source(self):
+        if '_contract_source' not in self.__dict__:
+            self._contract_source = self.source_code.content.decode(
+                'utf8'
+            ) if self.source_code_id else None
+        return self._contract_source
+
+    @contract_source.setter
+    def contract_source(self, value):
+        self._contract_source = value
+        self._code_changed = True
+
+    def store_code(self, codes=None):
+        """
+        Point to the Code of contract_micheline and contract_source if they
+        were set, codes is a dict of Code by hash shared by a batch.
+        """
+        if not self.__dict__.pop('_code_changed', False):
+            return
+        codes = {} if codes is None else codes
+
+        def store(data):
+            digest = Code.digest(data)
+            if digest not in codes:
+                codes[digest] = Code.objects.store(data)
+            return codes[digest]
+
+        micheline = self.__dict__.get('_contract_micheline', None)
+        if '_contract_micheline' in self.__dict__:
+            self.micheline_code = store(
+                Code.dumps(micheline)
+            ) if micheline else None
+        source = self.__dict__.get('_contract_source', None)
+        if '_contract_source' in self.__dict__:
+            self.source_code = store(
+                source.encode('utf8')
+            ) if source else None
+
+    def encode_args(self, contract_codes=None):
+        """
+        Encode the args of a call into args_mich with the entrypoint schema
+        of the contract, raise ValidationError if they don't match it.
+
+        contract_codes is a dict of micheline code hash by contract pk shared
+        by a batch. Args are encoded again only when they change, and calls
+        to contracts without code keep args_mich None, the provider encodes
+        them at deploy time.
+        """
+        if (
+            not self.function
+            or self.txhash
+            or 'args' in self.get_deferred_fields()
+        ):
+            return
+        encoded = json.dumps(self.args)
+        if self.__dict__.get('_encoded_args') == encoded:
+            return
+
+        if not self.contract_id:
+            code_hash = None
+        elif contract_codes is None:
+            code_hash = self.contract.micheline_code_id
+        else:
+            if self.contract_id not in contract_codes:
+                contract_codes[self.contract_id] = Transaction.objects.filter(
+                    pk=self.contract_id,
+                ).values_list('micheline_code', flat=True).first()
+            code_hash = contract_codes[self.contract_id]
+
+        args_mich = None
+        if code_hash and self.blockchain:
+            args_mich = self.blockchain.provider.encode_args(
+                code_hash,
+                self.function,
+                self.args,
+            )
+        self.args_mich = args_mich
+        self._encoded_args = encoded
+
+    def validate(self, contract_codes=None):
         if (
             not self.amount
             and not self.function
@@ -322,15 +1197,21 @@ class Transaction(models.Model):
         ):
             raise ValidationError('Requires amount, function or micheline')
 
+        if self.state not in self.states:
+            raise Exception('Invalid state', self.state)
+
+        self.encode_args(contract_codes)
+
+    def save(self, *args, **kwargs):
+        self.validate()
+
         if self.contract_id and not self.contract_name:
             self.contract_name = self.contract.contract_name
 
         if self.contract_id and not self.contract_address:
             self.contract_address = self.contract.contract_address
 
-        if self.state not in self.states:
-            raise Exception('Invalid state', self.state)
-
+        self.store_code()
         return super().save(*args, **kwargs)
 
     def call(self, **kwargs):
@@ -339,13 +1220,26 @@ class Transaction(models.Model):
             **kwargs
         )
 
-    def state_set(self, state):
+    @property
+    def history(self):
+        """
+        Transitions in the [[state, timestamp], ...] shape of the former
+        history JSON field.
+        """
+        return [
+            [transition.state, int(transition.created_at.timestamp())]
+            for transition in sorted(
+                self.transitions.all(),
+                key=lambda transition: (transition.created_at, transition.pk),
+            )
+        ]
+
+    def state_set(self, state, error=None):
         self.state = state
-        self.history.append([
-            self.state,
-            int(datetime.datetime.now().strftime('%s')),
-        ])
+        if error is not None:
+            self.error = error
         self.save()
+        self.transitions.create(state=state, error=error or '')
         logger.info(f'Tx({self}).state set to {self.state}')
         # ensure commit happens, is it really necessary ?
         # not sure why not
@@ -360,6 +1254,354 @@ class Transaction(models.Model):
         return f'https://better-call.dev/search?text={self.txhash or self.contract_address}'
 
 
+class StateTransitionQuerySet(models.QuerySet):
+    def settled_id(self):
+        """
+        Return the id up to which transitions are older than EVENTS_SETTLE
+        seconds.
+
+        Ids are allocated on insert but rows show on commit, so a cursor
+        moved past a fresh transition could skip one with a lower id that
+        is committed later. created_at is also set on insert, so that holds
+        only for transactions shorter than EVENTS_SETTLE.
+        """
+        horizon = timezone.now() - datetime.timedelta(
+            seconds=SETTINGS['EVENTS_SETTLE'],
+        )
+        young = self.filter(created_at__gt=horizon).aggregate(
+            pk=Min('pk'),
+        )['pk']
+        if young is not None:
+            return young - 1
+        return self.aggregate(pk=Max('pk'))['pk'] or 0
+
+    def settled(self, limit):
+        """Return up to limit settled transitions in id order."""
+        return list(self.filter(
+            pk__lte=StateTransition.objects.settled_id(),
+        ).order_by('pk')[:limit])
+
+
+class StateTransition(models.Model):
+    """
+    State set on a transaction, the id orders events for streaming.
+
+    Append only: one insert per state_set() instead of rewriting a list.
+    """
+    transaction = models.ForeignKey(
+        Transaction,
+        related_name='transitions',
+        on_delete=models.CASCADE,
+    )
+    state = models.CharField(max_length=200)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    error = models.TextField(blank=True)
+
+    objects = StateTransitionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['state', 'created_at'],
+                name='djtezos_transition_state',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.transaction_id} {self.state}'
+
+    def as_event(self):
+        return dict(
+            id=str(self.transaction_id),
+            state=self.state,
+            created_at=self.created_at.isoformat(),
+        )
+
+
+class ArchivedTransactionQuerySet(ParticipantQuerySetMixin, models.QuerySet):
+    pass
+
+
+class ArchivedTransaction(models.Model):
+    """
+    Finished transaction moved out of the live table by djtezos_archive.
+
+    Only keeps what is read after the fact, with history frozen from the
+    transitions.
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    sender = models.ForeignKey(
+        'Account',
+        related_name='+',
+        null=True,
+        on_delete=models.CASCADE,
+    )
+    receiver = models.ForeignKey(
+        'Account',
+        related_name='+',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+    )
+    users = models.ManyToManyField(
+        settings.AUTH_USER_MODEL,
+        related_name='+',
+        blank=True,
+    )
+    contract = models.ForeignKey(
+        Transaction,
+        related_name='+',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+    )
+    created_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    txhash = OperationHashField(
+        max_length=255,
+        null=True,
+        blank=True,
+        db_index=True,
+    )
+    gasprice = models.BigIntegerField(blank=True, null=True)
+    gas = models.BigIntegerField(blank=True, null=True)
+    fee = models.BigIntegerField(blank=True, null=True)
+    fee_percentile = models.PositiveSmallIntegerField(blank=True, null=True)
+    priority = models.PositiveSmallIntegerField(
+        choices=Transaction.PRIORITY_CHOICES,
+        default=1,
+    )
+    contract_address = AddressField(max_length=255, null=True)
+    contract_name = models.CharField(max_length=100, null=True)
+    function = models.CharField(max_length=100, null=True, blank=True)
+    args = models.JSONField(null=True, default=list, blank=True)
+    amount = models.PositiveBigIntegerField(null=True, blank=True)
+    level = models.PositiveIntegerField(null=True, blank=True)
+    state = models.CharField(
+        choices=Transaction.STATE_CHOICES,
+        max_length=200,
+    )
+    error = models.TextField(blank=True)
+    history = models.JSONField(default=list)
+
+    # contracts are not archived
+    contract_micheline = None
+
+    objects = ArchivedTransactionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['created_at', 'id'],
+                name='djtezos_archive_created_id',
+            ),
+        ]
+
+    __str__ = Transaction.__str__
+    blockchain = Transaction.blockchain
+    pool = None
+
+    @classmethod
+    def from_transaction(cls, transaction):
+        return cls(
+            history=transaction.history,
+            **{
+                field.attname: getattr(transaction, field.attname)
+                for field in cls._meta.concrete_fields
+                if field.name != 'history'
+            },
+        )
+
+
+def webhook_secret():
+    return secrets.token_hex(32)
+
+
+class Webhook(models.Model):
+    """
+    Endpoint that djtezos_webhooks POSTs batches of state transitions to.
+
+    StateTransition is the outbox: cursor is the id of the last transition
+    delivered, so that recording a transition costs nothing more than its
+    insert. Only settled transitions are delivered, see
+    StateTransitionQuerySet.settled_id().
+    """
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        help_text='Only send transactions of this user, all if empty',
+    )
+    url = models.URLField()
+    secret = models.CharField(
+        max_length=200,
+        default=webhook_secret,
+        help_text='Key of the HMAC-SHA256 signature of request bodies',
+    )
+    states = models.JSONField(
+        default=list,
+        blank=True,
+        help_text='Only send transitions to these states, all if empty',
+    )
+    is_active = models.BooleanField(default=True)
+    cursor = models.BigIntegerField(null=True, blank=True)
+    delivered = models.BigIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.url
+
+    def save(self, *args, **kwargs):
+        if self.cursor is None:
+            # start with transitions after creation
+            self.cursor = StateTransition.objects.aggregate(
+                cursor=models.Max('pk'),
+            )['cursor'] or 0
+        return super().save(*args, **kwargs)
+
+    @staticmethod
+    def signature(secret, body):
+        return hmac.new(
+            secret.encode('utf8'),
+            body,
+            hashlib.sha256,
+        ).hexdigest()
+
+    def pending(self):
+        transitions = StateTransition.objects.filter(pk__gt=self.cursor)
+        if self.owner_id:
+            transitions = transitions.filter(
+                transaction__in=Transaction.objects.all().for_user(
+                    self.owner
+                ).values('pk'),
+            )
+        if self.states:
+            transitions = transitions.filter(state__in=self.states)
+        return transitions.order_by('pk')
+
+    def next_batch(self):
+        """
+        Return the next transitions to deliver and the cursor after them.
+
+        Unless the batch is full, the cursor moves past every settled
+        transition, also those that owner and states skip, so that they are
+        not scanned again.
+        """
+        settled_id = StateTransition.objects.settled_id()
+        transitions = list(self.pending().filter(
+            pk__lte=settled_id,
+        )[:SETTINGS['WEBHOOK_BATCH']])
+        if len(transitions) == SETTINGS['WEBHOOK_BATCH']:
+            return transitions, transitions[-1].pk
+        return transitions, max(settled_id, self.cursor)
+
+    def failed(self, error):
+        """Reschedule the next attempt with exponential backoff."""
+        self.failures += 1
+        low, high = SETTINGS['WEBHOOK_BACKOFF']
+        delay = min(low * 2 ** (self.failures - 1), high)
+        self.next_attempt_at = timezone.now() + datetime.timedelta(
+            seconds=delay,
+        )
+        self.last_error = str(error)
+        self.save()
+
+
+class QueueClassManager(models.Manager):
+    def pick(self, active):
+        """
+        Return the QueueClass to deploy from, among active (priority, kind).
+
+        Stride scheduling: the class with the lowest pass is picked and its
+        pass advances by the inverse of its weight.
+        """
+        with db_transaction.atomic():
+            classes = list(self.select_for_update().order_by('pk'))
+            missing = set(active) - {
+                (queue_class.priority, queue_class.kind)
+                for queue_class in classes
+            }
+            if missing:
+                # another writer may be creating them too
+                self.bulk_create(
+                    [
+                        self.model(priority=priority, kind=kind)
+                        for priority, kind in sorted(missing)
+                    ],
+                    ignore_conflicts=True,
+                )
+                classes = list(self.select_for_update().order_by('pk'))
+            candidates = [
+                queue_class for queue_class in classes
+                if (queue_class.priority, queue_class.kind) in active
+            ]
+            chosen = min(
+                candidates,
+                key=lambda queue: (queue.pass_value, -queue.priority),
+            )
+            # idle classes must not bank credit while they have nothing queued
+            self.exclude(
+                pk__in=[queue_class.pk for queue_class in candidates],
+            ).filter(
+                pass_value__lt=chosen.pass_value,
+            ).update(pass_value=chosen.pass_value)
+            chosen.pass_value += 1 / chosen.weight
+            chosen.save()
+        return chosen
+
+
+class QueueClass(models.Model):
+    """
+    Scheduling state and queue wait statistics of a (priority, kind) class.
+    """
+    KIND_CHOICES = (
+        ('transfer', _('Transfer')),
+        ('contract', _('Contract')),
+        ('call', _('Call')),
+    )
+    priority = models.PositiveSmallIntegerField(
+        choices=Transaction.PRIORITY_CHOICES,
+    )
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    pass_value = models.FloatField(default=0)
+    dispatched = models.PositiveIntegerField(default=0)
+    total_wait = models.FloatField(
+        default=0,
+        help_text='Seconds dispatched transactions waited in queue',
+    )
+    max_wait = models.FloatField(default=0)
+
+    objects = QueueClassManager()
+
+    class Meta:
+        unique_together = (('priority', 'kind'),)
+
+    def __str__(self):
+        return f'{self.get_priority_display()} {self.kind}'
+
+    @property
+    def weight(self):
+        return SETTINGS['PRIORITY_WEIGHTS'][self.get_priority_display()]
+
+    @property
+    def average_wait(self):
+        return self.total_wait / self.dispatched if self.dispatched else 0
+
+    def dispatch(self, transaction):
+        """Record the time transaction waited in queue."""
+        since = transaction.last_fail or transaction.created_at
+        wait = (timezone.now() - since).total_seconds()
+        QueueClass.objects.filter(pk=self.pk).update(
+            dispatched=F('dispatched') + 1,
+            total_wait=F('total_wait') + wait,
+            max_wait=Greatest('max_wait', Value(wait)),
+        )
+        return wait
+
+
 class ContractManager(TransactionManager):
     def get_queryset(self):
         return super().get_queryset().filter(function=None, amount=None)
@@ -0,0 +1,110 @@
+import base64
+import datetime
+import uuid
+
+from collections import OrderedDict
+
+from django.db.models import F, Q
+from rest_framework import exceptions, pagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Paginate on (created_at, id) descending, without counting rows.
+
+    The cursor encodes the created_at and id of the last row of the page, the
+    next page starts right after it.
+    """
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def encode_cursor(self, obj):
+        created_at = obj.created_at.isoformat() if obj.created_at else ''
+        return base64.urlsafe_b64encode(
+            f'{created_at}|{obj.pk}'.encode('utf8')
+        ).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            created_at, pk = base64.urlsafe_b64decode(
+                cursor.encode('ascii')
+            ).decode('utf8').split('|')
+            if created_at:
+                created_at = datetime.datetime.fromisoformat(created_at)
+            return created_at or None, uuid.UUID(pk)
+        except ValueError:
+            raise exceptions.NotFound('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_querysets([queryset], request, view)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        """
+        Paginate the rows of several querysets as if they were one.
+        """
+        self.request = request
+        size = self.get_page_size(request)
+
+        after = None
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_at, pk = self.decode_cursor(cursor)
+            after = Q(created_at=None, id__lt=pk)
+            if created_at:
+                after = (
+                    Q(created_at__lt=created_at)
+                    | Q(created_at=created_at, id__lt=pk)
+                    | Q(created_at=None)
+                )
+
+        page = []
+        for queryset in querysets:
+            queryset = queryset.order_by(
+                F('created_at').desc(nulls_last=True),
+                '-id',
+            )
+            if after:
+                queryset = queryset.filter(after)
+            page += queryset[:size + 1]
+
+        if len(querysets) > 1:
+            page.sort(
+                key=lambda obj: (
+                    obj.created_at is not None,
+                    obj.created_at or datetime.datetime.min,
+                    obj.pk,
+                ),
+                reverse=True,
+            )
+            page = page[:size + 1]
+        self.next_cursor = None
+        if len(page) > size:
+            page = page[:size]
+            self.next_cursor = self.encode_cursor(page[-1])
+        return page
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor,
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
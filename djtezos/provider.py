@@ -1,3 +1,40 @@
 class BaseProvider:
     def __init__(self, blockchain):
         self.blockchain = blockchain
+
+    @staticmethod
+    def derive_wallet(passphrase):
+        """
+        Return an (address, private_key) tuple for a new wallet.
+
+        This must not touch the database nor the blockchain so that it can run
+        in a process pool, see the djtezos_keys management command.
+        """
+        raise NotImplementedError()
+
+    def create_wallet(self, passphrase):
+        return self.derive_wallet(passphrase)
+
+    def uses_key_pool(self):
+        """
+        Return True if new accounts take keys from the WalletKey pool, that
+        is if derive_wallet() is implemented.
+        """
+        return type(self).derive_wallet is not BaseProvider.derive_wallet
+
+    def encode_args(self, code_hash, function, args):
+        """
+        Return args of a call to function encoded for the contract Code of
+        code_hash, or None to leave encoding to deploy.
+
+        Raise ValidationError if args don't match the function.
+        """
+
+    def provision(self, address):
+        """Queue funding of address, if the blockchain needs it."""
+
+    def provision_batch(self):
+        """Fund queued provisions, see the djtezos_provision command."""
+
+    def watch_mempool(self, blockchain):
+        """Requeue injected transactions that can't be included anymore."""
@@ -34,8 +34,31 @@ class AccountSerializer(serializers.HyperlinkedModelSerializer):
         )
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class ExpandableFieldsMixin:
+    """
+    Drop expandable_fields unless listed in the expand context.
+
+    Nothing is dropped when the context has no expand set.
+    """
+    expandable_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = self.context.get('expand', None)
+        if expand is None:
+            return
+        for name in self.expandable_fields:
+            if name not in expand:
+                self.fields.pop(name)
+
+
+class TransactionSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     blockchain = BlockchainSerializer()
+    contract_micheline = serializers.JSONField(read_only=True)
+    expandable_fields = (
+        'contract_micheline',
+        'args',
+    )
 
     class Meta:
         model = Transaction
@@ -48,6 +71,9 @@ class TransactionSerializer(serializers.ModelSerializer):
             'state',
             'gasprice',
             'gas',
+            'fee',
+            'fee_percentile',
+            'priority',
             'contract_address',
             'contract_name',
             'contract_micheline',
@@ -60,6 +86,8 @@ class TransactionSerializer(serializers.ModelSerializer):
 
 
 class TransactionCreateSerializer(serializers.ModelSerializer):
+    contract_micheline = serializers.JSONField(required=False)
+
     class Meta:
         model = Transaction
         fields = (
@@ -68,6 +96,7 @@ class TransactionCreateSerializer(serializers.ModelSerializer):
             'contract_micheline',
             'function',
             'args',
+            'priority',
         )
 
 
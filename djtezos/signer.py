@@ -0,0 +1,186 @@
+"""
+Signer process holding decrypted keys, see the djtezos_signer command.
+
+Workers send it forged operations over a Unix socket instead of decrypting
+keys themselves. Requests and responses are one JSON line each, several
+may be sent over a connection:
+
+- {"public_keys": [address, ...]} responds {"public_keys": [edpk, ...]}
+- {"sign": [[address, hex message], ...]} responds {"signatures": [...]}
+
+and {"error": "...", "permanent": true} if a request fails, permanent when
+it can't succeed on retry, ie. without a key for the address.
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+from django.db import close_old_connections
+
+from .exceptions import PermanentError, TemporaryError
+from .models import Account
+
+
+logger = logging.getLogger('djtezos.signer')
+
+
+# generic watermark of manager operations, the only messages the signer signs
+WATERMARK = b'\x03'
+
+# public keys by address, they never change
+PUBLIC_KEYS = dict()
+
+# signer clients by socket path, see signer()
+SIGNERS = dict()
+
+
+def signer(path):
+    """Return the Signer of path, which keeps a connection per thread."""
+    if path not in SIGNERS:
+        SIGNERS[path] = Signer(path)
+    return SIGNERS[path]
+
+
+class Signer:
+    """Client of a signer process listening on the Unix socket at path."""
+    timeout = 10
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.local.sock = sock
+        self.local.file = sock.makefile('rb')
+        # forked workers must not share the connection of their parent
+        self.local.pid = os.getpid()
+
+    def close(self):
+        if getattr(self.local, 'sock', None):
+            self.local.file.close()
+            self.local.sock.close()
+        self.local.sock = self.local.file = None
+
+    def send(self, body):
+        """Return the response line to body, reusing the connection."""
+        reused = bool(
+            getattr(self.local, 'sock', None)
+            and self.local.pid == os.getpid()
+        )
+        try:
+            if not reused:
+                self.connect()
+            self.local.sock.sendall(body)
+            response = self.local.file.readline()
+        except OSError as e:
+            self.close()
+            if reused:
+                # the signer may have closed an idle connection
+                return self.send(body)
+            raise TemporaryError(f'Signer {self.path}: {e}')
+        if not response:
+            self.close()
+            if reused:
+                return self.send(body)
+            raise TemporaryError(f'Signer {self.path} closed the connection')
+        return response
+
+    def request(self, **data):
+        response = json.loads(self.send(
+            json.dumps(data).encode('utf8') + b'\n'
+        ))
+        if 'error' in response:
+            error = f'Signer {self.path}: {response["error"]}'
+            if response.get('permanent', False):
+                raise PermanentError(error)
+            raise TemporaryError(error)
+        return response
+
+    def public_key(self, address):
+        if address not in PUBLIC_KEYS:
+            PUBLIC_KEYS[address], = self.request(
+                public_keys=[address],
+            )['public_keys']
+        return PUBLIC_KEYS[address]
+
+    def sign(self, messages):
+        """Return the signatures of a list of (address, message) tuples."""
+        return self.request(sign=[
+            [address, message.hex()] for address, message in messages
+        ])['signatures']
+
+
+class KeyStore:
+    """Keys by address, decrypted from their account on first use."""
+
+    def __init__(self):
+        self.keys = dict()
+        self.lock = threading.Lock()
+
+    def load(self, accounts):
+        from pytezos import Key
+        for account in accounts.exclude(crypted_key=None):
+            self.keys[account.address] = Key.from_secret_exponent(
+                account.private_key
+            )
+        return len(self.keys)
+
+    def get(self, address):
+        with self.lock:
+            if address not in self.keys:
+                close_old_connections()
+                self.load(Account.objects.filter(address=address))
+        if address not in self.keys:
+            raise ValueError(f'No key for {address}')
+        return self.keys[address]
+
+    def handle(self, request):
+        if 'public_keys' in request:
+            return dict(public_keys=[
+                self.get(address).public_key()
+                for address in request['public_keys']
+            ])
+        if 'sign' in request:
+            messages = [
+                (address, bytes.fromhex(message))
+                for address, message in request['sign']
+            ]
+            for address, message in messages:
+                if not message.startswith(WATERMARK):
+                    raise ValueError('Only operations can be signed')
+            return dict(signatures=[
+                self.get(address).sign(message, generic=True)
+                for address, message in messages
+            ])
+        raise ValueError('Unknown request')
+
+
+class SignerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.keys.handle(json.loads(line))
+            except (ValueError, TypeError, KeyError) as e:
+                response = dict(error=str(e), permanent=True)
+            except Exception as e:
+                logger.exception(e)
+                response = dict(error=f'{type(e).__name__}: {e}')
+            self.wfile.write(json.dumps(response).encode('utf8') + b'\n')
+
+
+class SignerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, keys):
+        self.keys = keys
+        super().__init__(path, SignerHandler)
@@ -0,0 +1,144 @@
+import datetime
+import pytest
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from djtezos.models import (
+    Account,
+    ArchivedTransaction,
+    StateTransition,
+    Transaction,
+    Webhook,
+)
+from djtezos.views import TransactionViewSet
+
+
+@pytest.fixture
+def account(fake, user):
+    return Account.objects.create(owner=user, blockchain=fake)
+
+
+def finished(days, **kwargs):
+    tx = Transaction.objects.create(state='deploy', **kwargs)
+    tx.state_set('done')
+    Transaction.objects.filter(pk=tx.pk).update(
+        updated_at=timezone.now() - datetime.timedelta(days=days),
+    )
+    return tx
+
+
+@pytest.mark.django_db
+def test_archive(account, user):
+    contract = finished(
+        100,
+        sender=account,
+        contract_name='token',
+        contract_micheline=[dict(prim='code')],
+    )
+    old = finished(
+        100,
+        contract=contract,
+        function='replace',
+        args=[1],
+    )
+    old.users.add(user)
+    transfer = finished(100, sender=account, amount=1)
+    recent = finished(1, sender=account, amount=2)
+    watching = Transaction.objects.create(
+        sender=account,
+        amount=3,
+        state='watching',
+    )
+    Transaction.objects.filter(pk=watching.pk).update(
+        updated_at=timezone.now() - datetime.timedelta(days=100),
+    )
+
+    # batches of 1 to check that it goes on until nothing is left
+    call_command('djtezos_archive', days=90, batch=1)
+
+    assert set(Transaction.objects.values_list('pk', flat=True)) == {
+        contract.pk,
+        recent.pk,
+        watching.pk,
+    }
+    archived = ArchivedTransaction.objects.get(pk=old.pk)
+    assert archived.contract == contract
+    assert archived.args == [1]
+    assert [state for state, timestamp in archived.history] == ['done']
+    assert list(archived.users.all()) == [user]
+    assert set(
+        ArchivedTransaction.objects.for_user(user).values_list('pk', flat=True)
+    ) == {old.pk, transfer.pk}
+
+    # nothing left to archive
+    call_command('djtezos_archive', days=90)
+    assert ArchivedTransaction.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_archive_webhooks(account):
+    webhook = Webhook.objects.create(url='http://hook/', cursor=0)
+    Webhook.objects.create(url='http://inactive/', cursor=0, is_active=False)
+    tx = finished(100, sender=account, amount=1)
+
+    # its transitions are not delivered yet
+    call_command('djtezos_archive', days=90)
+    assert Transaction.objects.filter(pk=tx.pk).exists()
+
+    webhook.cursor = StateTransition.objects.get(transaction=tx).pk
+    webhook.save()
+    call_command('djtezos_archive', days=90)
+    assert not Transaction.objects.filter(pk=tx.pk).exists()
+    assert ArchivedTransaction.objects.filter(pk=tx.pk).exists()
+
+
+@pytest.mark.django_db
+def test_archive_filtered_webhooks(account, user):
+    other = get_user_model().objects.create(username='other')
+    Webhook.objects.create(url='http://hook/', owner=other, cursor=0)
+    Webhook.objects.create(url='http://hook/', states=['aborted'], cursor=0)
+
+    # transitions no webhook would deliver don't hold archiving back
+    tx = finished(100, sender=account, amount=1)
+    assert Transaction.objects.archive(timezone.now()) == 1
+
+    tx = finished(100, sender=account, amount=1)
+    tx.users.add(other)
+    assert Transaction.objects.archive(timezone.now()) == 0
+
+
+def view(user, action, path, **kwargs):
+    request = APIRequestFactory().get(path)
+    force_authenticate(request, user=user)
+    return TransactionViewSet.as_view({'get': action})(request, **kwargs)
+
+
+@pytest.mark.django_db
+def test_archive_reads(account, user, settings):
+    # hyperlinked blockchain and transaction urls
+    settings.ROOT_URLCONF = 'djtezos.test_views'
+    transactions = [
+        finished(100 if i % 2 else 1, sender=account, amount=i + 1)
+        for i in range(5)
+    ]
+    call_command('djtezos_archive', days=90)
+    assert ArchivedTransaction.objects.count() == 2
+
+    response = view(user, 'list', '/transaction/?page_size=2')
+    ids = [row['id'] for row in response.data['results']]
+    while response.data['next']:
+        response = view(user, 'list', response.data['next'])
+        ids += [row['id'] for row in response.data['results']]
+    assert ids == [str(tx.pk) for tx in reversed(transactions)]
+
+    response = view(user, 'retrieve', '/', pk=str(transactions[1].pk))
+    assert response.data['id'] == str(transactions[1].pk)
+    assert response.data['state'] == 'done'
+    assert response.data['blockchain']['name'] == 'fake'
+
+    other = get_user_model().objects.create(username='other')
+    response = view(other, 'retrieve', '/', pk=str(transactions[1].pk))
+    assert response.status_code == 404
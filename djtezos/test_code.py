@@ -0,0 +1,48 @@
+import pytest
+
+from djtezos.models import Code, Contract, Transaction
+
+
+mich = [
+    dict(prim='parameter', args=[dict(prim='int')]),
+    dict(prim='storage', args=[dict(prim='int')]),
+    dict(prim='code', args=[[dict(prim='CDR')]]),
+]
+
+
+@pytest.mark.django_db
+def test_code_dedupe(account, django_assert_num_queries):
+    first = Transaction.objects.create(
+        sender=account,
+        contract_micheline=mich,
+        contract_source='storage int',
+    )
+    Transaction.objects.bulk_enqueue(
+        dict(sender=account, contract_micheline=mich) for i in range(10)
+    )
+    assert Code.objects.count() == 2
+    assert Transaction.objects.filter(
+        micheline_code=first.micheline_code,
+    ).count() == 11
+
+    contract = Contract.objects.get(pk=first.pk)
+    with django_assert_num_queries(1):
+        assert contract.contract_micheline == mich
+        assert contract.contract_micheline == mich
+    assert contract.contract_source == 'storage int'
+
+    # changing code stores new content and keeps the former
+    contract.contract_micheline = mich[:2]
+    contract.save()
+    contract = Contract.objects.get(pk=first.pk)
+    assert contract.contract_micheline == mich[:2]
+    assert Code.objects.count() == 3
+
+    # calls have no code
+    call = Transaction.objects.create(
+        sender=account,
+        contract=contract,
+        function='replace',
+    )
+    assert call.micheline_code is None
+    assert Transaction.objects.get(pk=call.pk).contract_micheline == []
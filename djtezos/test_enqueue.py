@@ -0,0 +1,58 @@
+import pytest
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+
+from djtezos.models import Call, Transaction
+
+
+User = get_user_model()
+
+
+@pytest.fixture
+def contract(account):
+    return Transaction.objects.create(
+        sender=account,
+        contract_name='token',
+        contract_address='KT1Token',
+        contract_micheline=[dict(prim='storage')],
+    )
+
+
+@pytest.mark.django_db
+def test_bulk_enqueue(account, contract, django_assert_max_num_queries):
+    user = User.objects.create(username='test_enqueue')
+
+    def payouts():
+        for i in range(10):
+            yield dict(
+                sender=account,
+                contract=contract,
+                function='transfer',
+                args=[i],
+                state='deploy',
+                users=[user],
+            )
+
+    # per batch: contract lookup, savepoint, 3 inserts, release
+    with django_assert_max_num_queries(6 * 3):
+        assert Transaction.objects.bulk_enqueue(payouts(), batch_size=4) == 10
+
+    calls = Call.objects.filter(contract=contract)
+    assert calls.count() == 10
+    call = calls.get(args=[3])
+    assert call.contract_name == 'token'
+    assert call.contract_address == 'KT1Token'
+    assert call.history[0][0] == 'deploy'
+    assert list(call.users.all()) == [user]
+    assert Transaction.objects.all().for_user(user).count() == 10
+
+
+@pytest.mark.django_db
+def test_bulk_enqueue_invalid(account):
+    with pytest.raises(ValidationError):
+        Transaction.objects.bulk_enqueue([
+            Transaction(sender=account, amount=1),
+            Transaction(sender=account),
+        ])
+    assert not Transaction.objects.count()
@@ -0,0 +1,45 @@
+import pytest
+
+from djtezos.fields import AddressField, OperationHashField
+from djtezos.models import Account, Blockchain, Transaction
+
+
+@pytest.mark.parametrize('field, value, size', [
+    (AddressField(), 'tz1UcpXy3ho5pF9gD8aXgeNQ2u8KAQFsv7dt', 21),
+    (AddressField(), 'tz2G1omg87ZKL6izM8jntdrXL86BB1mE54GW', 21),
+    (AddressField(), 'tz3dofmAbhgGxibVaYeENozgyKkPz6kseCFE', 21),
+    (AddressField(), 'KT1QPYrWP7bR5nudEY2pBDzTvMHvyC4hfeYK', 21),
+    (OperationHashField(), 'oo6Fbx57ZcVRSQvcPvyp6Q4NkCMNNmyVmR7aSTc2ubWK5VAE5r6', 33),
+    # not base58check, stored as is
+    (AddressField(), 'KT1Token', 9),
+    (AddressField(), '', 1),
+    (OperationHashField(), 'ooBadChecksumBadChecksumBadChecksumBadChecksumBadCh', 52),
+])
+def test_encode(field, value, size):
+    encoded = field.get_prep_value(value)
+    assert len(encoded) == size
+    assert field.from_db_value(encoded, None, None) == value
+
+
+@pytest.mark.django_db
+def test_lookups():
+    blockchain = Blockchain.objects.create(
+        name='fake',
+        provider_class='djtezos.fake.Provider',
+    )
+    address = 'tz1UcpXy3ho5pF9gD8aXgeNQ2u8KAQFsv7dt'
+    account = Account.objects.create(blockchain=blockchain, address=address)
+    assert Account.objects.get(address=address) == account
+    assert Account.objects.filter(address__in=[address, 'KT1Token']).count() == 1
+
+    txhash = 'oo6Fbx57ZcVRSQvcPvyp6Q4NkCMNNmyVmR7aSTc2ubWK5VAE5r6'
+    tx = Transaction.objects.create(
+        sender=account,
+        amount=1,
+        txhash=txhash,
+        contract_address='KT1QPYrWP7bR5nudEY2pBDzTvMHvyC4hfeYK',
+    )
+    assert Transaction.objects.get(txhash=txhash) == tx
+    assert txhash in Transaction.objects.values_list('txhash', flat=True)
+    tx.refresh_from_db()
+    assert tx.contract_address == 'KT1QPYrWP7bR5nudEY2pBDzTvMHvyC4hfeYK'
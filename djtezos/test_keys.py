@@ -0,0 +1,60 @@
+import pytest
+
+from django.core.management import call_command
+from django.db import IntegrityError
+
+from djtezos.models import Account, WalletKey
+from djtezos.provider import BaseProvider
+
+
+@pytest.mark.django_db
+def test_generate_private_key_from_pool(fake, user):
+    call_command('djtezos_keys', size=3, processes=2)
+    assert WalletKey.objects.filter(blockchain=fake).count() == 3
+
+    # refilling a full pool does nothing
+    call_command('djtezos_keys', size=3, processes=2)
+    assert WalletKey.objects.filter(blockchain=fake).count() == 3
+
+    key = WalletKey.objects.order_by('pk').first()
+    account = user.account_set.create(blockchain=fake)
+    account.generate_private_key()
+    assert account.address == key.address
+    assert account.private_key
+    assert WalletKey.objects.filter(blockchain=fake).count() == 2
+
+
+@pytest.mark.django_db
+def test_generate_private_key_empty_pool(fake, user):
+    account = user.account_set.create(blockchain=fake)
+    account.generate_private_key()
+    assert account.address
+    assert account.private_key
+
+
+@pytest.mark.django_db(transaction=True)
+def test_generate_private_key_save_fails(fake, user, monkeypatch):
+    call_command('djtezos_keys', size=1, processes=1)
+    key = WalletKey.objects.get()
+    account = Account(owner=user, blockchain=fake)
+    account.generate_private_key()
+    assert not WalletKey.objects.count()
+
+    def save_base(*args, **kwargs):
+        raise IntegrityError()
+    monkeypatch.setattr(Account, 'save_base', save_base)
+    with pytest.raises(IntegrityError):
+        account.save()
+    assert WalletKey.objects.get().address == key.address
+
+
+@pytest.mark.django_db
+def test_key_pool_unused(tzlocal, monkeypatch):
+    monkeypatch.setenv('DJBLOCKCHAIN_MOCK', '1')
+    assert not tzlocal.provider.uses_key_pool()
+    call_command('djtezos_keys', size=3, blockchain='tzlocal')
+    assert not WalletKey.objects.count()
+
+    class Provider(BaseProvider):
+        pass
+    assert not Provider(tzlocal).uses_key_pool()
@@ -2,8 +2,10 @@ import json
 import os
 import pytest
 import time
+import uuid
 
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from djtezos.models import Blockchain, Contract, Call, Transfer, Transaction
 from djtezos.management.commands.djtezos_write import Command as Write
 from djtezos.management.commands.djtezos_balance import Command as Balance
@@ -162,14 +164,43 @@ def test_wrong_args(account):
 
     assert contract.state == 'done'
 
-    call = Transaction.objects.create(
-        sender=account,
-        contract=contract,
-        function='replace',
-        args=['foobar'],
-        state='deploy',
-    )
-    write()
-    call = Call.objects.get(pk=call.pk)
-    assert call.state == 'retrying'
-    assert call.error
+    # rejected at enqueue time with the entrypoint schema
+    with pytest.raises(ValidationError):
+        Transaction.objects.create(
+            sender=account,
+            contract=contract,
+            function='replace',
+            args=['foobar'],
+            state='deploy',
+        )
+    assert not Call.objects.filter(function='replace').exists()
+
+
+def test_uuid7():
+    import datetime
+    from djtezos.models import uuid7, uuid7_min
+
+    before = datetime.datetime.now()
+    ids = [uuid7() for i in range(10_000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert {(i.version, i.variant) for i in ids} == {(7, uuid.RFC_4122)}
+    # hex order, as stored in char columns, is the same
+    assert [i.hex for i in ids] == sorted(i.hex for i in ids)
+    assert uuid7_min(before) <= ids[0]
+    assert uuid7_min(before + datetime.timedelta(seconds=1)) > ids[0]
+
+
+def test_uuid7_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    from djtezos.models import uuid7
+
+    with ThreadPoolExecutor(8) as executor:
+        batches = list(executor.map(
+            lambda i: [uuid7() for i in range(2_000)],
+            range(8),
+        ))
+    ids = [i for batch in batches for i in batch]
+    assert len(set(ids)) == len(ids)
+    for batch in batches:
+        assert batch == sorted(batch)
@@ -0,0 +1,81 @@
+import decimal
+import pytest
+
+from django.utils import timezone
+
+from djtezos.models import Account, SenderPool, Transaction
+
+
+@pytest.fixture
+def pool(fake):
+    return SenderPool.objects.create(name='payouts', blockchain=fake)
+
+
+def account(pool, balance):
+    return Account.objects.create(
+        blockchain=pool.blockchain,
+        pool=pool,
+        balance=decimal.Decimal(balance),
+        balance_updated_at=timezone.now(),
+    )
+
+
+@pytest.mark.django_db
+def test_dispatch(pool):
+    rich = account(pool, 100)
+    poor = account(pool, 10)
+    account(pool, 0)
+    busy = account(pool, 1000)
+    Transaction.objects.create(sender=busy, amount=1, state='watching')
+    Transaction.objects.create(sender=busy, amount=1, state='deploying')
+
+    txs = [
+        Transaction.objects.create(pool=pool, amount=1, state='deploy')
+        for i in range(4)
+    ]
+    held = Transaction.objects.create(pool=pool, amount=1, state='held')
+    pool.dispatch()
+
+    senders = [
+        Transaction.objects.get(pk=tx.pk).sender
+        for tx in txs
+    ]
+    assert senders == [rich, poor, rich, poor]
+    assert not Transaction.objects.get(pk=held.pk).sender
+
+
+@pytest.mark.django_db
+def test_rebalance(pool):
+    pool.min_balance = 20
+    pool.save()
+    rich = account(pool, 100)
+    poor = account(pool, 10)
+    account(pool, 70)
+
+    pool.rebalance()
+    transfer = Transaction.objects.get(receiver=poor)
+    assert transfer.sender == rich
+    assert transfer.amount == 50_000_000
+
+    # don't queue another refill while one is in flight
+    pool.rebalance()
+    assert Transaction.objects.filter(receiver=poor).count() == 1
+
+    # still counted once done, until the balance of poor is synced
+    transfer.state = 'done'
+    transfer.save()
+    pool.rebalance()
+    assert Transaction.objects.filter(receiver=poor).count() == 1
+
+
+@pytest.mark.django_db
+def test_rebalance_large(pool):
+    pool.min_balance = 1000
+    pool.save()
+    rich = account(pool, 100_000)
+    poor = account(pool, 0)
+
+    pool.rebalance()
+    transfer = Transaction.objects.get(receiver=poor)
+    assert transfer.sender == rich
+    assert transfer.amount == 50_000_000_000
@@ -0,0 +1,96 @@
+import socket
+import threading
+
+import pytest
+
+from pytezos import Key, pytezos
+
+from djtezos.exceptions import PermanentError, TemporaryError
+from djtezos.models import Account, encrypt
+from djtezos.signer import WATERMARK, KeyStore, Signer, SignerServer
+from djtezos.tezos import SETTINGS, Provider
+
+
+SECRET = 'edsk3gUfUPyBSfrS9CCgmCiQsTCHGkviBDusMxDJstFtojtc1zcpsh'
+
+
+@pytest.fixture
+def account(tzlocal):
+    key = Key.from_encoded_key(SECRET)
+    return Account.objects.create(
+        address=key.public_key_hash(),
+        crypted_key=encrypt(key.secret_exponent),
+        blockchain=tzlocal,
+    )
+
+
+@pytest.fixture
+def signer(account, tmp_path):
+    keys = KeyStore()
+    keys.load(Account.objects.all())
+    path = str(tmp_path / 'signer.sock')
+    server = SignerServer(path, keys)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield Signer(path)
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_signer(account, signer):
+    key = Key.from_encoded_key(SECRET)
+    assert signer.public_key(account.address) == key.public_key()
+
+    messages = [
+        (account.address, WATERMARK + b'first'),
+        (account.address, WATERMARK + b'second'),
+    ]
+    signatures = signer.sign(messages)
+    for (address, message), signature in zip(messages, signatures):
+        assert key.verify(signature, message)
+
+    with pytest.raises(PermanentError, match='Only operations'):
+        signer.sign([(account.address, b'\x05block')])
+    with pytest.raises(PermanentError, match='No key'):
+        signer.sign([('tz1Unknown', WATERMARK + b'first')])
+    with pytest.raises(TemporaryError):
+        Signer(signer.path + '.missing').sign(messages)
+
+    # requests reuse the connection, and reconnect when it was closed
+    sock = signer.local.sock
+    signer.sign(messages)
+    assert signer.local.sock is sock
+    sock.shutdown(socket.SHUT_RDWR)
+    assert len(signer.sign(messages)) == 2
+    assert signer.local.sock is not sock
+
+
+@pytest.mark.django_db
+def test_provider_sign(account, signer, monkeypatch):
+    opg = pytezos.using(key=SECRET).transaction(
+        destination=account.address,
+        amount=1,
+        source=account.address,
+        counter=1,
+        fee=1000,
+        gas_limit=1500,
+        storage_limit=0,
+    )._spawn(branch='BLockGenesisGenesisGenesisGenesisGenesisf79b5d1CoW2')
+    expected = opg.sign().signature
+
+    monkeypatch.setitem(SETTINGS, 'SIGNER_SOCKET', signer.path)
+    provider = account.blockchain.provider
+    client = provider.sender_client(account)
+    assert not client.key.secret_exponent
+    opg = client.transaction(
+        destination=account.address,
+        amount=1,
+        source=account.address,
+        counter=1,
+        fee=1000,
+        gas_limit=1500,
+        storage_limit=0,
+    )._spawn(branch='BLockGenesisGenesisGenesisGenesisGenesisf79b5d1CoW2')
+    assert provider.sign(opg).signature == expected
@@ -0,0 +1,67 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+
+# budgets for a web worker that only imports models and views, override them
+# on slow CI servers
+IMPORT_SECONDS = float(os.getenv('DJTEZOS_IMPORT_SECONDS', '2'))
+IMPORT_RSS_KB = int(os.getenv('DJTEZOS_IMPORT_RSS_KB', str(120 * 1024)))
+
+HEAVY_MODULES = ('pytezos', 'mnemonic', 'tenacity', 'cryptography')
+
+
+def startup(*modules):
+    script = textwrap.dedent(f'''
+        import json, resource, sys, time
+        start = time.perf_counter()
+        import django
+        django.setup()
+        for module in {modules!r}:
+            __import__(module)
+        seconds = time.perf_counter() - start
+        try:
+            # ru_maxrss would include the memory of the forked parent
+            with open('/proc/self/status') as status:
+                rss = int([
+                    line for line in status if line.startswith('VmRSS:')
+                ][0].split()[1])
+        except OSError:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(json.dumps(dict(
+            seconds=seconds,
+            rss=rss,
+            heavy=[m for m in {HEAVY_MODULES!r} if m in sys.modules],
+        )))
+    ''')
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'djtezos.test_settings')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p]
+    )
+    output = subprocess.check_output([sys.executable, '-c', script], env=env)
+    return json.loads(output.decode('utf8').strip().split('\n')[-1])
+
+
+def test_models_startup():
+    result = startup('djtezos.models')
+    assert not result['heavy']
+    assert result['seconds'] < IMPORT_SECONDS, result
+    assert result['rss'] < IMPORT_RSS_KB, result
+
+
+def test_views_startup():
+    result = startup('djtezos.models', 'djtezos.views')
+    assert not result['heavy']
+    assert result['seconds'] < IMPORT_SECONDS, result
+    assert result['rss'] < IMPORT_RSS_KB, result
+
+
+def test_provider_startup():
+    # the provider module is loaded by Blockchain.provider, it should not load
+    # pytezos until an operation actually runs
+    result = startup('djtezos.tezos', 'djtezos.fake')
+    assert not result['heavy']
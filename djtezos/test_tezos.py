@@ -0,0 +1,696 @@
+import pytest
+
+from django.core.exceptions import ValidationError
+
+from djtezos.models import (
+    Account,
+    GlobalConstant,
+    Provision,
+    StateTransition,
+    Transaction,
+)
+from djtezos.tezos import (
+    PROVISION_RESERVE,
+    SETTINGS,
+    ChainContext,
+    Provider,
+    code_constants,
+    entrypoints,
+    expand_constants,
+    percentile,
+)
+
+
+@pytest.mark.django_db
+def test_provision_queue(tzlocal):
+    tzlocal.provider.provision('tz1foo')
+    provision = Provision.objects.get()
+    assert provision.address == 'tz1foo'
+    assert provision.amount == Provider.provision_amounts['tzlocal']
+    assert not provision.txhash
+
+
+def test_assign_funders():
+    provisions = [Provision(address=str(i), amount=10) for i in range(5)]
+    balances = dict(
+        rich=PROVISION_RESERVE + 30,
+        poor=PROVISION_RESERVE + 10,
+        broke=0,
+    )
+    batches = Provider.assign_funders(provisions, balances, size=3)
+    assert [p.address for p in batches['rich']] == ['0', '1', '2']
+    assert [p.address for p in batches['poor']] == ['3']
+    assert 'broke' not in batches
+
+
+class SignedOperation:
+    contents = [dict(fee='1234', source='tz1Test', counter='7')]
+    branch = 'BLockHash'
+
+    def hash(self):
+        return 'ooTestHash'
+
+    def binary_payload(self):
+        return b'signed'
+
+
+@pytest.mark.django_db
+def test_write_transaction_persists_before_inject(tzlocal, monkeypatch):
+    sender = Account.objects.create(blockchain=tzlocal)
+    transaction = Transaction.objects.create(sender=sender, amount=1)
+
+    def inject(self, tx):
+        # worker could die here: the operation must be tracked already
+        tx = Transaction.objects.get(pk=tx.pk)
+        assert tx.txhash == 'ooTestHash'
+        assert bytes(tx.signed_operation) == b'signed'
+        assert tx.branch_level == 250
+        # watched by djtezos_sync and watch_mempool if the worker dies
+        assert tx.state == 'watching'
+        assert tx.history[-1][0] == 'watching'
+        injected.append(tx)
+    injected = []
+    monkeypatch.setattr(Provider, 'inject', inject)
+    monkeypatch.setattr(Provider, 'get_block_level', lambda self, h: 250)
+
+    tzlocal.provider.write_transaction(SignedOperation(), transaction)
+    assert injected
+    assert ChainContext(tzlocal).counter(None, 'tz1Test') == 8
+
+    # a retry injects the same operation instead of forging a new one
+    from pytezos import pytezos
+    monkeypatch.setattr(pytezos, 'using', lambda shell: Node())
+    injected.clear()
+    tzlocal.provider.deploy(transaction)
+    assert injected
+
+
+def test_mempool_statuses():
+    statuses = Provider.mempool_statuses(dict(
+        applied=[dict(hash='ooApplied', branch='B')],
+        refused=[['ooRefused', dict(branch='B')]],
+        outdated=[dict(hash='ooOutdated')],
+    ))
+    assert statuses == dict(
+        ooApplied='applied',
+        ooRefused='refused',
+        ooOutdated='outdated',
+    )
+
+
+class Shell:
+    """Count RPCs that ChainContext makes."""
+    def __init__(self):
+        self.calls = []
+        self.protocol = 'PtFirst'
+        self.level = 1
+        self.head = self
+        self.context = self
+        self.chains = self
+        self.main = self
+        self.contracts = self
+
+    def header(self):
+        self.calls.append('header')
+        return dict(
+            hash=f'BLock{self.level}',
+            level=self.level,
+            protocol=self.protocol,
+        )
+
+    def constants(self):
+        self.calls.append('constants')
+        return dict(minimal_block_delay='30')
+
+    def chain_id(self):
+        self.calls.append('chain_id')
+        return 'NetXTest'
+
+    def __getitem__(self, address):
+        return lambda: self.calls.append('counter') or dict(counter='41')
+
+
+class Client:
+    def __init__(self):
+        self.shell = Shell()
+
+
+@pytest.mark.django_db
+def test_chain_context(tzlocal):
+    from django.core.cache import cache
+    cache.clear()
+    client = Client()
+    context = ChainContext(tzlocal)
+
+    assert context.head(client)['hash'] == 'BLock1'
+    assert context.chain_id(client) == 'NetXTest'
+    assert context.counter(client, 'tz1Test') == 42
+    assert client.shell.calls == ['header', 'constants', 'chain_id', 'counter']
+
+    # cached until the next block
+    client.shell.calls.clear()
+    client.shell.level = 2
+    assert context.head(client)['hash'] == 'BLock1'
+    assert context.chain_id(client) == 'NetXTest'
+    assert not client.shell.calls
+
+    # counters are bumped locally on injection, resynced on errors
+    context.counter_set('tz1Test', 42)
+    assert context.counter(client, 'tz1Test') == 43
+    context.counter_reset('tz1Test')
+    assert context.counter(client, 'tz1Test') == 42
+    assert client.shell.calls == ['counter']
+
+    # constants are fetched again on protocol change
+    client.shell.calls.clear()
+    client.shell.protocol = 'PtSecond'
+    cache.delete(context.prefix + 'head')
+    assert context.head(client)['protocol'] == 'PtSecond'
+    assert client.shell.calls == ['header', 'constants']
+
+
+def test_percentile():
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert percentile([3, 1, 2, 4], 90) == 4
+    assert percentile([3, 1, 2, 4], 1) == 1
+
+
+class AutofilledOperation:
+    def __init__(self):
+        self.contents = [dict(fee='500', gas_limit='1000')]
+
+    def forge(self):
+        return '00' * 36  # 100 bytes with the signature
+
+
+@pytest.mark.django_db
+def test_set_fee(tzlocal):
+    tzlocal.fee_samples = [[100, 1000], [1000, 1000], [2000, 30000]]
+    tzlocal.fee_percentiles = dict(low=0, high=100)
+    tzlocal.save()
+    provider = tzlocal.provider
+
+    # normal priority: 50th percentile of both fee per gas and per byte
+    transaction = Transaction(priority=1)
+    opg = provider.set_fee(AutofilledOperation(), transaction)
+    assert opg.contents[0]['fee'] == '1000'
+    assert transaction.fee == 1000
+    assert transaction.fee_percentile == 50
+    assert transaction.gasprice == 1000
+
+    # high priority: size weighs more than gas at the 100th percentile
+    transaction = Transaction(priority=2)
+    opg = provider.set_fee(AutofilledOperation(), transaction)
+    assert transaction.fee == 3000
+
+    # low priority keeps the minimal fee from autofill
+    transaction = Transaction(priority=0)
+    opg = provider.set_fee(AutofilledOperation(), transaction)
+    assert transaction.fee == 500
+
+
+mich = [
+    dict(prim='parameter', args=[dict(prim='or', args=[
+        dict(prim='unit', annots=['%double']),
+        dict(prim='pair', annots=['%replace'], args=[
+            dict(prim='int', annots=['%value']),
+            dict(prim='string', annots=['%memo']),
+        ]),
+    ])]),
+    dict(prim='storage', args=[dict(prim='int')]),
+    dict(prim='code', args=[[dict(prim='CDR')]]),
+]
+
+
+@pytest.mark.django_db
+def test_encode_args(tzlocal, django_assert_num_queries):
+    sender = Account.objects.create(blockchain=tzlocal)
+    contract = Transaction.objects.create(
+        sender=sender,
+        contract_name='test',
+        contract_address='KT1Contract',
+        contract_micheline=mich,
+    )
+    call = contract.call(sender=sender, function='replace', args=[3, 'x'])
+    assert call.args_mich == dict(
+        prim='Pair',
+        args=[dict(int='3'), dict(string='x')],
+    )
+    assert contract.call(sender=sender, function='double').args_mich == dict(
+        prim='Unit',
+    )
+
+    with pytest.raises(ValidationError):
+        contract.call(sender=sender, function='replace', args=['x', 3])
+    with pytest.raises(ValidationError):
+        contract.call(sender=sender, function='missing', args=[1])
+
+    # the schema is cached by code and args encoded again only on change
+    call = Transaction.objects.get(pk=call.pk)
+    entrypoints.cache_clear()
+    with django_assert_num_queries(1):
+        call.save()
+    call.args = [4, 'y']
+    # contract, sender, blockchain, code and update
+    with django_assert_num_queries(5):
+        call.save()
+    call.args = [5, 'z']
+    with django_assert_num_queries(1):
+        call.save()
+    assert call.args_mich['args'][0] == dict(int='5')
+
+
+class ContractClient:
+    def __init__(self):
+        self.transactions = []
+
+    def contract(self, address):
+        raise AssertionError('Contract script fetched to encode args')
+
+    def transaction(self, **kwargs):
+        self.transactions.append(kwargs)
+        return self
+
+    def sign(self):
+        return self
+
+
+@pytest.mark.django_db
+def test_send_encoded(tzlocal, monkeypatch):
+    sender = Account.objects.create(blockchain=tzlocal)
+    contract = Transaction.objects.create(
+        sender=sender,
+        contract_micheline=mich,
+        contract_address='KT1Contract',
+    )
+    call = contract.call(sender=sender, function='double')
+
+    client = ContractClient()
+    monkeypatch.setattr(Provider, 'sender_client', lambda self, a: client)
+    monkeypatch.setattr(Provider, 'autofill', lambda self, c, opg, tx: opg)
+    monkeypatch.setattr(
+        Provider,
+        'write_transaction',
+        lambda self, tx, transaction: 'ooHash',
+    )
+    assert tzlocal.provider.send(call) == 'ooHash'
+    assert client.transactions == [dict(
+        destination='KT1Contract',
+        amount=0,
+        parameters=dict(entrypoint='double', value=dict(prim='Unit')),
+    )]
+
+
+@pytest.mark.django_db
+def test_code_constants(tzlocal):
+    sender = Account.objects.create(blockchain=tzlocal)
+    contract = Transaction.objects.create(sender=sender, contract_micheline=mich)
+    code, values = code_constants(contract.micheline_code_id, 4)
+    assert code[:2] == mich[:2]
+    digest, = values
+    assert digest.startswith('expr')
+    assert values[digest] == [dict(prim='CDR')]
+    assert code[2] == dict(prim='code', args=[
+        dict(prim='constant', args=[dict(string=digest)]),
+    ])
+    assert expand_constants(code, values) == mich
+
+    # small code is originated as is
+    assert code_constants(contract.micheline_code_id, 100) == (mich, {})
+
+
+@pytest.mark.django_db
+def test_global_constants(tzlocal, monkeypatch):
+    monkeypatch.setitem(SETTINGS, 'GLOBAL_CONSTANT_BYTES', 4)
+    monkeypatch.setattr(Provider, 'constant_exists', lambda self, c, d: False)
+    sender = Account.objects.create(blockchain=tzlocal)
+    provider = tzlocal.provider
+
+    first = Transaction.objects.create(
+        sender=sender,
+        contract_micheline=mich,
+        state='deploying',
+    )
+    code, register = provider.global_constants(Node(), first)
+    assert register == [[dict(prim='CDR')]]
+    assert code[2]['args'][0]['prim'] == 'constant'
+    constant = GlobalConstant.objects.get()
+    assert constant.transaction == first
+    assert constant.code.content == b'[{"prim":"CDR"}]'
+
+    # not registered twice while the first origination is in flight
+    second = Transaction.objects.create(
+        sender=sender,
+        contract_micheline=mich,
+        state='deploying',
+    )
+    assert provider.global_constants(Node(), second) == (mich, [])
+
+    first.state = 'done'
+    first.save()
+    code, register = provider.global_constants(Node(), second)
+    assert code[2]['args'][0]['prim'] == 'constant'
+    assert register == []
+
+    # another origination takes over a registration that was aborted
+    GlobalConstant.objects.update(transaction=second)
+    second.state = 'aborted'
+    second.save()
+    third = Transaction.objects.create(sender=sender, contract_micheline=mich)
+    code, register = provider.global_constants(Node(), third)
+    assert register == [[dict(prim='CDR')]]
+    assert GlobalConstant.objects.get().transaction == third
+
+    # or one that is stuck retrying, unless it will re-inject its operation
+    third.state = 'retrying'
+    third.signed_operation = b'signed'
+    third.branch_level = 250
+    third.save()
+    fourth = Transaction.objects.create(sender=sender, contract_micheline=mich)
+    assert provider.global_constants(Node(), fourth)[1] == []
+    Transaction.objects.filter(pk=third.pk).update(
+        signed_operation=None,
+        branch_level=None,
+    )
+    code, register = provider.global_constants(Node(), fourth)
+    assert register == [[dict(prim='CDR')]]
+
+    # or one that can't be included anymore, Node has head 300 and ttl 120
+    Transaction.objects.filter(pk=fourth.pk).update(
+        state='watching',
+        branch_level=180,
+    )
+    fifth = Transaction.objects.create(sender=sender, contract_micheline=mich)
+    assert provider.global_constants(Node(), fifth)[1] == []
+    Transaction.objects.filter(pk=fourth.pk).update(branch_level=179)
+    assert provider.global_constants(Node(), fifth)[1] == register
+    assert GlobalConstant.objects.get().transaction == fifth
+
+
+BLOCKS = (
+    'BKiiym5cWWUEL6xzjK7FtMdP3RzHXYvGYGqmRLj5KvfhsCcaAQb',
+    'BKjAd6vPYydi8XwmF63kzwbF2jJPqDHqigsNhYb3V2GxjpbXB49',
+    'BKjcGSmAbSoBvxvXkrzG7XZ722cW8sfQu6tyykT1e7tDcNJvj9m',
+)
+
+
+class Chain:
+    """Client with a shell that knows the hash of blocks by level."""
+    def __init__(self, hashes):
+        self.hashes = hashes
+        self.shell = self
+        self.blocks = self
+        self.calls = []
+
+    def __getitem__(self, level):
+        self.calls.append(level)
+        return self
+
+    def hash(self):
+        return self.hashes[self.calls[-1]]
+
+
+@pytest.mark.django_db
+def test_confirmations(tzlocal):
+    tzlocal.confirmation_blocks = 2
+    tzlocal.save()
+    sender = Account.objects.create(blockchain=tzlocal)
+    provider = tzlocal.provider
+
+    def transfer(level, block_hash, state='watching'):
+        return Transaction.objects.create(
+            sender=sender,
+            amount=1,
+            state=state,
+            level=level,
+            block_hash=block_hash,
+        )
+    first = transfer(10, BLOCKS[0])
+    second = transfer(11, BLOCKS[1])
+    pending = transfer(None, None)
+
+    assert provider.promote(tzlocal, 11) == 0
+    assert provider.promote(tzlocal, 12) == 1
+    first.refresh_from_db()
+    assert first.state == 'done'
+    assert first.history[-1][0] == 'done'
+
+    # the block of second was replaced, third is above a lagging head
+    third = transfer(13, BLOCKS[2])
+    chain = Chain({11: BLOCKS[2]})
+    assert provider.demote_orphans(chain, tzlocal, 12) == 11
+    assert chain.calls == [11]
+    second.refresh_from_db()
+    assert second.state == 'watching'
+    assert second.level is None
+    assert second.block_hash is None
+    assert StateTransition.objects.filter(
+        error='Block orphaned by a reorg',
+    ).count() == 1
+    third.refresh_from_db()
+    assert third.level == 13
+
+    # confirmed and pending operations are left alone
+    first.refresh_from_db()
+    assert first.state == 'done'
+    assert first.block_hash == BLOCKS[0]
+    assert provider.demote_orphans(chain, tzlocal, 12) is None
+    pending.refresh_from_db()
+    assert pending.state == 'watching'
+
+    # calls recorded from blocks have a contract but no sender
+    contract = transfer(5, BLOCKS[0], state='done')
+    call = Transaction.objects.create(
+        contract=contract,
+        function='double',
+        state='watching',
+        level=14,
+        block_hash=BLOCKS[2],
+    )
+    assert provider.promote(tzlocal, 16) == 2
+    call.refresh_from_db()
+    assert call.state == 'done'
+
+
+@pytest.mark.django_db
+def test_watch_lower_head(tzlocal, monkeypatch):
+    from pytezos import pytezos
+    monkeypatch.setattr(pytezos, 'using', lambda shell: Node())
+    tzlocal.max_level = 310
+    tzlocal.save()
+    sender = Account.objects.create(blockchain=tzlocal)
+    done = Transaction.objects.create(
+        sender=sender,
+        amount=1,
+        state='done',
+        level=305,
+        block_hash=BLOCKS[1],
+    )
+
+    # the head of the node is 299, below what was scanned already
+    tzlocal.provider.watch_blockchain(tzlocal)
+    tzlocal.refresh_from_db()
+    assert tzlocal.max_level == 310
+    done.refresh_from_db()
+    assert done.state == 'done'
+    assert done.level == 305
+
+
+class Node:
+    """Shell of a node where ooIncluded was included at level 105."""
+    def __init__(self):
+        self.shell = self
+        self.head = self
+        self.mempool = self
+        self.blocks = self
+
+    def metadata(self):
+        return dict(
+            level_info=dict(level=300, level_position=299),
+            max_operations_ttl=120,
+        )
+
+    def pending_operations(self):
+        return dict(applied=[], refused=[])
+
+    def __getitem__(self, level):
+        self.level = level
+        return self
+
+    def operation_hashes(self):
+        return [[], [], [], ['ooIncluded'] if self.level == 105 else []]
+
+    def hash(self):
+        return BLOCKS[0] if self.level == 105 else BLOCKS[1]
+
+
+@pytest.mark.django_db
+def test_mempool_included(tzlocal, monkeypatch):
+    from pytezos import pytezos
+    monkeypatch.setattr(pytezos, 'using', lambda shell: Node())
+    sender = Account.objects.create(blockchain=tzlocal)
+
+    def call(txhash, state='watching'):
+        # to a contract that is not tracked here
+        return Transaction.objects.create(
+            sender=sender,
+            contract_address='KT1External',
+            function='transfer',
+            txhash=txhash,
+            branch_level=100,
+            state=state,
+        )
+    included = call('ooIncluded')
+    expired = call('ooExpired')
+    deploying = call('ooDeploying', state='deploying')
+
+    tzlocal.provider.watch_mempool(tzlocal)
+    included.refresh_from_db()
+    assert included.state == 'watching'
+    assert included.txhash == 'ooIncluded'
+    assert included.level == 105
+    assert included.block_hash == BLOCKS[0]
+    # the level and hash are of the same block, though the head level
+    # position is off by one
+    assert tzlocal.provider.demote_orphans(Node(), tzlocal, 299) is None
+    included.refresh_from_db()
+    assert included.level == 105
+    expired.refresh_from_db()
+    assert expired.state == 'retrying'
+    assert expired.txhash is None
+    deploying.refresh_from_db()
+    assert deploying.state == 'deploying'
+
+
+@pytest.mark.django_db
+def test_watch_provisions(tzlocal):
+    def provision(txhash, branch_level=100):
+        return Provision.objects.create(
+            blockchain=tzlocal,
+            address='tz1foo',
+            amount=10,
+            funder='tz1funder',
+            txhash=txhash,
+            branch_level=branch_level,
+        )
+    included = provision('ooIncluded')
+    expired = provision('ooExpired')
+    pending = provision('ooPending', branch_level=250)
+
+    tzlocal.provider.watch_provisions(Node())
+    included.refresh_from_db()
+    assert included.txhash == 'ooIncluded'
+    assert included.level == 105
+    expired.refresh_from_db()
+    assert expired.txhash is None
+    assert expired.funder is None
+    assert expired.branch_level is None
+    pending.refresh_from_db()
+    assert pending.txhash == 'ooPending'
+    assert pending.level is None
+
+
+@pytest.mark.django_db
+def test_sync_operations(tzlocal):
+    sender = Account.objects.create(blockchain=tzlocal)
+    provider = tzlocal.provider
+    contract = Transaction.objects.create(
+        sender=sender,
+        contract_address='KT1Tracked',
+        contract_micheline=mich,
+    )
+    external = Transaction.objects.create(
+        sender=sender,
+        contract_address='KT1External',
+        function='transfer',
+        txhash='ooExternal',
+        state='watching',
+    )
+    # a call to a tracked contract without the contract relation
+    call = Transaction.objects.create(
+        sender=sender,
+        contract_address='KT1Tracked',
+        function='double',
+        txhash='ooCall',
+        state='watching',
+    )
+
+    def op(txhash, destination):
+        content = dict(
+            kind='transaction',
+            fee='1234',
+            destination=destination,
+            parameters=dict(entrypoint='double', value=dict(prim='Unit')),
+        )
+        return dict(hash=txhash, contents=[content])
+
+    for operation in (op('ooExternal', 'KT1External'), op('ooCall', 'KT1Tracked')):
+        provider.sync_operation(20, BLOCKS[0], operation)
+    provider.sync_call(
+        20,
+        BLOCKS[0],
+        op('ooCall', 'KT1Tracked'),
+        op('ooCall', 'KT1Tracked')['contents'][0],
+        Transaction.objects.filter(pk=contract.pk),
+        tzlocal,
+    )
+    assert Transaction.objects.count() == 3
+    for transaction in (external, call):
+        transaction.refresh_from_db()
+        assert transaction.level == 20
+        assert transaction.gas == 1234
+    assert call.args_mich == dict(prim='Unit')
+
+    assert provider.promote(tzlocal, 20) == 2
+
+
+
+@pytest.mark.django_db
+def test_reinject(tzlocal, monkeypatch):
+    from pytezos import pytezos
+    from pytezos.rpc.node import RpcError
+    monkeypatch.setattr(pytezos, 'using', lambda shell: Node())
+    sender = Account.objects.create(blockchain=tzlocal)
+    provider = tzlocal.provider
+    errors = []
+
+    def inject(transaction):
+        if errors:
+            raise RpcError(errors[0])
+    monkeypatch.setattr(provider, 'inject', inject)
+
+    def retrying(txhash, branch_level):
+        return Transaction.objects.create(
+            sender=sender,
+            amount=1,
+            state='retrying',
+            txhash=txhash,
+            signed_operation=b'signed',
+            branch_level=branch_level,
+        )
+
+    # Node has head 300 and ttl 120
+    assert provider.reinject(retrying('ooLive', 200))
+    errors.append('proto.contract.counter_in_the_past')
+    assert provider.reinject(retrying('ooPast', 200))
+    # included where nothing recorded it
+    assert provider.reinject(retrying('ooIncluded', 100))
+
+    errors[0] = 'proto.operation.invalid_signature'
+    refused = retrying('ooRefused', 200)
+    expired = retrying('ooExpired', 100)
+    for transaction in (refused, expired):
+        assert not provider.reinject(transaction)
+        transaction.refresh_from_db()
+        assert transaction.txhash is None
+        assert transaction.signed_operation is None
+        assert transaction.branch_level is None
+
+    # djtezos_sync finds a retrying operation in a block
+    provider.sync_operation(
+        305,
+        BLOCKS[0],
+        dict(hash='ooLive', contents=[dict(fee='1000')]),
+    )
+    assert Transaction.objects.get(txhash='ooLive').state == 'watching'
+    assert Transaction.objects.get(txhash='ooPast').state == 'retrying'
@@ -0,0 +1,276 @@
+import io
+import json
+import pytest
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from rest_framework.filters import SearchFilter
+from rest_framework.request import Request
+from rest_framework.routers import DefaultRouter
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from djtezos.models import SETTINGS, Account, Transaction
+from djtezos.views import (
+    BlockchainViewSet, RequestTooLarge, TransactionViewSet)
+
+
+User = get_user_model()
+
+router = DefaultRouter()
+router.register('blockchain', BlockchainViewSet)
+router.register('transaction', TransactionViewSet)
+urlpatterns = router.urls
+
+
+def bulk(user, body, content_type):
+    request = APIRequestFactory().post(
+        '/transaction/bulk/',
+        body,
+        content_type=content_type,
+    )
+    force_authenticate(request, user=user)
+    return TransactionViewSet.as_view({'post': 'bulk'})(request)
+
+
+@pytest.mark.django_db
+def test_bulk_json(user):
+    response = bulk(user, json.dumps([
+        dict(state='deploy', function='replace', args=[1]),
+        dict(state='foo', function='replace'),
+        dict(state='held'),
+    ]), 'application/json')
+    assert response.status_code == 201
+    assert 'id' in response.data[0]
+    assert 'state' in response.data[1]['errors']
+    assert response.data[2]['errors']
+    assert Transaction.objects.get().pk.hex == response.data[0]['id'].replace('-', '')
+
+
+@pytest.mark.django_db
+def test_bulk_ndjson(user):
+    body = '\n'.join(
+        json.dumps(dict(state='deploy', function='replace', args=[i]))
+        for i in range(3)
+    )
+    response = bulk(user, body, 'application/x-ndjson')
+    assert response.status_code == 201
+    assert Transaction.objects.count() == 3
+    assert Transaction.objects.get(args=[2]).history[0][0] == 'deploy'
+
+
+@pytest.mark.django_db
+def test_bulk_limits(user, monkeypatch):
+    monkeypatch.setitem(SETTINGS, 'BULK_MAX_ITEMS', 2)
+    items = [dict(state='deploy', function='replace')] * 3
+    response = bulk(user, json.dumps(items), 'application/json')
+    assert response.status_code == 413
+    response = bulk(
+        user,
+        '\n'.join(json.dumps(item) for item in items),
+        'application/x-ndjson',
+    )
+    assert response.status_code == 413
+
+    monkeypatch.setitem(SETTINGS, 'BULK_MAX_BYTES', 10)
+    response = bulk(user, json.dumps(items[:1]), 'application/json')
+    assert response.status_code == 413
+    assert not Transaction.objects.count()
+
+    # chunked body without Content-Length
+    monkeypatch.setitem(SETTINGS, 'BULK_MAX_BYTES', 100)
+    for content_type in ('application/json', 'application/x-ndjson'):
+        request = Request(APIRequestFactory().post(
+            '/transaction/bulk/',
+            content_type=content_type,
+        ))
+        request.META.pop('CONTENT_LENGTH', None)
+        request._stream = io.BytesIO(
+            '\n'.join(json.dumps(item) for item in items * 10).encode()
+        )
+        with pytest.raises(RequestTooLarge):
+            TransactionViewSet().get_bulk_items(request)
+
+
+def listing(user, **params):
+    request = APIRequestFactory().get('/transaction/', params)
+    force_authenticate(request, user=user)
+    return TransactionViewSet.as_view({'get': 'list'})(request)
+
+
+@pytest.fixture
+def urls(settings):
+    # test settings have no ROOT_URLCONF for the hyperlinked blockchain
+    settings.ROOT_URLCONF = __name__
+
+
+@pytest.fixture
+def account(fake, user):
+    return Account.objects.create(owner=user, blockchain=fake)
+
+
+@pytest.mark.django_db
+def test_list_keyset(user, account, urls):
+    user.is_superuser = True
+    created = Transaction.objects.bulk_enqueue(
+        dict(sender=account, state='held', function='replace', args=[i])
+        for i in range(5)
+    )
+    # created_at ties are broken by id
+    first = Transaction.objects.order_by('created_at').first()
+    Transaction.objects.update(created_at=first.created_at)
+    Transaction.objects.filter(pk=first.pk).update(created_at=None)
+    expected = list(Transaction.objects.order_by('-created_at', '-id'))
+
+    response = listing(user, page_size=2)
+    assert 'count' not in response.data
+    seen = [row['id'] for row in response.data['results']]
+    while response.data['next']:
+        cursor = response.data['next'].split('cursor=')[1].split('&')[0]
+        response = listing(user, page_size=2, cursor=cursor)
+        seen += [row['id'] for row in response.data['results']]
+    assert seen == [str(tx.pk) for tx in expected]
+    assert len(seen) == created
+
+
+@pytest.mark.django_db
+def test_list_expand(user, account, urls, django_assert_num_queries):
+    user.is_superuser = True
+    Transaction.objects.create(
+        sender=account,
+        state='held',
+        contract_micheline=[dict(prim='code')],
+        args={'int': '1'},
+    )
+    # live and archived transactions
+    with django_assert_num_queries(2):
+        row = listing(user).data['results'][0]
+    assert 'contract_micheline' not in row
+    assert 'args' not in row
+    assert row['blockchain']['name'] == 'fake'
+
+    row = listing(user, expand='args').data['results'][0]
+    assert 'contract_micheline' not in row
+    assert row['args'] == {'int': '1'}
+
+
+@pytest.mark.django_db
+def test_list_invalid_cursor(user):
+    assert listing(user, cursor='nope').status_code == 404
+
+
+@pytest.mark.django_db
+def test_for_user(user, account):
+    other = Account.objects.create(
+        owner=User.objects.create(username='other'),
+        blockchain=account.blockchain,
+    )
+    sent = Transaction.objects.create(
+        sender=account, receiver=account, amount=1,
+    )
+    sent.users.add(user)
+    received = Transaction.objects.create(
+        sender=other, receiver=account, amount=1,
+    )
+    shared = Transaction.objects.create(sender=other, function='replace')
+    shared.users.add(user)
+    Transaction.objects.create(sender=other, receiver=other, amount=1)
+
+    # no duplicate through the users relation
+    assert sorted(
+        Transaction.objects.all().for_user(user).values_list('pk', flat=True)
+    ) == sorted([sent.pk, received.pk, shared.pk])
+
+    latest = Transaction.objects.all().for_user(user).order_by('-created_at')
+    assert 'JOIN' not in str(latest[:10].query)
+    if connection.vendor == 'sqlite':
+        # walks the created_at index and stops after 10 rows, however large
+        # the table grows
+        assert 'USING INDEX djtezos_tx_created_id' in latest[:10].explain()
+
+
+def events(user, **headers):
+    request = APIRequestFactory().get(
+        '/transaction/events/',
+        HTTP_ACCEPT='text/event-stream',
+        **headers,
+    )
+    force_authenticate(request, user=user)
+    response = TransactionViewSet.as_view(
+        {'get': 'events'},
+        **TransactionViewSet.events.kwargs,
+    )(request)
+    assert response.status_code == 200
+    return [
+        dict(line.split(': ', 1) for line in event.split('\n'))
+        for event in b''.join(response.streaming_content).decode().split('\n\n')
+        if event.startswith('id:')
+    ]
+
+
+@pytest.mark.django_db
+def test_search(user, account):
+    txhash = 'ooYC3ZdJ5W4RYGP8K1zZeZYkXmBgLkQVYg5DwG3SBVU6dmcCHSJ'
+    account.address = 'tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx'
+    account.save()
+    tx = Transaction.objects.create(sender=account, amount=1, txhash=txhash)
+    Transaction.objects.create(sender=account, amount=1)
+
+    def search(term):
+        request = Request(APIRequestFactory().get('/', dict(search=term)))
+        return list(SearchFilter().filter_queryset(
+            request,
+            Transaction.objects.all(),
+            TransactionViewSet(),
+        ))
+
+    assert search(txhash) == [tx]
+    assert len(search(account.address)) == 2
+    assert search(txhash[:10]) == []
+
+
+@pytest.mark.django_db
+def test_events(user, account, monkeypatch):
+    monkeypatch.setitem(SETTINGS, 'EVENTS_TIMEOUT', 0)
+    monkeypatch.setitem(SETTINGS, 'EVENTS_SETTLE', 0)
+    tx = Transaction.objects.create(sender=account, amount=1, state='held')
+    hidden = Transaction.objects.create(
+        sender=Account.objects.create(blockchain=account.blockchain),
+        amount=1,
+    )
+    tx.state_set('deploy')
+    hidden.state_set('deploy')
+    tx.state_set('deploying')
+
+    streamed = events(user, HTTP_LAST_EVENT_ID='0')
+    assert [json.loads(e['data'])['state'] for e in streamed] == [
+        'deploy',
+        'deploying',
+    ]
+    assert json.loads(streamed[0]['data'])['id'] == str(tx.pk)
+
+    # resume after the last received event
+    tx.state_set('watching')
+    streamed = events(user, HTTP_LAST_EVENT_ID=streamed[-1]['id'])
+    assert [json.loads(e['data'])['state'] for e in streamed] == ['watching']
+
+    # without last event id, only new transitions are streamed
+    assert events(user) == []
+
+    # transitions younger than EVENTS_SETTLE wait for lower ids to commit
+    monkeypatch.setitem(SETTINGS, 'EVENTS_SETTLE', 60)
+    tx.state_set('done')
+    assert events(user, HTTP_LAST_EVENT_ID=streamed[-1]['id']) == []
+
+
+@pytest.mark.django_db
+def test_events_invalid(user):
+    request = APIRequestFactory().get(
+        '/transaction/events/?transaction=nope',
+        HTTP_ACCEPT='text/event-stream',
+    )
+    force_authenticate(request, user=user)
+    response = TransactionViewSet.as_view(
+        {'get': 'events'},
+        **TransactionViewSet.events.kwargs,
+    )(request)
+    assert response.status_code == 400
@@ -0,0 +1,148 @@
+import datetime
+import json
+import pytest
+import requests
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+
+from djtezos.models import (
+    SETTINGS, Account, StateTransition, Transaction, Webhook)
+
+
+class Receiver:
+    def __init__(self, status=200):
+        self.status = status
+        self.requests = []
+
+    def __call__(self, url, data, headers, timeout):
+        self.requests.append((url, data, headers))
+        response = requests.Response()
+        response.status_code = self.status
+        response.url = url
+        return response
+
+    def events(self):
+        return [
+            event
+            for url, data, headers in self.requests
+            for event in json.loads(data)['events']
+        ]
+
+
+@pytest.fixture
+def account(fake, user):
+    return Account.objects.create(owner=user, blockchain=fake)
+
+
+def transfer(account):
+    return Transaction.objects.create(sender=account, amount=1, state='held')
+
+
+def deliver(monkeypatch, receiver, settle=0):
+    monkeypatch.setattr(requests, 'post', receiver)
+    monkeypatch.setitem(SETTINGS, 'EVENTS_SETTLE', settle)
+    call_command('djtezos_webhooks', concurrency=1)
+
+
+@pytest.mark.django_db
+def test_deliver_batches(account, monkeypatch):
+    monkeypatch.setitem(SETTINGS, 'WEBHOOK_BATCH', 2)
+    transfer(account).state_set('aborted')
+    webhook = Webhook.objects.create(url='http://hook/', states=['done'])
+    hidden = Webhook.objects.create(
+        url='http://other/',
+        owner=get_user_model().objects.create(username='other'),
+    )
+    for i in range(3):
+        tx = transfer(account)
+        tx.state_set('deploy')
+        tx.state_set('done')
+
+    receiver = Receiver()
+    deliver(monkeypatch, receiver)
+    assert [url for url, data, headers in receiver.requests] == [
+        'http://hook/',
+        'http://hook/',
+    ]
+    # transitions before the webhook was created are not sent
+    assert [e['state'] for e in receiver.events()] == ['done'] * 3
+
+    url, data, headers = receiver.requests[0]
+    assert headers['X-Djtezos-Signature'] == 'sha256=' + Webhook.signature(
+        webhook.secret,
+        data,
+    )
+
+    webhook.refresh_from_db()
+    assert webhook.delivered == 3
+    assert webhook.cursor == receiver.events()[-1]['event_id']
+    hidden.refresh_from_db()
+    assert hidden.delivered == 0
+    # past the transitions it doesn't match, not to scan them again
+    assert hidden.cursor == webhook.cursor
+
+    # nothing left to deliver
+    receiver = Receiver()
+    deliver(monkeypatch, receiver)
+    assert receiver.requests == []
+
+
+@pytest.mark.django_db
+def test_deliver_backoff(account, monkeypatch):
+    webhook = Webhook.objects.create(url='http://hook/')
+    transfer(account).state_set('deploy')
+
+    deliver(monkeypatch, Receiver(status=500))
+    webhook.refresh_from_db()
+    assert webhook.failures == 1
+    assert webhook.delivered == 0
+    assert '500' in webhook.last_error
+    first_delay = webhook.next_attempt_at
+
+    # not due yet
+    receiver = Receiver()
+    deliver(monkeypatch, receiver)
+    assert receiver.requests == []
+
+    Webhook.objects.update(next_attempt_at=None)
+    deliver(monkeypatch, Receiver(status=500))
+    webhook.refresh_from_db()
+    assert webhook.failures == 2
+    assert webhook.next_attempt_at > first_delay
+
+    Webhook.objects.update(next_attempt_at=None)
+    receiver = Receiver()
+    deliver(monkeypatch, receiver)
+    assert [e['state'] for e in receiver.events()] == ['deploy']
+    webhook.refresh_from_db()
+    assert webhook.failures == 0
+    assert webhook.next_attempt_at is None
+
+
+@pytest.mark.django_db
+def test_deliver_settled(account, monkeypatch):
+    webhook = Webhook.objects.create(url='http://hook/')
+    tx = transfer(account)
+    tx.state_set('deploy')
+    tx.state_set('deploying')
+    transitions = StateTransition.objects.filter(transaction=tx).order_by('pk')
+    transitions.filter(pk=transitions[0].pk).update(
+        created_at=timezone.now() - datetime.timedelta(minutes=1),
+    )
+    # an older transition with a higher id, ie. committed late
+    transfer(account).state_set('deploy')
+    StateTransition.objects.filter(pk=transitions[1].pk + 1).update(
+        created_at=timezone.now() - datetime.timedelta(minutes=1),
+    )
+
+    receiver = Receiver()
+    deliver(monkeypatch, receiver, settle=30)
+    assert [e['state'] for e in receiver.events()] == ['deploy']
+    webhook.refresh_from_db()
+    assert webhook.cursor == transitions[0].pk
+
+    receiver = Receiver()
+    deliver(monkeypatch, receiver)
+    assert [e['state'] for e in receiver.events()] == ['deploying', 'deploy']
@@ -0,0 +1,221 @@
+import decimal
+import pytest
+
+from django.utils import timezone
+
+from djtezos.models import (
+    Account,
+    QueueClass,
+    Transaction,
+    low_balance,
+)
+from djtezos.management.commands.djtezos_write import Command as Write
+from djtezos.management.commands.djtezos_balance import Command as Balance
+
+
+@pytest.fixture
+def account(fake):
+    return Account.objects.create(
+        blockchain=fake,
+        balance=decimal.Decimal(1),
+        balance_updated_at=timezone.now(),
+    )
+
+
+@pytest.mark.django_db
+def test_affordable(account):
+    Transaction.objects.create(
+        sender=account,
+        amount=500_000,
+        gas=1_000,
+        state='watching',
+    )
+    tx = Transaction.objects.create(sender=account, amount=400_000, gas=1_000)
+    assert Transaction.objects.all().with_available().get(pk=tx.pk).available == 499_000
+    assert Transaction.objects.all().affordable().filter(pk=tx.pk)
+
+    # the default transfer fee estimate exceeds what's left
+    tx.gas = None
+    tx.save()
+    assert not Transaction.objects.all().affordable().filter(pk=tx.pk)
+
+
+@pytest.mark.django_db
+def test_write_skips_underfunded(account):
+    Transaction.objects.create(
+        sender=account,
+        amount=900_000,
+        gas=1_000,
+        state='done',
+    )
+    tx = Transaction.objects.create(
+        sender=account,
+        amount=100_000,
+        state='deploy',
+    )
+    Write().handle()
+    tx.refresh_from_db()
+    assert tx.state == 'deploy'
+
+    alerts = []
+
+    def receiver(sender, account, **kwargs):
+        alerts.append(account)
+    low_balance.connect(receiver)
+    try:
+        Balance().alert()
+    finally:
+        low_balance.disconnect(receiver)
+    assert alerts == [account]
+
+    # a balance refresh after the done transaction releases its reservation
+    account.balance_updated_at = timezone.now()
+    account.save()
+    Write().handle()
+    tx.refresh_from_db()
+    assert tx.state == 'watching'
+    assert tx.txhash
+
+
+@pytest.fixture
+def users():
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+    return [User.objects.create(username=f'test_write_{i}') for i in range(2)]
+
+
+def funded(blockchain, owner):
+    return Account.objects.create(
+        blockchain=blockchain,
+        owner=owner,
+        balance=decimal.Decimal(1000),
+        balance_updated_at=timezone.now(),
+    )
+
+
+@pytest.mark.django_db
+def test_schedule_priorities(fake, users):
+    account = funded(fake, users[0])
+    for priority in (1, 1, 1, 2, 2, 2):
+        Transaction.objects.create(
+            sender=account,
+            amount=1,
+            priority=priority,
+            state='deploy',
+        )
+
+    priorities = []
+    for i in range(6):
+        tx = Write().schedule()
+        tx.state_set('done')
+        priorities.append(tx.priority)
+
+    # high priority gets twice the share of normal priority while both queue
+    assert priorities == [2, 1, 2, 2, 1, 1]
+    assert QueueClass.objects.get(priority=2, kind='transfer').dispatched == 3
+
+
+@pytest.mark.django_db
+def test_schedule_owners(fake, users):
+    bulk = funded(fake, users[0])
+    user = funded(fake, users[1])
+    for i in range(3):
+        Transaction.objects.create(sender=bulk, amount=1, state='deploy')
+    Transaction.objects.create(sender=user, amount=1, state='deploy')
+
+    senders = []
+    for i in range(2):
+        tx = Write().schedule()
+        tx.state_set('watching')
+        senders.append(tx.sender)
+
+    # the owner with a transaction in flight waits for the other one
+    assert senders == [bulk, user]
+
+
+@pytest.mark.django_db
+def test_schedule_kinds(fake, users):
+    account = funded(fake, users[0])
+    for i in range(2):
+        Transaction.objects.create(sender=account, amount=1, state='deploy')
+    Transaction.objects.create(
+        sender=account,
+        contract_address='KT1',
+        function='replace',
+        state='deploy',
+    )
+
+    kinds = []
+    for i in range(3):
+        tx = Write().schedule()
+        tx.state_set('done')
+        kinds.append('call' if tx.function else 'transfer')
+
+    # transfers don't starve calls anymore
+    assert 'call' in kinds[:2]
+
+
+@pytest.mark.django_db
+def test_pick_creates_classes(monkeypatch):
+    bulk_create = QueueClass.objects.bulk_create
+
+    def concurrent_bulk_create(objs, **kwargs):
+        # another writer creates a class after it was found missing
+        QueueClass.objects.create(priority=1, kind='call')
+        return bulk_create(objs, **kwargs)
+    monkeypatch.setattr(
+        QueueClass.objects,
+        'bulk_create',
+        concurrent_bulk_create,
+    )
+
+    chosen = QueueClass.objects.pick([(1, 'call'), (2, 'call')])
+    assert (chosen.priority, chosen.kind) == (2, 'call')
+    assert QueueClass.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_queue_command(fake, users):
+    from io import StringIO
+    from django.core.management import call_command
+
+    account = funded(fake, users[0])
+    Transaction.objects.create(sender=account, amount=1, state='deploy')
+    Write().schedule()
+    out = StringIO()
+    call_command('djtezos_queue', stdout=out)
+    assert 'normal transfer' in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_deploy_aborts(fake, monkeypatch):
+    import djtezos.fake
+    monkeypatch.setattr(djtezos.fake, 'SLEEP', 0)
+    fake.provider_class = 'djtezos.fake.FailDeploy'
+    fake.save()
+    tx = Transaction.objects.create(
+        sender=funded(fake, None),
+        amount=1,
+        state='deploy',
+    )
+    # attempts before a previous abort don't count
+    tx.state_set('deploying')
+    tx.state_set('aborted')
+
+    for i in range(10):
+        Write().deploy(tx)
+    assert tx.state == 'aborted'
+    assert tx.error.startswith('Aborting because >= 10 failures')
+
+    transitions = tx.transitions.order_by('pk')
+    assert transitions.filter(state='retrying').count() == 9
+    assert transitions.last().error == tx.error
+    assert transitions.filter(
+        state='retrying',
+    ).first().error == 'Deploy failed as requested'
+    # former history shape
+    assert [state for state, timestamp in tx.history][-3:] == [
+        'retrying',
+        'deploying',
+        'aborted',
+    ]
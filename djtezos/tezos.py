@@ -1,35 +1,192 @@
+import functools
 import importlib
 import json
 import logging
+import math
 import time
 import os
 
 from django.conf import settings
-from pytezos import Contract, Key, pytezos
-from mnemonic import Mnemonic
-from tenacity import retry, stop_after_attempt
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from pytezos.rpc.node import RpcError
-from requests.exceptions import ConnectionError
+from django.db import transaction as db_transaction
+from django.db.models import Q
+from django.utils import timezone
 
 from .exceptions import PermanentError, TemporaryError
-from .models import Account, Transaction
+from .models import (
+    Account,
+    Code,
+    GlobalConstant,
+    Provision,
+    Transaction,
+)
 from .provider import BaseProvider
+from .signer import WATERMARK, signer
 
 logger = logging.getLogger('djtezos.tezos')
 
-SETTINGS = dict(TEZOS_CONTRACTS='')
+SETTINGS = dict(
+    TEZOS_CONTRACTS='',
+    # originate the code subtrees that pack to at least this many bytes as
+    # global constants, 0 to disable
+    GLOBAL_CONSTANT_BYTES=0,
+    # Unix socket of the djtezos_signer process, to sign with it instead of
+    # decrypting keys in workers
+    SIGNER_SOCKET='',
+)
 SETTINGS.update(getattr(settings, 'DJBLOCKCHAIN', {}))
 
 
 RETRIES = 3
 
+# max number of transfers in the operation group of a funder
+PROVISION_BATCH = int(os.getenv('DJTEZOS_PROVISION_BATCH', '50'))
+
+# mutez a funder keeps for fees
+PROVISION_RESERVE = 1_000_000
+
+# number of recent operations to compute fee percentiles from
+FEE_SAMPLES = int(os.getenv('DJTEZOS_FEE_SAMPLES', '500'))
+
+# max_micheline_bytes_limit of the protocol, for the value of a constant
+GLOBAL_CONSTANT_MAX_BYTES = 50_000
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = math.ceil(len(values) * percent / 100) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+@functools.lru_cache(maxsize=256)
+def entrypoints(code_hash):
+    """
+    Return the entrypoint types of the contract Micheline of a Code by name.
+
+    Cached by hash since the content of a Code never changes.
+    """
+    from pytezos.michelson.sections.parameter import ParameterSection
+    code = json.loads(Code.objects.get(pk=code_hash).content)
+    for section in code:
+        if isinstance(section, dict) and section.get('prim') == 'parameter':
+            return ParameterSection.match(section).list_entrypoints()
+    return {}
+
+
+@functools.lru_cache(maxsize=256)
+def code_constants(code_hash, min_bytes):
+    """
+    Return the contract Micheline of a Code with the largest subtrees of its
+    code section that pack to min_bytes or more replaced by constants, and
+    the dict of their values by expression hash.
+
+    Cached by hash since the content of a Code never changes, don't mutate
+    the result.
+    """
+    from pytezos.michelson.forge import forge_micheline, forge_script_expr
+    values = dict()
+
+    def replace(node):
+        packed = forge_micheline(node)
+        if len(packed) < min_bytes:
+            return node
+        if len(packed) <= GLOBAL_CONSTANT_MAX_BYTES:
+            digest = forge_script_expr(b'\x05' + packed)
+            values[digest] = node
+            return dict(prim='constant', args=[dict(string=digest)])
+        if isinstance(node, list):
+            return [replace(child) for child in node]
+        if isinstance(node, dict) and 'args' in node:
+            return dict(node, args=[replace(arg) for arg in node['args']])
+        return node
+
+    code = [
+        dict(section, args=[replace(arg) for arg in section['args']])
+        if isinstance(section, dict) and section.get('prim') == 'code'
+        else section
+        for section in json.loads(Code.objects.get(pk=code_hash).content)
+    ]
+    return code, values
+
+
+def expand_constants(node, values):
+    """Return node with the constants of hashes in values expanded."""
+    if isinstance(node, list):
+        return [expand_constants(child, values) for child in node]
+    if not isinstance(node, dict) or 'args' not in node:
+        return node
+    if node.get('prim') == 'constant' and node['args'][0]['string'] in values:
+        return values[node['args'][0]['string']]
+    return dict(node, args=[expand_constants(arg, values) for arg in node['args']])
+
 
 class Bank:
     address = 'tz1Tc5WeytFSQvciXAX7xb7SeUBwZ2q4dWXj'
     key = b'B\xfeNx\r\xd4\x90\xb7c\x07\x0c\x8a\xe4\r\x8d?\xfa\x137\xee\xe2$\xa9A)\xd7?\xf1\xfb\x9c\xb31\xa3\xd5J\xaf\xab\x84\xd0\x91IN\xc5\xdd\x1c\xd5\xb1\xcb@\x0c\xa3\xf6E\xb3\x15(^/\x8aw\xee\xf6h\xf2'  # noqa
 
 
+class ChainContext:
+    """
+    Cache of what autofill would otherwise fetch for every operation.
+
+    Stored in the Django cache so that it's shared by workers when a shared
+    cache backend is configured. The head is cached for one block time,
+    which is read from the constants again on protocol change, the counter
+    of a sender is bumped on injection and resynced on counter errors.
+    """
+    def __init__(self, blockchain):
+        self.prefix = f'djtezos.{blockchain.pk}.'
+
+    def get(self, name):
+        return cache.get(self.prefix + name)
+
+    def set(self, name, value, timeout=None):
+        cache.set(self.prefix + name, value, timeout)
+
+    def head(self, client):
+        head = self.get('head')
+        if head is None:
+            header = client.shell.head.header()
+            head = dict(
+                hash=header['hash'],
+                level=header['level'],
+                protocol=header['protocol'],
+            )
+            if (
+                head['protocol'] != self.get('protocol')
+                or self.get('block_time') is None
+            ):
+                constants = client.shell.head.context.constants()
+                self.set('block_time', int(constants.get(
+                    'minimal_block_delay',
+                    constants.get('time_between_blocks', [30])[0],
+                )))
+                self.set('protocol', head['protocol'])
+            self.set('head', head, self.get('block_time'))
+        return head
+
+    def chain_id(self, client):
+        chain_id = self.get('chain_id')
+        if chain_id is None:
+            chain_id = client.shell.chains.main.chain_id()
+            self.set('chain_id', chain_id)
+        return chain_id
+
+    def counter(self, client, address):
+        """Return the counter for the next operation of address."""
+        counter = self.get(f'counter.{address}')
+        if counter is None:
+            counter = int(client.shell.contracts[address]()['counter'])
+        return counter + 1
+
+    def counter_set(self, address, counter):
+        self.set(f'counter.{address}', counter)
+
+    def counter_reset(self, address):
+        cache.delete(self.prefix + f'counter.{address}')
+
+
 class Provider(BaseProvider):
     sandbox_ids = (
         'edsk3gUfUPyBSfrS9CCgmCiQsTCHGkviBDusMxDJstFtojtc1zcpsh',
@@ -38,6 +195,12 @@ class Provider(BaseProvider):
         'edsk2uqQB9AY4FvioK2YMdfmyMrer5R8mGFyuaLLFfSRo8EoyNdht3',
         'edsk4QLrcijEffxV31gGdN2HU7UpyJjA8drFoNcmnB28n89YjPNRFm',
     )
+    # mempool classifications of operations that will never be included
+    dead_statuses = ('refused', 'outdated')
+    provision_amounts = {
+        'tezos carthagenet': 49_000_000,
+        'tzlocal': 1_200_000_000,
+    }
 
     def transfer(self, transaction):
         """
@@ -49,19 +212,16 @@ class Provider(BaseProvider):
               'kind': 'temporary'},)
         """
         logger.debug(f'Transfering {transaction.amount} from {transaction.sender} to {transaction.receiver}')
-        client = self.get_client(
-            transaction.sender.private_key,
-            reveal=True,
-            sender=transaction.sender.address
-        )
-        tx = client.transaction(
+        client = self.sender_client(transaction.sender, reveal=True)
+        tx = self.sign(self.autofill(client, client.transaction(
             destination=transaction.receiver.address,
             amount=transaction.amount,
-        ).autofill().sign()
+        ), transaction))
         result = self.write_transaction(tx, transaction)
         return result
 
     def get_sandbox_account(self):
+        from pytezos import pytezos
         key = None
         for sandbox_id in self.sandbox_ids:
             sandbox = pytezos.key.from_encoded_key(sandbox_id)
@@ -73,83 +233,219 @@ class Provider(BaseProvider):
                 return key
         return key
 
-    def get_richest_sandbox_account(self):
-        balances = dict()
-        for sandbox_id in self.sandbox_ids:
-            sandbox = pytezos.key.from_encoded_key(sandbox_id)
-            sandbox_balance = self.get_balance(sandbox.public_key_hash(), sandbox.secret_exponent)
-            balances[sandbox_balance] = sandbox
-
-        max_tezies = max(balances)
-        return balances[max_tezies]
-
-
-    def create_wallet(self, passphrase):
+    @staticmethod
+    def derive_wallet(passphrase):
+        from mnemonic import Mnemonic
+        from pytezos import Key
         mnemonic = Mnemonic('english').generate(128)
         key = Key.from_mnemonic(mnemonic, passphrase, curve=b'ed')
-        if self.blockchain.name == 'tzlocal':
-            # during tests, use sandbox accounts to avoid having to make time-eating transfers
-            if 'DJBLOCKCHAIN_MOCK' in os.environ and os.environ['DJBLOCKCHAIN_MOCK']:
-                key = self.get_sandbox_account()
         return key.public_key_hash(), key.secret_exponent
 
-    def _provision_tzlocal(self, address):
-        if 'DJBLOCKCHAIN_MOCK' in os.environ and os.environ['DJBLOCKCHAIN_MOCK']:
-            pass
-        # pick the sandbox account with the most tezies and transfer to the new account
-        DEFAULT_TZLOCAL_TEZIES = 1_200_000_000
-        try:
-            richest_sandbox = self.get_richest_sandbox_account()
-            self.transfer(
-                richest_sandbox.public_key_hash(),
-                richest_sandbox.secret_exponent,
-                address,
-                DEFAULT_TZLOCAL_TEZIES
-            )
-        except ConnectionError as e:
-            logger.info(f"Connection error while trying to either get balance or transfer tezies to {address}")
-
-    def _provision_carthagenet(self, address):
-        bank = self.get_client(Bank.key)
-        balance = bank.account()['balance'] or 0
-        if int(balance) < 50:
-            logger.error(
-                '[cartage] Insufficient balance to transfer',
-                balance,
-                Bank.address,
-            )
-        else:
-            self.transfer(
-                Bank.address,
-                Bank.key,
-                address,
-                49_000_000,
-            )
-            logger.info(
-                f'[cartage] {Bank.address} sent 49tz remains: {balance}')
+    def sandbox_wallets(self):
+        # during tests, use sandbox accounts to avoid having to make time-eating transfers
+        return self.blockchain.name == 'tzlocal' and bool(os.getenv('DJBLOCKCHAIN_MOCK'))
 
-    def provision(self, address):
+    def create_wallet(self, passphrase):
+        if self.sandbox_wallets():
+            key = self.get_sandbox_account()
+            return key.public_key_hash(), key.secret_exponent
+        return self.derive_wallet(passphrase)
+
+    def uses_key_pool(self):
+        return not self.sandbox_wallets()
+
+    def get_funders(self):
+        from pytezos import Key
         if self.blockchain.name == 'tezos carthagenet':
-            self._provision_carthagenet(address)
+            return [Key.from_secret_exponent(Bank.key)]
         elif self.blockchain.name == 'tzlocal':
-            self._provision_tzlocal(address)
+            return [Key.from_encoded_key(i) for i in self.sandbox_ids]
+        return []
+
+    def provision(self, address):
+        amount = self.provision_amounts.get(self.blockchain.name, None)
+        if not amount:
+            return
+        Provision.objects.create(
+            blockchain=self.blockchain,
+            address=address,
+            amount=amount,
+        )
+
+    @staticmethod
+    def assign_funders(provisions, balances, size):
+        """
+        Spread provisions over funders, return a funder: provisions dict.
+
+        Each provision goes to the funder with the most remaining balance,
+        that funder gets at most size provisions. Provisions that no funder
+        can afford are left out.
+        """
+        remaining = dict(balances)
+        batches = {funder: [] for funder in balances}
+        for provision in provisions:
+            candidates = [
+                funder for funder, batch in batches.items()
+                if len(batch) < size
+                and remaining[funder] - provision.amount >= PROVISION_RESERVE
+            ]
+            if not candidates:
+                continue
+            funder = max(candidates, key=lambda funder: remaining[funder])
+            remaining[funder] -= provision.amount
+            batches[funder].append(provision)
+        return {funder: batch for funder, batch in batches.items() if batch}
+
+    def provision_batch(self, size=PROVISION_BATCH):
+        """
+        Fund pending provisions with one operation group per funder.
+
+        Meant to run once per block: a source can only have one manager
+        operation per block, so all the transfers of a funder are grouped.
+        """
+        from pytezos import pytezos
+        from requests.exceptions import ConnectionError
+
+        self.watch_provisions(pytezos.using(shell=self.blockchain.endpoint))
+
+        funders = {
+            funder.public_key_hash(): funder
+            for funder in self.get_funders()
+        }
+        provisions = list(Provision.objects.filter(
+            blockchain=self.blockchain,
+            txhash=None,
+        ).order_by('pk')[:size * len(funders)])
+        if not provisions:
+            return
+
+        # balances are fetched once for the whole batch
+        balances = dict()
+        for address, funder in funders.items():
+            try:
+                balances[address] = self.get_balance(
+                    address,
+                    funder.secret_exponent,
+                )
+            except ConnectionError:
+                logger.info(f'Connection error while getting balance of {address}')
+
+        batches = self.assign_funders(provisions, balances, size)
+        if len(provisions) > sum(len(batch) for batch in batches.values()):
+            logger.error(f'Insufficient funder balance on {self.blockchain}')
+
+        for address, batch in batches.items():
+            client = pytezos.using(
+                key=funders[address],
+                shell=self.blockchain.endpoint,
+            )
+            try:
+                signed = client.bulk(*[
+                    client.transaction(
+                        destination=provision.address,
+                        amount=provision.amount,
+                    )
+                    for provision in batch
+                ]).autofill().sign()
+                branch_level = self.get_block_level(signed.branch)
+                opg = signed.inject()
+            except Exception as exception:
+                logger.exception(exception)
+                continue
+
+            Provision.objects.filter(
+                pk__in=[provision.pk for provision in batch]
+            ).update(
+                txhash=opg['hash'],
+                funder=address,
+                branch_level=branch_level,
+            )
+            logger.info(f'{address} funded {len(batch)} addresses in {opg["hash"]}')
+
+    def watch_provisions(self, client):
+        """
+        Record the inclusion of funding operations, put provisions whose
+        operation can't be included anymore back in queue, as watch_mempool
+        does for transactions.
+        """
+        provisions = Provision.objects.filter(
+            blockchain=self.blockchain,
+            level=None,
+        ).exclude(txhash=None)
+        if not provisions:
+            return
+
+        metadata = client.shell.head.metadata()
+        head_level = metadata['level_info']['level']
+        ttl = metadata['max_operations_ttl']
+        statuses = self.mempool_statuses(
+            client.shell.mempool.pending_operations()
+        )
+
+        # the provisions of a batch share their operation
+        for provision in {p.txhash: p for p in provisions}.values():
+            status = statuses.get(provision.txhash, None)
+            if status in self.dead_statuses:
+                reason = f'Operation {status} by the mempool'
+            elif (
+                not status
+                and provision.branch_level
+                and head_level - provision.branch_level > ttl
+            ):
+                level = self.find_inclusion(client, provision, ttl)
+                if level:
+                    Provision.objects.filter(txhash=provision.txhash).update(
+                        level=level,
+                    )
+                    continue
+                reason = f'Operation expired after {ttl} blocks'
+            else:
+                continue
+
+            logger.info(f'{provision.txhash}: {reason}, requeuing provisions')
+            Provision.objects.filter(txhash=provision.txhash).update(
+                txhash=None,
+                funder=None,
+                branch_level=None,
+            )
 
     def get_balance(self, account_address, private_key):
         client = self.get_client(private_key)
         balance = client.account()['balance']
         return int(balance)
 
+    def sender_client(self, account, reveal=False):
+        """
+        Return a client for account, with only its public key when the
+        signer process holds the private key.
+        """
+        from pytezos import Key
+        if SETTINGS['SIGNER_SOCKET']:
+            key = Key.from_encoded_key(
+                signer(SETTINGS['SIGNER_SOCKET']).public_key(account.address)
+            )
+        else:
+            key = Key.from_secret_exponent(account.private_key)
+        return self.get_client(key, reveal=reveal, sender=account.address)
+
     def get_client(self, private_key, reveal=False, sender=None):
+        """Return a client for a private key or pytezos Key."""
+        from pytezos import Key, pytezos
+        from pytezos.rpc.node import RpcError
+        if not isinstance(private_key, Key):
+            private_key = Key.from_secret_exponent(private_key)
         client = pytezos.using(
-            key=Key.from_secret_exponent(private_key),
+            key=private_key,
             shell=self.blockchain.endpoint,
         )
-        if reveal:
+        context = ChainContext(self.blockchain)
+        if reveal and not context.get(f'revealed.{sender}'):
             # key reveal dance
             try:
-                operation = client.reveal().autofill().sign().inject()
+                operation = self.sign(client.reveal().autofill()).inject()
             except RpcError as e:
                 if 'id' in e.args[0] and 'previously_revealed_key' in e.args[0]['id']:
+                    context.set(f'revealed.{sender}', True)
                     return client
                 raise e
             else:
@@ -157,6 +453,8 @@ class Provider(BaseProvider):
                 opg = self.wait_injection(client, operation)
                 if not opg:
                     raise ValidationError(f'Could not reveal {sender}')
+                context.counter_reset(sender)
+                context.set(f'revealed.{sender}', True)
 
         return client
 
@@ -178,7 +476,9 @@ class Provider(BaseProvider):
         return opg
 
     def deploy(self, transaction):
-        if transaction.amount:
+        if transaction.signed_operation and self.reinject(transaction):
+            return transaction.txhash
+        elif transaction.amount:
             return self.transfer(transaction)
         elif transaction.function:
             return self.send(transaction)
@@ -187,50 +487,311 @@ class Provider(BaseProvider):
 
     def originate(self, transaction):
         logger.debug(f'{transaction}.originate({transaction.args}): start')
-        client = self.get_client(
-            transaction.sender.private_key,
-            reveal=True,
-            sender=transaction.sender.address
-        )
+        client = self.sender_client(transaction.sender, reveal=True)
 
         if not client.balance():
             raise ValidationError(
                 f'{transaction.sender.address} needs more than 0 tezies')
 
-        tx = client.origination(dict(
-            code=transaction.contract_micheline,
+        opg = client
+        code = transaction.contract_micheline
+        if SETTINGS['GLOBAL_CONSTANT_BYTES'] and transaction.micheline_code_id:
+            code, register = self.global_constants(client, transaction)
+            # registered by the same operation group, before the origination
+            for value in register:
+                opg = opg.register_global_constant(value)
+
+        tx = self.sign(self.autofill(client, opg.origination(dict(
+            code=code,
             storage=transaction.args,
-        )).autofill().sign()
+        )), transaction))
 
         result = self.write_transaction(tx, transaction)
 
         logger.info(f'{transaction.contract_name}.deploy({transaction.args}): {result}')
         return result
 
+    def global_constants(self, client, transaction):
+        """
+        Return the code to originate with global constants, and the values of
+        the constants that the origination has to register.
+
+        A constant that another origination in flight registers is expanded
+        rather than registered twice. Registrations of originations that
+        are held, aborted, retrying or expired are taken over.
+        """
+        code, values = code_constants(
+            transaction.micheline_code_id,
+            SETTINGS['GLOBAL_CONSTANT_BYTES'],
+        )
+        constants = {
+            constant.hash: constant
+            for constant in GlobalConstant.objects.filter(
+                blockchain=self.blockchain,
+                hash__in=values,
+            ).select_related('transaction')
+        }
+        register = []
+        expand = dict()
+        for digest, value in values.items():
+            constant = constants.get(digest, None)
+            if not constant:
+                constant, created = GlobalConstant.objects.get_or_create(
+                    blockchain=self.blockchain,
+                    hash=digest,
+                    defaults=dict(code=Code.objects.store(Code.dumps(value))),
+                )
+            if constant.is_registered:
+                continue
+            if self.constant_exists(client, digest):
+                constant.registered = True
+                constant.save(update_fields=['registered'])
+                continue
+            claims = GlobalConstant.objects.filter(pk=constant.pk)
+            claimed = claims.filter(
+                Q(transaction=None)
+                | Q(transaction=transaction)
+                | Q(transaction__state__in=('held', 'aborted'))
+                # a retrying claimant with a signed operation re-injects it
+                | Q(
+                    transaction__state='retrying',
+                    transaction__signed_operation=None,
+                )
+            ).update(transaction=transaction)
+            if not claimed:
+                claimed = claims.filter(
+                    transaction__branch_level__lt=self.expired_branch(client),
+                ).update(transaction=transaction)
+            if claimed:
+                register.append(value)
+            else:
+                expand[digest] = value
+
+        if expand:
+            code = expand_constants(code, expand)
+        return code, register
+
+    def expired_branch(self, client):
+        """Return the lowest branch level operations can still be on."""
+        metadata = client.shell.head.metadata()
+        return metadata['level_info']['level'] - metadata['max_operations_ttl']
+
+    def constant_exists(self, client, digest):
+        from pytezos.rpc.node import RpcError
+        try:
+            client.shell.blocks['head'].context.global_constants[digest]()
+        except RpcError:
+            return False
+        return True
+
+    def sign(self, opg):
+        """
+        Sign opg with the key of its client, or in the signer process when
+        SIGNER_SOCKET is set: only the forged bytes leave the worker, over
+        the connection of its thread.
+
+        An operation group has one signature and a worker deploys one
+        transaction at a time, so there is one message per request here.
+        Callers that sign several groups at once, such as a bulk of
+        transactions of different senders, can pass them all in one
+        Signer.sign call.
+        """
+        if not SETTINGS['SIGNER_SOCKET']:
+            return opg.sign()
+        signature, = signer(SETTINGS['SIGNER_SOCKET']).sign([(
+            opg.key.public_key_hash(),
+            WATERMARK + bytes.fromhex(opg.forge()),
+        )])
+        return opg._spawn(signature=signature)
+
+    def autofill(self, client, opg, transaction):
+        """
+        Autofill opg with the protocol, branch and counter from the context.
+
+        Forging and signing are local, pytezos only calls the node to fetch
+        constants and simulate the operation.
+        """
+        from pytezos.rpc.node import RpcError
+        context = ChainContext(self.blockchain)
+        head = context.head(client)
+        opg.protocol = head['protocol']
+        opg.chain_id = context.chain_id(client)
+        opg.branch = head['hash']
+        source = client.key.public_key_hash()
+        try:
+            opg = opg.autofill(counter=context.counter(client, source))
+        except RpcError as e:
+            if 'counter_in_the_' in str(e):
+                context.counter_reset(source)
+                raise TemporaryError(f'Counter of {source} out of sync')
+            raise
+        return self.set_fee(opg, transaction)
+
+    def set_fee(self, opg, transaction):
+        """
+        Raise the fee of opg to the percentile of recent fees for its priority.
+
+        Bakers order operations by fee per gas or per byte, whichever weighs
+        most, so the fee must reach the percentile on both.
+        """
+        fee = int(opg.contents[0]['fee'])
+        gas = sum(int(content['gas_limit']) for content in opg.contents)
+        percent = self.blockchain.get_fee_percentile(transaction.priority)
+        samples = self.blockchain.fee_samples
+        if percent and samples:
+            size = len(bytes.fromhex(opg.forge())) + 64  # signature
+            fee = max(fee, math.ceil(max(
+                gas * percentile([s[0] for s in samples], percent),
+                size * percentile([s[1] for s in samples], percent),
+            ) / 1000))
+            opg.contents[0]['fee'] = str(fee)
+        transaction.fee = fee
+        transaction.fee_percentile = percent
+        transaction.gasprice = fee * 1000 // gas if gas else None
+        return opg
+
+    @staticmethod
+    def fee_sample(content):
+        """Return [fee per gas, fee per byte] in nanotez of a block content."""
+        from pytezos.operation.forge import forge_operation
+        if content.get('kind') not in ('transaction', 'origination'):
+            return
+        try:
+            fee = int(content['fee']) * 1000
+            gas = int(content['gas_limit'])
+            size = len(forge_operation(content))
+        except Exception:
+            return
+        if gas and size:
+            return [fee // gas, fee // size]
+
     def write_transaction(self, tx, transaction):
-        origination = tx.inject(
-            _async=False,
-            # this seems not to be working for us, systematic TimeoutError
-            #min_confirmations=transaction.blockchain.confirmation_blocks,
+        """
+        Persist the hash and bytes of a signed operation then inject it.
+
+        The hash is computed locally and the transaction is watching before
+        injection, so that djtezos_sync and watch_mempool track the operation
+        even if the worker dies right after, injection doesn't wait for the
+        operation to be included.
+        """
+        transaction.gas = tx.contents[0]['fee']
+        transaction.txhash = tx.hash()
+        transaction.branch_level = self.get_block_level(tx.branch)
+        transaction.signed_operation = tx.binary_payload()
+        with db_transaction.atomic():
+            transaction.state_set('watching', error='')
+        result = self.inject(transaction)
+        ChainContext(self.blockchain).counter_set(
+            tx.contents[0]['source'],
+            max(int(content['counter']) for content in tx.contents),
         )
-        transaction.gas = origination['contents'][0]['fee']
-        transaction.txhash = origination['hash']
+        return result
+
+    def reinject(self, transaction):
+        """
+        Inject the persisted operation of a previous attempt again, return
+        False after clearing it if it can't be included, to sign a new one.
+
+        The previous attempt may not have injected it: the same bytes can't
+        double spend. An operation that may be included already is left to
+        djtezos_sync and watch_mempool.
+        """
+        from pytezos import pytezos
+        from pytezos.rpc.node import RpcError
+        client = pytezos.using(shell=self.blockchain.endpoint)
+        metadata = client.shell.head.metadata()
+        ttl = metadata['max_operations_ttl']
+        if (
+            not transaction.branch_level
+            or metadata['level_info']['level'] - transaction.branch_level <= ttl
+        ):
+            try:
+                self.inject(transaction)
+            except RpcError as e:
+                if 'counter_in_the_past' in str(e) or 'already' in str(e):
+                    return True
+                reason = f'Injection failed: {e}'
+            else:
+                return True
+        elif self.find_inclusion(client, transaction, ttl):
+            return True
+        else:
+            reason = f'Operation expired after {ttl} blocks'
+
+        logger.info(f'{transaction}: {reason}, signing a new operation')
+        transaction.txhash = None
+        transaction.signed_operation = None
+        transaction.branch_level = None
+        transaction.save(
+            update_fields=['txhash', 'signed_operation', 'branch_level'],
+        )
+        return False
+
+    def get_block_level(self, block_hash):
+        from pytezos import pytezos
+        head = ChainContext(self.blockchain).get('head')
+        if head and head['hash'] == block_hash:
+            return head['level']
+        client = pytezos.using(shell=self.blockchain.endpoint)
+        return client.shell.blocks[block_hash].header()['level']
+
+    def inject(self, transaction):
+        from pytezos import pytezos
+        client = pytezos.using(shell=self.blockchain.endpoint)
+        client.shell.injection.operation.post(
+            operation=bytes(transaction.signed_operation),
+            _async=True,
+        )
+        logger.info(f'{transaction}: injected')
+        return transaction.txhash
+
+    def encode_args(self, code_hash, function, args):
+        from pytezos.michelson.micheline import MichelsonRuntimeError
+        schema = entrypoints(code_hash).get(function, None)
+        if schema is None:
+            raise ValidationError(f'Contract has no {function} entrypoint')
+
+        # the same python object as the contract interface gets from
+        # method(*args)
+        args = tuple(args or ())
+        if len(args) == 1:
+            args = args[0]
+        elif not args:
+            args = None
+        try:
+            return schema.from_python_object(args).to_micheline_value()
+        except (MichelsonRuntimeError, ValueError) as e:
+            raise ValidationError(
+                f'Invalid args for {function}: {" ".join(map(str, e.args))}'
+            )
 
     def send(self, transaction):
         logger.debug(f'{transaction}({transaction.args}): get_client')
-        client = self.get_client(transaction.sender.private_key)
-        logger.debug(f'{transaction}({transaction.args}): counter = {client.account()["counter"]}')
-        ci = client.contract(transaction.contract_address)
-        method = getattr(ci, transaction.function)
-        try:
-            tx = method(*transaction.args)
-        except ValueError as e:
-            raise PermanentError(*e.args)
+        client = self.sender_client(transaction.sender)
+        if transaction.args_mich is not None:
+            # encoded at enqueue time, may be an empty list
+            tx = client.transaction(
+                destination=transaction.contract_address,
+                amount=0,
+                parameters=dict(
+                    entrypoint=transaction.function,
+                    value=transaction.args_mich,
+                ),
+            )
+        else:
+            ci = client.contract(transaction.contract_address)
+            method = getattr(ci, transaction.function)
+            try:
+                tx = method(*transaction.args).as_transaction()
+            except ValueError as e:
+                raise PermanentError(*e.args)
+        tx = self.sign(self.autofill(client, tx, transaction))
         result = self.write_transaction(tx, transaction)
         logger.debug(f'{transaction}({transaction.args}): {result}')
         return result
 
     def watch(self, transaction):
+        from pytezos import pytezos
         logger.debug(f'{transaction}: watch begin')
 
         client = pytezos.using(shell=self.blockchain.endpoint)
@@ -252,37 +813,34 @@ class Provider(BaseProvider):
             if start_level - current_level >= max_depth:
                 raise TemporaryError(f'Did not find operation {transaction.txhash}')
 
-        level_operation = client.shell.blocks[opg['branch']].level()
-        offset = client.shell.head.metadata()['level_info']['level_position'] - level_operation
-        if self.blockchain.confirmation_blocks and offset < self.blockchain.confirmation_blocks:
-            logger.info(f'{transaction} watch: not enough confirmation blocks')
-            raise TemporaryError('Not enough confirmation blocks')
-
-        result = opg['contents'][0]['metadata']['operation_result']
+        # watch_blockchain counts confirmations of the included operations
         transaction.gas = opg['contents'][0]['fee']
-        if 'originated_contracts' in result:
-            transaction.contract_address = result['originated_contracts'][0]
+        # originations may come after global constant registrations
+        for content in opg['contents']:
+            result = content['metadata']['operation_result']
+            if 'originated_contracts' in result:
+                transaction.contract_address = result['originated_contracts'][0]
 
         logger.info(f'{transaction}: watch success')
 
     def watch_blockchain(self, blockchain):
+        """
+        Record the inclusion of operations in new blocks, demote those of
+        orphaned blocks, then promote those with enough confirmations.
+        """
+        from pytezos import pytezos
         client = pytezos.using(shell=blockchain.endpoint)
         start_level = current_level = client.shell.head.metadata()['level_info']['level_position']
 
         if blockchain.max_level and start_level < blockchain.max_level:
-            # reorg
-            Transaction.objects.filter(
-                sender__blockchain=blockchain,
-                level__gte=blockchain.max_level,
-            ).exclude(level=None).update(
-                level=None,
-                txhash=None,
-                contract_address=None,
-                state='held',
-            )
-            blockchain.max_level = blockchain.max_level
-            blockchain.save()
-            return  # commit to reorg in a transaction
+            # the node is behind, wait for it rather than demote on its word
+            logger.warning(f'{blockchain}: head {start_level} below scanned level {blockchain.max_level}, skipping')
+            return
+
+        # scan the levels of a new branch again
+        orphaned = self.demote_orphans(client, blockchain, start_level)
+        if orphaned and blockchain.max_level:
+            blockchain.max_level = min(blockchain.max_level, orphaned - 1)
 
         if blockchain.max_level and start_level == blockchain.max_level:
             # no need to go all way back further if we are up to date just
@@ -297,11 +855,11 @@ class Provider(BaseProvider):
             # go with an arbitrary backlog
             max_depth = 500
 
-        hashes = Transaction.objects.filter(
+        hashes = set(Transaction.objects.filter(
             sender__blockchain=blockchain
         ).exclude(
             txhash=None
-        ).values_list('txhash', flat=True)
+        ).values_list('txhash', flat=True))
 
         contracts = Transaction.objects.exclude(
             contract_address=None,
@@ -316,56 +874,223 @@ class Provider(BaseProvider):
             flat=True,
         )
 
+        samples = []
         while current_level and start_level - current_level < max_depth:
             print('level', current_level)
             block = client.shell.blocks[current_level]
+            block_hash = None
             for ops in block.operations():
                 for op in ops:
+                    if len(samples) < FEE_SAMPLES:
+                        for content in op.get('contents', []):
+                            sample = self.fee_sample(content)
+                            if sample:
+                                samples.append(sample)
+
                     if op['hash'] not in hashes:
                         continue
+                    block_hash = block_hash or block.hash()
+                    print(f'Syncing operation {op["hash"]}')
+                    self.sync_operation(current_level, block_hash, op)
                     for content in op.get('contents', []):
                         if content['kind'] == 'origination':
-                            print(f'Syncing origination from {op["hash"]}')
                             result = content['metadata']['operation_result']
                             tx = Transaction.objects.get(txhash=op['hash'])
-                            spool = not tx.contract_address
-                            tx.level = current_level
                             tx.contract_address = result['originated_contracts'][0]
-                            tx.gas = content['fee']
-                            tx.state_set('done')
+                            tx.save(update_fields=['contract_address'])
                             tx.call_set.update(
                                 contract_address=tx.contract_address,
                             )
 
-                        elif content['kind'] == 'transaction':
-                            print(f'Syncing transaction from {op["hash"]}')
-                            destination = content.get('destination', None)
-                            if destination in addresses:
-                                self.sync_call(current_level, op, content, contracts, blockchain)
+                        elif (
+                            content['kind'] == 'transaction'
+                            and content.get('destination', None) in addresses
+                        ):
+                            self.sync_call(current_level, block_hash, op, content, contracts, blockchain)
 
             current_level -= 1
 
+        self.promote(blockchain, start_level)
+
         blockchain.max_level = start_level - 1  # consider head as suceptible to change
+        # samples are collected from the most recent block backwards
+        blockchain.fee_samples = (
+            samples + blockchain.fee_samples
+        )[:FEE_SAMPLES]
         blockchain.save()
 
-    def sync_call(self, level, op, content, contracts, blockchain):
+    @staticmethod
+    def operations(blockchain):
+        """
+        Transactions of a blockchain, with calls recorded from blocks that
+        only have a contract.
+        """
+        return Transaction.objects.filter(
+            Q(sender__blockchain=blockchain)
+            | Q(contract__sender__blockchain=blockchain)
+        )
+
+    def demote_orphans(self, client, blockchain, head):
+        """
+        Put back to watching the operations included in blocks that are not
+        in the chain anymore, return the lowest orphaned level.
+
+        Only blocks of operations that are not confirmed yet are checked, one
+        call per level up to the head.
+        """
+        included = self.operations(blockchain).filter(
+            state='watching',
+        ).exclude(level=None)
+        blocks = set(included.filter(
+            level__lte=head,
+        ).exclude(
+            block_hash=None,
+        ).values_list('level', 'block_hash').distinct())
+
+        orphans = [
+            (level, block_hash)
+            for level, block_hash in sorted(blocks)
+            if client.shell.blocks[level].hash() != block_hash
+        ]
+        if not orphans:
+            return None
+
+        demoted = included.filter(functools.reduce(Q.__or__, [
+            Q(level=level, block_hash=block_hash)
+            for level, block_hash in orphans
+        ])).state_set(
+            'watching',
+            error='Block orphaned by a reorg',
+            level=None,
+            block_hash=None,
+        )
+        lowest = orphans[0][0]
+        logger.info(f'{blockchain}: {demoted} operations orphaned from level {lowest}')
+        return lowest
+
+    def promote(self, blockchain, head):
+        """
+        Mark done the included operations that have confirmation_blocks
+        blocks on top of theirs, with one update, return how many.
+        """
+        return self.operations(blockchain).filter(
+            state='watching',
+            level__lte=head - blockchain.confirmation_blocks,
+        ).state_set('done', error='')
+
+    @staticmethod
+    def mempool_statuses(pending_operations):
+        """Return a hash: status dict from a pending_operations response."""
+        statuses = dict()
+        for status, operations in pending_operations.items():
+            for operation in operations:
+                if isinstance(operation, dict):
+                    statuses[operation['hash']] = status
+                else:
+                    # older nodes return [hash, operation] pairs
+                    statuses[operation[0]] = status
+        return statuses
+
+    def watch_mempool(self, blockchain):
+        """
+        Put injected operations that can't be included anymore back in queue.
+
+        An operation is dead if the mempool refused it, or if it is neither
+        included, which djtezos_sync records, nor in the mempool and its
+        branch is older than the max operations TTL. Operations of
+        transactions still deploying are left to their worker.
+        """
+        from pytezos import pytezos
+        client = pytezos.using(shell=blockchain.endpoint)
+
+        # included operations are not in the mempool anymore
+        transactions = Transaction.objects.filter(
+            sender__blockchain=blockchain,
+            state='watching',
+            level=None,
+        ).exclude(txhash=None)
+        if not transactions:
+            return
+
+        metadata = client.shell.head.metadata()
+        head_level = metadata['level_info']['level']
+        ttl = metadata['max_operations_ttl']
+        statuses = self.mempool_statuses(
+            client.shell.mempool.pending_operations()
+        )
+
+        for transaction in transactions:
+            status = statuses.get(transaction.txhash, None)
+            if status in self.dead_statuses:
+                reason = f'Operation {status} by the mempool'
+            elif (
+                not status
+                and transaction.branch_level
+                and head_level - transaction.branch_level > ttl
+            ):
+                level = self.find_inclusion(client, transaction, ttl)
+                if level:
+                    # included where djtezos_sync didn't look for it, which
+                    # also records the block it fetched by the same level
+                    Transaction.objects.filter(pk=transaction.pk).update(
+                        level=level,
+                        block_hash=client.shell.blocks[level].hash(),
+                    )
+                    continue
+                reason = f'Operation expired after {ttl} blocks'
+            else:
+                continue
+
+            logger.info(f'{transaction}: {reason}, requeuing')
+            transaction.txhash = None
+            transaction.signed_operation = None
+            transaction.branch_level = None
+            transaction.last_fail = timezone.now()
+            transaction.state_set('retrying', error=reason)
+
+    def find_inclusion(self, client, transaction, ttl):
+        """
+        Return the level of the block that includes the operation of
+        transaction, which can only be within ttl blocks of its branch.
+        """
+        for level in range(
+            transaction.branch_level + 1,
+            transaction.branch_level + ttl + 1,
+        ):
+            for hashes in client.shell.blocks[level].operation_hashes():
+                if transaction.txhash in hashes:
+                    return level
+
+    def sync_operation(self, level, block_hash, op):
+        """Record the inclusion of an operation of ours, whatever its kind."""
+        operations = Transaction.objects.filter(txhash=op['hash'])
+        operations.update(
+            level=level,
+            block_hash=block_hash,
+            gas=op['contents'][0]['fee'],
+        )
+        # injected by an attempt that seemed to fail
+        operations.filter(state='retrying').state_set('watching', error='')
+
+    def sync_call(self, level, block_hash, op, content, contracts, blockchain):
+        if 'parameters' not in content:
+            return
         contract = contracts.get(contract_address=content['destination'])
 
-        parameters = content.get('parameters', {})
+        parameters = content['parameters']
 
-        call = contract.call_set.filter(
-            txhash=op['hash'],
-            contract_address=content['destination'],
-        ).first()
+        # calls may not reference the contract they were sent to
+        call = Transaction.objects.filter(txhash=op['hash']).first()
         if not call:
             call = Call(
                 txhash=op['hash'],
                 function=parameters['entrypoint'],
                 contract_address=content['destination'],
                 contract=contract,
+                state='watching',
             )
-        call.state = 'done'
         call.args_mich = parameters['value']
         call.gas = content['fee']
         call.level = level
+        call.block_hash = block_hash
         call.save()
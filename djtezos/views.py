@@ -1,17 +1,35 @@
-from rest_framework import viewsets
+import json
+import time
+import uuid
+
+from rest_framework import (
+    exceptions,
+    generics,
+    renderers,
+    serializers,
+    status,
+    viewsets,
+)
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.response import Response
 
 from django import http
-from django.db.models import Q
+from django.core.exceptions import ValidationError
+from django.db import transaction as db_transaction
+from django.db.models import Max, Q
 
 from .models import (
+    SETTINGS,
     Account,
+    ArchivedTransaction,
     Blockchain,
+    StateTransition,
     Transaction,
 )
 
 
+from .pagination import KeysetPagination
 from .serializers import (
     AccountSerializer,
     BlockchainSerializer,
@@ -21,6 +39,21 @@ from .serializers import (
 )
 
 
+class RequestTooLarge(exceptions.APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Request too large.'
+    default_code = 'request_too_large'
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # only errors are rendered, events are streamed
+        return json.dumps(data).encode('utf8')
+
+
 class AccountViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Account.objects.all()
     serializer_class = AccountSerializer
@@ -55,26 +88,247 @@ class BlockchainViewSet(viewsets.ReadOnlyModelViewSet):
 class TransactionViewSet(viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    # not serialized, or only when requested with ?expand= on lists
+    list_deferred_fields = (
+        'args_mich',
+        'signed_operation',
+        'sender__blockchain__fee_samples',
+    )
+    # fetch with the transactions when their property is expanded
+    expand_related = dict(
+        contract_micheline='micheline_code',
+    )
+    # binary Base58Field columns only support exact lookups
     search_fields = [
-        'txhash',
+        '=txhash',
         'contract_name',
-        'contract_address',
-        'blockchain__name',
-        'sender__address',
-        'receiver__address',
+        '=contract_address',
+        'sender__blockchain__name',
+        '=sender__address',
+        '=receiver__address',
     ]
 
     def get_serializer_class(self):
-        if self.action == 'create':
+        if self.action in ('create', 'bulk'):
             return TransactionCreateSerializer
         if self.action in ('partial_update', 'update'):
             return TransactionUpdateSerializer
         return TransactionSerializer
 
+    def perform_create(self, serializer):
+        # invalid args are only known once the contract is resolved
+        try:
+            serializer.save()
+        except ValidationError as e:
+            raise serializers.ValidationError(e.messages)
+
+    def get_expand(self):
+        return set(filter(None, self.request.query_params.get(
+            'expand', ''
+        ).split(',')))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'list':
+            context['expand'] = self.get_expand()
+        return context
+
     def get_queryset(self):
-        qs = super().get_queryset()
+        return self.get_user_queryset(super().get_queryset())
+
+    def get_archive_queryset(self):
+        return self.get_user_queryset(ArchivedTransaction.objects.all())
 
+    def get_user_queryset(self, qs):
         if not self.request.user.is_superuser:
             qs = qs.for_user(self.request.user)
 
+        if self.action == 'list':
+            expand = self.get_expand()
+            fields = {field.name for field in qs.model._meta.get_fields()}
+            qs = qs.select_related('sender__blockchain', *[
+                related
+                for name, related in self.expand_related.items()
+                if name in expand and related in fields
+            ]).defer(*[
+                name
+                for name in (
+                    *self.list_deferred_fields,
+                    *TransactionSerializer.expandable_fields,
+                )
+                if name not in expand and name.split('__')[0] in fields
+            ])
+
         return qs
+
+    def paginate_queryset(self, queryset):
+        # archived transactions are listed with the live ones
+        if self.paginator is None:
+            return None
+        return self.paginator.paginate_querysets(
+            [queryset, self.get_archive_queryset()],
+            self.request,
+            view=self,
+        )
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except http.Http404:
+            if self.action != 'retrieve':
+                raise
+        obj = generics.get_object_or_404(
+            self.get_archive_queryset(),
+            pk=self.kwargs[self.lookup_url_kwarg or self.lookup_field],
+        )
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    @action(
+        detail=False,
+        methods=['get'],
+        renderer_classes=[EventStreamRenderer, renderers.JSONRenderer],
+    )
+    def events(self, request):
+        """
+        Stream state transitions of the user's transactions as server-sent
+        events.
+
+        Starts after the Last-Event-ID header or last_event_id parameter, or
+        with new transitions only, and ends after EVENTS_TIMEOUT seconds for
+        the client to reconnect.
+
+        Each client holds a worker for up to EVENTS_TIMEOUT seconds, so serve
+        this action with threaded or async workers, or lower EVENTS_TIMEOUT.
+        """
+        transitions = StateTransition.objects.filter(
+            transaction__in=self.get_queryset().values('pk'),
+        )
+        if 'transaction' in request.query_params:
+            # validated here, the stream can't respond with an error
+            try:
+                transaction = uuid.UUID(request.query_params['transaction'])
+            except ValueError:
+                raise exceptions.ValidationError('Invalid transaction id')
+            transitions = transitions.filter(transaction=transaction)
+
+        last_id = request.headers.get(
+            'Last-Event-ID',
+            request.query_params.get('last_event_id', None),
+        )
+        if last_id is None:
+            last_id = StateTransition.objects.aggregate(
+                last_id=Max('pk'),
+            )['last_id'] or 0
+        try:
+            last_id = int(last_id)
+        except ValueError:
+            raise exceptions.ValidationError('Invalid last event id')
+
+        response = http.StreamingHttpResponse(
+            self.stream(transitions, last_id),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def stream(self, transitions, last_id, batch=100):
+        yield f'retry: {int(SETTINGS["EVENTS_POLL"] * 1000)}\n\n'
+        deadline = time.monotonic() + SETTINGS['EVENTS_TIMEOUT']
+        while True:
+            events = transitions.filter(pk__gt=last_id).settled(batch)
+            for event in events:
+                last_id = event.pk
+                data = json.dumps(event.as_event())
+                yield f'id: {last_id}\nevent: state\ndata: {data}\n\n'
+
+            if len(events) == batch:
+                continue
+            if time.monotonic() >= deadline:
+                return
+            # comment line to keep proxies from closing an idle stream
+            yield ':\n\n'
+            time.sleep(SETTINGS['EVENTS_POLL'])
+
+    def read_lines(self, request, max_bytes):
+        """
+        Yield the lines of the request body, raise RequestTooLarge after
+        max_bytes even without Content-Length.
+        """
+        stream = request.stream
+        size = 0
+        while stream:
+            line = stream.readline(max_bytes + 1 - size)
+            if not line:
+                return
+            size += len(line)
+            if size > max_bytes:
+                raise RequestTooLarge(f'Body exceeds {max_bytes} bytes')
+            yield line
+
+    def get_bulk_items(self, request):
+        """Return the list of items of a JSON array or NDJSON request."""
+        max_items = SETTINGS['BULK_MAX_ITEMS']
+        max_bytes = SETTINGS['BULK_MAX_BYTES']
+        if int(request.META.get('CONTENT_LENGTH') or 0) > max_bytes:
+            raise RequestTooLarge(f'Body exceeds {max_bytes} bytes')
+
+        if request.content_type.startswith('application/x-ndjson'):
+            items = []
+            for line in self.read_lines(request, max_bytes):
+                if not line.strip():
+                    continue
+                if len(items) == max_items:
+                    raise RequestTooLarge(f'More than {max_items} items')
+                try:
+                    items.append(json.loads(line))
+                except ValueError as e:
+                    raise exceptions.ParseError(f'Line {len(items) + 1}: {e}')
+        else:
+            try:
+                body = b''.join(self.read_lines(request, max_bytes))
+                items = json.loads(body)
+            except ValueError as e:
+                raise exceptions.ParseError(f'JSON parse error: {e}')
+            if not isinstance(items, list):
+                raise exceptions.ParseError('Expected a list of transactions')
+            if len(items) > max_items:
+                raise RequestTooLarge(f'More than {max_items} items')
+        return items
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create transactions from a JSON array or NDJSON body.
+
+        Respond with the id or the errors of each item, in order, valid items
+        are created even if others are not.
+        """
+        items = self.get_bulk_items(request)
+        serializer = self.get_serializer(data=items, many=True)
+        results = []
+        transactions = []
+        contract_codes = dict()
+        for item in items:
+            try:
+                data = serializer.child.run_validation(item)
+                tx = Transaction(**data)
+                tx.validate(contract_codes)
+            except serializers.ValidationError as e:
+                results.append(dict(errors=e.detail))
+            except ValidationError as e:
+                results.append(dict(errors=e.messages))
+            else:
+                transactions.append(tx)
+                results.append(dict(id=str(tx.pk)))
+
+        with db_transaction.atomic():
+            Transaction.objects.bulk_enqueue(transactions)
+
+        return Response(
+            results,
+            status=status.HTTP_201_CREATED
+            if transactions else status.HTTP_400_BAD_REQUEST,
+        )
@@ -6,6 +6,7 @@ setup(
     versioning='dev',
     setup_requires='setupmeta',
     install_requires=[
+        'base58',
         'django-model-utils',
         'cryptography',
         'djcall',